@@ -7,7 +7,8 @@
 # This is run when there are no arguments
 if [ $# -eq 0 ] ; then
   echo "Running in persistent server mode"
-  python -u -m src.main
+  # exec replaces the shell, so the supervisor is PID 1 and receives SIGTERM directly
+  exec python -u -m src.main
 
 # Test mode
 elif [ "${1}" = "test" ] ; then
@@ -0,0 +1,81 @@
+"""
+Load every object in a set of workspaces into RE, using the document
+generators in src.generate_workspace_objs.
+
+Set KBASE_SECURE_CONFIG_PARAM_WRITER_BACKEND=arango to write directly to
+ArangoDB rather than through the RE API, for faster initial loads.
+
+With --incremental, each workspace's high-water mark is recorded after a
+complete, error-free run, and later runs only load newer objects.
+
+Only the workspaces in this node's shard are loaded (see src.utils.sharding),
+so the same backfill can be run on every node.
+
+Usage:
+    python -m src.backfill [--batch-size N] [--threads N] [--incremental] wsid [wsid ...]
+"""
+import argparse
+
+from src.generate_workspace_objs import generate_workspace_objs
+from src.utils.bulk_loader import BulkLoader
+from src.utils.config import get_config
+from src.utils.logger import log
+from src.utils.sharding import claim_workspaces
+from src.utils.watermarks import Watermark, WatermarkStore
+from src.utils.ws_info_cache import get_workspace_info
+
+
+def backfill(wsids, batch_size=10000, threads=4, incremental=False):
+    """
+    Generate and save the documents for the workspace IDs in a list that
+    belong to this node's shard, and are not leased by another job.
+    If `incremental` is set, only objects that are newer than the last
+    complete backfill of each workspace are loaded (see src.utils.watermarks).
+    Returns the number of documents saved per collection and the number of errors.
+    """
+    store = WatermarkStore(get_config()['watermark_path']) if incremental else None
+    counts = {}  # type: dict
+    errors = 0
+    for wsid in claim_workspaces(wsids):
+        watermark = None
+        if store is not None:
+            watermark = store.get(wsid) or Watermark()
+            log('INFO', f'Generating documents for workspace {wsid} since {watermark}..')
+        else:
+            log('INFO', f'Generating documents for workspace {wsid}..')
+        ws_errors = 0
+        loader = BulkLoader(batch_size=batch_size, threads=threads)
+        try:
+            for (result, err) in generate_workspace_objs(get_workspace_info(wsid), watermark):
+                if err:
+                    log('ERROR', f'Error generating documents for workspace {wsid}: {err}')
+                    ws_errors += 1
+                    continue
+                loader.add(*result)
+        finally:
+            for (coll, count) in loader.close().items():
+                counts[coll] = counts.get(coll, 0) + count
+        errors += ws_errors
+        if store is not None and not ws_errors:
+            # Everything up to the watermark has been saved, so later runs can start from there
+            store.set(wsid, watermark)
+    return (counts, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load all the objects in some workspaces into RE.')
+    parser.add_argument('wsids', nargs='+', type=int, help='workspace IDs')
+    parser.add_argument('--batch-size', type=int, default=10000, help='documents to save in each request')
+    parser.add_argument('--threads', type=int, default=4, help='max number of collections to load at once')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only load objects that are newer than the last complete backfill')
+    args = parser.parse_args()
+    (counts, errors) = backfill(args.wsids, batch_size=args.batch_size, threads=args.threads,
+                                incremental=args.incremental)
+    log('INFO', f'Saved {sum(counts.values())} documents: {counts}')
+    if errors:
+        log('ERROR', f'{errors} errors; see above.')
+
+
+if __name__ == '__main__':
+    main()
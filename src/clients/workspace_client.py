@@ -2,11 +2,14 @@
 Make API requests to the kbase workspace JSON RPC server.
 """
 import json
-import requests
 
 from src.utils.config import get_config
+from src.utils.http import get_session
+from src.utils.json_stream import iter_array
 
-_CONFIG = get_config()
+
+# Number of bytes to read at a time from a streamed response
+_STREAM_CHUNK_SIZE = 65536
 
 
 def download_info(wsid, objid, ver):
@@ -43,10 +46,54 @@ def admin_req(method, params):
     return _post_req(payload)
 
 
+def req_iter(method, params, path):
+    """
+    Make a JSON RPC request to the workspace server, yielding each entry of a
+    list nested in the result without loading the full response into memory.
+    `path` is relative to the first result, eg. ['data'] for get_objects2.
+    """
+    payload = {'version': '1.1', 'method': method, 'params': [params]}
+    return _post_req_iter(payload, path)
+
+
+def admin_req_iter(method, params, path):
+    """
+    Make a JSON RPC administration request, yielding each entry of a list
+    nested in the result. `path` is relative to the first result, eg. [] for
+    listObjects or ['data'] for getObjects.
+    """
+    payload = {
+        'version': '1.1',
+        'method': 'Workspace.administer',
+        'params': [{'command': method, 'params': params}]
+    }
+    return _post_req_iter(payload, path)
+
+
+def _post_req_iter(payload, path):
+    """Make a streaming post request to the workspace server and incrementally parse the response."""
+    config = get_config()
+    headers = {'Authorization': config['ws_token']}
+    resp = get_session().post(config['ws_url'], data=json.dumps(payload), headers=headers, stream=True,
+                              timeout=config['request_timeout'])
+    with resp:
+        if not resp.ok:
+            raise RuntimeError('Error response from workspace:\n%s' % resp.text)
+        # The JSON RPC spec requires UTF-8, so don't let requests guess the encoding
+        resp.encoding = 'utf-8'
+        chunks = resp.iter_content(chunk_size=_STREAM_CHUNK_SIZE, decode_unicode=True)
+        try:
+            yield from iter_array(chunks, ['result', 0] + path)
+        except ValueError as err:
+            raise RuntimeError(f'Invalid workspace response:\n{err}')
+
+
 def _post_req(payload):
     """Make a post request to the workspace server and process the response."""
-    headers = {'Authorization': _CONFIG['ws_token']}
-    resp = requests.post(_CONFIG['ws_url'], data=json.dumps(payload), headers=headers)
+    config = get_config()
+    headers = {'Authorization': config['ws_token']}
+    resp = get_session().post(config['ws_url'], data=json.dumps(payload), headers=headers,
+                              timeout=config['request_timeout'])
     if not resp.ok:
         raise RuntimeError('Error response from workspace:\n%s' % resp.text)
     resp_json = resp.json()
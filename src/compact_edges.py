@@ -0,0 +1,107 @@
+"""
+One-off tool to compact edge collections that were bloated by replays.
+
+Edges used to be saved without a `_key`, so every replay of an event added
+another copy of each edge. Edges now have deterministic keys (see
+src.utils.documents.edge_key). This tool rewrites every edge that does not
+yet have its deterministic key, keeping the most recently listed copy of each
+set of duplicates, and removes the others.
+
+Usage:
+    python -m src.compact_edges [--dry-run] [collection ...]
+"""
+import argparse
+import itertools
+
+from src.utils.documents import edge_key
+from src.utils.logger import log
+from src.utils.re_client import query_iter, save
+
+# Edge collections to compact when none are given on the command line
+_EDGE_COLLS = [
+    'wsfull_copied_from',
+    'wsfull_version_of',
+    'wsfull_ws_contains_obj',
+    'wsfull_obj_created_with_method',
+    'wsfull_obj_created_with_module',
+    'wsfull_obj_instance_of_type',
+    'wsfull_owner_of',
+    'wsfull_refers_to',
+    'wsfull_prov_descendant_of',
+    'wsprov_copied_into',
+    'wsprov_links',
+]
+# Fields, besides _from and _to, that are part of the deterministic key in some collections
+_KEY_FIELDS = {'wsprov_links': ['type']}
+# Number of edges to rewrite in each request
+_BATCH_SIZE = 1000
+
+_SCAN_QUERY = """
+FOR e IN @@coll
+    SORT e._from, e._to
+    RETURN e
+"""
+
+_REMOVE_QUERY = """
+FOR k IN @keys
+    REMOVE k IN @@coll OPTIONS {ignoreErrors: true}
+"""
+
+
+def compact(coll, dry_run=False):
+    """
+    Rewrite the edges in a collection with deterministic keys and remove duplicates.
+    Returns a dict of counts of the edges that were scanned, rewritten, and removed.
+    """
+    fields = _KEY_FIELDS.get(coll, [])
+    counts = {'scanned': 0, 'rewritten': 0, 'removed': 0}
+    to_save = []  # type: list
+    to_remove = []  # type: list
+    edges = query_iter(_SCAN_QUERY, {'@coll': coll})
+    for (_, same_vertices) in itertools.groupby(edges, key=lambda e: (e['_from'], e['_to'])):
+        groups = {}  # type: dict
+        for edge in same_vertices:
+            counts['scanned'] += 1
+            groups.setdefault(tuple(edge.get(f) for f in fields), []).append(edge)
+        for (vals, dupes) in groups.items():
+            key = edge_key(dupes[0]['_from'], dupes[0]['_to'], *vals)
+            old_keys = [e['_key'] for e in dupes if e['_key'] != key]
+            if not old_keys:
+                continue
+            doc = {k: v for (k, v) in dupes[-1].items() if k not in ('_id', '_rev')}
+            doc['_key'] = key
+            to_save.append(doc)
+            to_remove.extend(old_keys)
+            counts['rewritten'] += 1
+            counts['removed'] += len(old_keys)
+        if len(to_save) >= _BATCH_SIZE:
+            _apply(coll, to_save, to_remove, dry_run)
+            log('INFO', f'{coll}: {counts}')
+            (to_save, to_remove) = ([], [])
+    _apply(coll, to_save, to_remove, dry_run)
+    return counts
+
+
+def _apply(coll, to_save, to_remove, dry_run):
+    """Save edges under their deterministic keys, and only then remove the old copies."""
+    if dry_run or not to_save:
+        return
+    # Never spool these, as the old copies are removed as soon as this returns
+    save(coll, to_save, on_duplicate='replace', spool=False)
+    for idx in range(0, len(to_remove), _BATCH_SIZE):
+        list(query_iter(_REMOVE_QUERY, {'@coll': coll, 'keys': to_remove[idx:idx + _BATCH_SIZE]}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove duplicate edges left by replays.')
+    parser.add_argument('collections', nargs='*', default=_EDGE_COLLS, help='edge collections to compact')
+    parser.add_argument('--dry-run', action='store_true', help='only count the edges that would change')
+    args = parser.parse_args()
+    for coll in args.collections:
+        log('INFO', f'Compacting {coll}..')
+        counts = compact(coll, dry_run=args.dry_run)
+        log('INFO', f'Finished {coll}: {counts}')
+
+
+if __name__ == '__main__':
+    main()
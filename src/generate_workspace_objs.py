@@ -2,7 +2,10 @@
 Generate workspace objects along with provenance, copy, and reference edges.
 """
 from src.clients import workspace_client
-from src.utils.timestamp_to_epoch import timestamp_to_epoch
+from src.utils.config import get_config
+from src.utils.formatting import ts_to_epoch, epoch_to_ts
+from src.utils.documents import ObjectInfo, Edge
+
 
 _UPA_DELIMITER = ':'
 _METHOD_VERT_NAME = 'wsfull_method_version'
@@ -13,9 +16,11 @@ _COPY_EDGE_NAME = 'wsfull_copied_from'
 _REF_EDGE_NAME = 'wsfull_refers_to'
 _LINK_EDGE_NAME = 'wsprov_links'
 _COLL_NAMES = [_OBJ_VERT_NAME, _COPY_EDGE_NAME, _LINK_EDGE_NAME]
+# Max number of results the workspace returns for a single listObjects request
+_LIST_OBJECTS_LIMIT = 10000
 
 
-def generate_workspace_objs(ws_info):
+def generate_workspace_objs(ws_info, watermark=None):
     """
     Generate wsfull_object documents for each workspace, plus related edges
     (refs, copies, provenance).
@@ -26,91 +31,103 @@ def generate_workspace_objs(ws_info):
       https://kbase.us/services/ws/docs/Workspace.html#typedefWorkspace.workspace_info
     Args:
         ws_info - workspace_info tuple
+        watermark - optional Watermark (see src.utils.watermarks) from a
+          previous run. If given, only objects and versions newer than the
+          watermark are listed, and it is advanced past every object version
+          that is listed, so that the caller can record it once everything has
+          been saved without errors. Deleted objects are always listed in
+          full, as deleting an object does not change its save date.
     yields a pair of (result, error), one of which will be None
-      `result` will be a pair of (collection_name, docs)
+      `result` will be a pair of (collection_name, doc)
         where `collection_name` is the string name of the collection
-        and `docs` is a list of dictionaries of data to save
+        and `doc` is a dictionary of data to save, or an Edge (see
+        src.utils.documents.to_doc for serialization)
     """
-    # Fetch all non-deleted objects for the workspace
-    for (obj_infos, err) in _list_objects(ws_info, show_deleted=False):
-        print('NONDELETED', len(obj_infos))
-        print('')
+    # Keys of wsfull_method_version documents we have already generated
+    seen_methods = set()  # type: set
+    # Fetch all non-deleted objects for the workspace, a chunk at a time
+    for (obj_infos, err) in _list_new_objects(ws_info, watermark):
         if err:
             yield (None, err)
             continue
-        # Fetch object details for each obj_info
+        if watermark is not None:
+            for obj_info in obj_infos:
+                watermark.advance(obj_info)
+        # Fetch object details for each obj_info in the chunk
         (obj_details, err) = _get_object_details(ws_info, obj_infos)
         if err:
             yield (None, err)
             continue
         # Generate/yield every arango document/edge
-        for (coll, doc) in _create_obj_docs(ws_info, obj_details, deleted=False):
+        for (coll, doc) in _create_obj_docs(ws_info, obj_details, deleted=False, seen_methods=seen_methods):
             yield ((coll, doc), None)
     # Fetch deleted objects in each workspace
     # This is a more limited import. We just import one wsfull_object_version
     # per deleted object from the objec_info tuple. We cannot fetch deleted
     # objects using get_objects2.
-    for (obj_infos, err) in _list_objects(ws_info, show_deleted=True):
+    for (obj_infos, err) in list_objects(ws_info, show_deleted=True):
         if err:
             yield (None, err)
             continue
         for obj_info in obj_infos:
-            workspace_client.admin_req
             # Create a partial wsfull_object_version from the object_info alone.
             doc = _create_obj_doc(ws_info, obj_info, deleted=True)
             yield ((_OBJ_VERT_NAME, doc), None)
 
 
 def _create_obj_doc(ws_info, obj_info, deleted):
-    """Create an arango document for some object info."""
+    """Create an arango document for an ObjectInfo."""
     return {
-        '_key': _get_upa_from_obj_info(obj_info, delimiter=_UPA_DELIMITER),
-        'workspace_id': obj_info[6],
-        'object_id': obj_info[0],
-        'version': obj_info[4],
-        'name': obj_info[1],
-        'hash': obj_info[8],
-        'size': obj_info[9],
-        'epoch': timestamp_to_epoch(obj_info[3]),
+        '_key': obj_info.upa(_UPA_DELIMITER),
+        'workspace_id': obj_info.wsid,
+        'object_id': obj_info.objid,
+        'version': obj_info.version,
+        'name': obj_info.name,
+        'hash': obj_info.chsum,
+        'size': obj_info.size,
+        'epoch': ts_to_epoch(obj_info.save_date),
         'deleted': deleted,
         'is_public': ws_info[6] == 'r',
-        'ws_type': obj_info[2],
+        'ws_type': obj_info.type,
         'owner': ws_info[2]
     }
 
 
-def _create_obj_docs(ws_info, obj_details, deleted):
+def _create_obj_docs(ws_info, obj_details, deleted, seen_methods=None):
     """
     Yield object and object edge docs for every set of object data.
     Should throw and return no errors.
+    Edges are deduplicated per object, and each wsfull_method_version
+    document is only generated once per `seen_methods` set.
     yields pairs of (collection_name, doc)
     """
+    if seen_methods is None:
+        seen_methods = set()
     # metadata = ws_info[-1]  # last element is additional workspace metadata
     # 'narrative_nice_name' is often set but looks to not be required
     # narr_name = metadata.get('narrative_nice_name', '')
     # See here: https://kbase.us/services/ws/docs/Workspace.html#typedefWorkspace.permission
     for obj in obj_details:
-        obj_info = obj['info']
+        obj_info = ObjectInfo._make(obj['info'])
         doc = _create_obj_doc(ws_info, obj_info, deleted=False)
         yield (_OBJ_VERT_NAME, doc)
         ws_id = ws_info[0]
-        obj_db_key = _get_upa_from_obj_info(obj_info, delimiter=_UPA_DELIMITER)
-        obj_db_id = _OBJ_VERT_NAME + '/' + obj_db_key  # eg. "wsprov_object/1:2:3
+        # Extra edge fields that are the same for every edge from this workspace
+        ws_data = {'ws_id': ws_id}
+        obj_db_key = doc['_key']  # eg. "1:2:3"
+        # Keys of edges already generated for this object, for each collection
+        seen_edges = {}  # type: dict
         # Create copy edge, if present, using wsfull_copied_from
         if 'copied' in obj and not obj.get('copy_source_inaccessible'):
             copy_db_key = obj['copied'].replace('/', _UPA_DELIMITER)  # eg. "1:2:3"
-            to_obj_id = _OBJ_VERT_NAME + '/' + copy_db_key  # eg. "wsprov_object/1:2:3"
-            copy_doc = {'_from': obj_db_id, '_to': to_obj_id, 'workspace_id': ws_id}
-            yield (_COPY_EDGE_NAME, copy_doc)
+            copy_edge = Edge(_OBJ_VERT_NAME, obj_db_key, _OBJ_VERT_NAME, copy_db_key, {'workspace_id': ws_id})
+            yield (_COPY_EDGE_NAME, copy_edge)
         # For each reference, create edges (wsfull_refers_to)
         for ref_upa in obj.get('refs', []):
             ref_key = ref_upa.replace('/', _UPA_DELIMITER)
-            ref_doc = {
-                '_from': obj_db_id,
-                '_to': _OBJ_VERT_NAME + '/' + ref_key,
-                'ws_id': ws_id
-            }
-            yield (_REF_EDGE_NAME, ref_doc)
+            ref_edge = Edge(_OBJ_VERT_NAME, obj_db_key, _OBJ_VERT_NAME, ref_key, ws_data)
+            if _is_new_edge(seen_edges, _REF_EDGE_NAME, ref_edge):
+                yield (_REF_EDGE_NAME, ref_edge)
         # Create provenance edges for the object
         #  - Method to object with wsfull_object_created_with_method
         #  - Object to object with wsfull_prov_descendant_of
@@ -128,85 +145,146 @@ def _create_obj_docs(ws_info, obj_details, deleted):
             module_ver = prov.get('service_ver', 'UNKNOWN')
             method_name = prov.get('method', 'UNKNOWN')
             method_key = module_name + ':' + (commit or module_ver) + '.' + method_name
-            method_doc = {
-                    '_key': method_key,
-                    'module_name': module_name,
-                    'method_name': method_name,
-                    'commit': commit,
-                    'code_url': code_url,
-                    'module_ver': module_ver
-            }
-            yield (_METHOD_VERT_NAME, method_doc)
+            if method_key not in seen_methods:
+                seen_methods.add(method_key)
+                method_doc = {
+                        '_key': method_key,
+                        'module_name': module_name,
+                        'method_name': method_name,
+                        'commit': commit,
+                        'code_url': code_url,
+                        'module_ver': module_ver
+                }
+                yield (_METHOD_VERT_NAME, method_doc)
             # Create an edge from this object to the method (wsfull_object_output_from)
-            method_edge_doc = {
-                '_from': obj_db_id,
-                '_to': _METHOD_VERT_NAME + '/' + method_doc['_key'],
-                'method_params': prov.get('method_params')
-            }
-            yield (_METHOD_EDGE_NAME, method_edge_doc)
+            method_edge = Edge(
+                _OBJ_VERT_NAME, obj_db_key, _METHOD_VERT_NAME, method_key,
+                {'method_params': prov.get('method_params')}
+            )
+            if _is_new_edge(seen_edges, _METHOD_EDGE_NAME, method_edge):
+                yield (_METHOD_EDGE_NAME, method_edge)
             # Create an edge from this object to any input objects (wsfull_prov_descendant_of)
+            method_data = {_METHOD_VERT_NAME: method_key}
             for input_upa in prov.get('resolved_ws_objects', []):
                 input_key = input_upa.replace('/', _UPA_DELIMITER)
-                prov_edge_doc = {
-                    '_from': obj_db_id,
-                    '_to': _OBJ_VERT_NAME + '/' + input_key,
-                    _METHOD_VERT_NAME: method_doc['_key']
-                }
-                yield (_OBJ_PROV_EDGE_NAME, prov_edge_doc)
+                prov_edge = Edge(_OBJ_VERT_NAME, obj_db_key, _OBJ_VERT_NAME, input_key, method_data)
+                if _is_new_edge(seen_edges, _OBJ_PROV_EDGE_NAME, prov_edge):
+                    yield (_OBJ_PROV_EDGE_NAME, prov_edge)
+
+
+def _is_new_edge(seen_edges, coll, edge):
+    """Check whether an edge has not yet been seen for a collection, and mark it as seen."""
+    seen = seen_edges.setdefault(coll, set())
+    if edge.key in seen:
+        return False
+    seen.add(edge.key)
+    return True
 
 
 def _get_object_details(ws_info, obj_infos):
     """
-    Given workspace info, generate all the object data in that workspace (from 'get_objects2')
+    Given a chunk of object info tuples, fetch the object data (from 'getObjects')
     https://kbase.us/services/ws/docs/Workspace.html#typedefWorkspace.GetObjects2Params
-    yields pair of (result, err), one of which will be None
-        result will be a list of up to 10k object detail objects from get_objects2
+    The response is parsed incrementally; callers should keep `obj_infos` to at
+    most the configured 'ws_chunk_size' to bound memory use.
+    returns pair of (result, err), one of which will be None
+        result will be a list of object detail objects from getObjects
     """
     if not obj_infos:  # empty list
-        return
-    obj_upas = [_get_upa_from_obj_info(info) for info in obj_infos]
-    get_obj_params = [{'ref': upa} for upa in obj_upas]
+        return ([], None)
+    get_obj_params = [{'ref': info.upa()} for info in obj_infos]
     try:
-        obj_details = workspace_client.admin_req('getObjects', {
+        obj_details = list(workspace_client.admin_req_iter('getObjects', {
             'objects': get_obj_params,
             'no_data': '1'
-        })['data']
+        }, ['data']))
         return (obj_details, None)
     except Exception as err:
         return (None, err)
 
 
-def _get_upa_from_obj_info(obj_info, delimiter='/'):
+def _list_new_objects(ws_info, watermark):
     """
-    Get the upa, such as "1/2/3", from an obj_info tuple.
-    https://kbase.us/services/ws/docs/Workspace.html#typedefWorkspace.object_info
+    Generate chunks of object info tuples for the non-deleted objects in a
+    workspace, or only for those newer than a watermark, if one is given.
+    yields pair of (result, err), one of which will be None
     """
-    return delimiter.join([str(obj_info[6]), str(obj_info[0]), str(obj_info[4])])
+    if watermark is None or not watermark.max_epoch:
+        yield from list_objects(ws_info, show_deleted=False)
+        return
+    # Versions saved since the watermark, which includes new versions of old
+    # objects. Save dates only have a precision of a second, so go back one.
+    saved = list_objects(ws_info, show_deleted=False, after=epoch_to_ts(watermark.max_epoch - 1000))
+    # Objects created since the watermark, in case any have an older save date
+    created = list_objects(ws_info, show_deleted=False, min_obj_id=watermark.max_objid + 1)
+    listed = set()  # type: set
+    for source in (saved, created):
+        for (obj_infos, err) in source:
+            if err:
+                yield (None, err)
+                continue
+            new_infos = [info for info in obj_infos if info.upa() not in listed]
+            listed.update(info.upa() for info in new_infos)
+            if new_infos:
+                yield (new_infos, None)
 
 
-def _list_objects(ws_info, show_deleted, min_obj_id=1):
+def list_objects(ws_info, show_deleted, min_obj_id=1, after=None, max_obj_id=None):
     """
-    Generate object info tuples for a given workspace_info tuple
+    Generate chunks of object info tuples for a given workspace_info tuple
+    The listObjects response is parsed incrementally and re-chunked into lists
+    of at most the configured 'ws_chunk_size' tuples, so we never hold a full
+    10k-result page in memory.
     For workspaces with more than 10k objects, we have to do some page iteration
-    Warning: recursive
+    If `after` is a timestamp, only versions saved after it are listed.
+    If `max_obj_id` is given, only objects up to that ID (inclusive) are listed.
     yields pair of (result, err), one of which will be None
-        result is the object_info tuple for each object
+        result is a list of ObjectInfo tuples
     """
     ws_id = ws_info[0]
-    try:
-        obj_infos = workspace_client.admin_req('listObjects', {
+    chunk_size = get_config()['ws_chunk_size']
+    listed = set()  # type: set  # (objid, version) of the versions on the previous page that may be listed again
+    while True:
+        chunk = []  # type: list
+        page_len = 0
+        last_obj_id = None
+        last_versions = set()  # type: set  # versions of last_obj_id on this page
+        params = {
             'ids': [ws_id],
             'showDeleted': int(show_deleted),
             'showHidden': 1,
             'showAllVersions': 1,
             'minObjectID': min_obj_id
-        })
-        yield (obj_infos, None)
-    except Exception as err:
-        yield (None, err)
-        return
-    # Workspace API returns a max of 10k results. We can fetch the next page using the obj id
-    if len(obj_infos) >= 10000:
-        next_obj_id = obj_infos[-1][0] + 1
-        for info in _list_objects(ws_info, show_deleted, min_obj_id=next_obj_id):
-            yield info
+        }
+        if after:
+            params['after'] = after
+        if max_obj_id is not None:
+            params['maxObjectID'] = max_obj_id
+        try:
+            for obj_info in workspace_client.admin_req_iter('listObjects', params, []):
+                page_len += 1
+                if obj_info[0] != last_obj_id:
+                    (last_obj_id, last_versions) = (obj_info[0], set())
+                last_versions.add(obj_info[4])
+                if (obj_info[0], obj_info[4]) in listed:
+                    continue
+                chunk.append(ObjectInfo._make(obj_info))
+                if len(chunk) >= chunk_size:
+                    yield (chunk, None)
+                    chunk = []
+        except Exception as err:
+            yield (None, err)
+            return
+        if chunk:
+            yield (chunk, None)
+        # Workspace API returns a max of 10k results. We can fetch the next page using the obj id
+        if page_len < _LIST_OBJECTS_LIMIT:
+            return
+        if len(last_versions) == page_len:
+            # Every result was a version of one object, so starting from it again would not get any further
+            yield (None, RuntimeError(f'Object {ws_id}/{last_obj_id} has more than {_LIST_OBJECTS_LIMIT} '
+                                      'versions; only some of them were listed'))
+            (min_obj_id, listed) = (last_obj_id + 1, set())
+            continue
+        # The page may have ended part way through the last object's versions, so start from it again
+        (min_obj_id, listed) = (last_obj_id, {(last_obj_id, ver) for ver in last_versions})
@@ -1,6 +1,10 @@
 import json
 
 from src.clients import workspace_client
+from src.generate_workspace_objs import list_objects
+from src.utils.documents import ObjectInfo, edge_key
+from src.utils.ws_info_cache import get_workspace_info
+
 
 _OBJ_VERT_NAME = 'wsprov_object'
 _COPY_EDGE_NAME = 'wsprov_copied_into'
@@ -15,32 +19,36 @@ def generate_wsprov_data(wsid, min_obj_id, max_obj_id, files):
     Args:
         wsid - workspace id integer
         min_obj_id - minimum object id to start importing (integer)
+        max_obj_id - maximum object id to import (integer, inclusive)
         files - dictionary where keys are collection names and values are opened file descriptors
             files should be oppened in APPEND mode
     """
     # Get the workspace info
-    ws_info = workspace_client.admin_req('getWorkspaceInfo', {'id': wsid})
+    ws_info = get_workspace_info(wsid)
     print('Fetched workspace info:', ws_info)
     is_public = ws_info[6] == 'r'
     metadata = ws_info[-1]
     narr_name = metadata.get('narrative_nice_name')
     owner = ws_info[2]
-    # Fetch all the objects for the workspace
-    obj_infos = workspace_client.admin_req('listObjects', {
-        'ids': [wsid],
-        'showAllVersions': 1,
-        'minObjectID': min_obj_id,
-        'maxObjectID': max_obj_id
-    })
-    print(f'Fetched {len(obj_infos)} object infos.')
-    obj_upas = [_get_upa_from_obj_info(info) for info in obj_infos[0:1000]]
-    get_obj_params = [{'ref': upa} for upa in obj_upas]
+    # Stream all the objects for the workspace and fetch their details a chunk at a time
+    count = 0
+    for (chunk, err) in list_objects(ws_info, show_deleted=False, min_obj_id=min_obj_id, max_obj_id=max_obj_id):
+        if err is not None:
+            print('Error listing objects:', err)
+            continue
+        count += len(chunk)
+        _write_obj_data(chunk, wsid, is_public, narr_name, owner, files)
+    print(f'Wrote data for {count} objects.')
+
+
+def _write_obj_data(obj_infos, wsid, is_public, narr_name, owner, files):
+    """Fetch object data for a chunk of object info tuples and write a document for each."""
+    get_obj_params = [{'ref': ObjectInfo._make(info).upa()} for info in obj_infos]
     print(f'Fetching with get_objects2 on {len(get_obj_params)} objects.')
-    obj_data = workspace_client.req('get_objects2', {'objects': get_obj_params, 'no_data': '1'})['data']
-    print(f'Fetched {len(obj_data)} object data.')
+    obj_data = workspace_client.req_iter('get_objects2', {'objects': get_obj_params, 'no_data': '1'}, ['data'])
     for obj in obj_data:
-        obj_info = obj['info']
-        obj_db_key = _get_upa_from_obj_info(obj_info, delimiter=_UPA_DELIMITER)
+        obj_info = ObjectInfo._make(obj['info'])
+        obj_db_key = obj_info.upa(_UPA_DELIMITER)
         obj_db_id = _OBJ_VERT_NAME + '/' + obj_db_key  # eg. "wsprov_object/1:2:3
         # Write the wsprov_object
         files[_OBJ_VERT_NAME].write(json.dumps({
@@ -49,24 +57,30 @@ def generate_wsprov_data(wsid, min_obj_id, max_obj_id, files):
             'deleted': False,  # TODO get this info -- I don't see it in object_info or ObjectData
             'narr_name': narr_name,
             'workspace_id': wsid,
-            'ws_type': obj_info[2],  # eg. "KBaseGenome.ContigSet"
-            'save_date': obj_info[3],  # timestamp
-            'checksum': obj_info[8],  # md5 hash
+            'ws_type': obj_info.type,  # eg. "KBaseGenome.ContigSet"
+            'save_date': obj_info.save_date,  # timestamp
+            'checksum': obj_info.chsum,  # md5 hash
             'owner': owner,  # username
-            'obj_name': obj_info[1]  # arbitrary string
+            'obj_name': obj_info.name  # arbitrary string
         }) + '\n')
         # Check if this object was copied (if so, create a copy edge)
         if 'copied' in obj and not obj.get('copy_source_inaccessible'):
             copy_db_key = obj['copied'].replace('/', _UPA_DELIMITER)  # eg. "1:2:3"
             from_obj_id = _OBJ_VERT_NAME + '/' + copy_db_key  # eg. "wsprov_object/1:2:3"
-            copy_doc = {'_from': from_obj_id, '_to': obj_db_id, 'workspace_id': wsid}
+            copy_doc = {
+                '_key': edge_key(from_obj_id, obj_db_id),
+                '_from': from_obj_id,
+                '_to': obj_db_id,
+                'workspace_id': wsid
+            }
             files[_COPY_EDGE_NAME].write(json.dumps(copy_doc) + '\n')
         # Create edges for every provenance action
         for prov in obj['provenance']:
             for input_upa in prov.get('resolved_ws_objects', []):
-                input_key = input_upa.replace('/', _UPA_DELIMITER)
+                input_id = _OBJ_VERT_NAME + '/' + input_upa.replace('/', _UPA_DELIMITER)
                 link_doc = {
-                    '_from': _OBJ_VERT_NAME + '/' + input_key,
+                    '_key': edge_key(input_id, obj_db_id, 'provenance'),
+                    '_from': input_id,
                     '_to': obj_db_id,
                     'type': 'provenance',
                     'service': prov.get('service'),
@@ -78,19 +92,12 @@ def generate_wsprov_data(wsid, min_obj_id, max_obj_id, files):
                 files[_LINK_EDGE_NAME].write(json.dumps(link_doc) + '\n')
         # For each reference in this object, create an object link edge
         for ref_upa in obj.get('refs', []):
-            ref_key = ref_upa.replace('/', _UPA_DELIMITER)
+            ref_id = _OBJ_VERT_NAME + '/' + ref_upa.replace('/', _UPA_DELIMITER)
             link_doc = {
+                '_key': edge_key(obj_db_id, ref_id, 'reference'),
                 '_from': obj_db_id,
-                '_to': _OBJ_VERT_NAME + '/' + ref_key,
+                '_to': ref_id,
                 'ws_id': wsid,
                 'type': 'reference'
             }
             files[_LINK_EDGE_NAME].write(json.dumps(link_doc) + '\n')
-
-
-def _get_upa_from_obj_info(obj_info, delimiter='/'):
-    """
-    Get the upa, such as "1/2/3", from an obj_info tuple.
-    https://kbase.us/services/ws/docs/Workspace.html#typedefWorkspace.object_info
-    """
-    return delimiter.join([str(obj_info[6]), str(obj_info[0]), str(obj_info[4])])
@@ -1,63 +1,290 @@
 """
 Consume workspace update events from kafka.
 """
+import functools
 import json
+import signal
+import threading
+import time
 import traceback
-from confluent_kafka import Consumer, KafkaError
+from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
 
+from src.utils import trace
 from src.utils.logger import log
 from src.utils.config import get_config
-from src.utils.workspace_client import download_info
-from src.utils.re_client import check_doc_existence
+from src.utils.workspace_client import download_infos
+from src.utils.coalesce import coalesce
+from src.utils.ledger import Ledger
+from src.utils.ws_info_cache import invalidate_workspace_info
+from src.utils.re_client import UNAVAILABLE_ERRORS, check_doc_existence
+from src.utils.doc_batch import DocBatch
 from src.import_object import import_object
 
-_CONFIG = get_config()
-
-
-def run():
-    """Run the main event loop, ie. the Kafka Consumer, dispatching to self._handle_message."""
-    topics = [
-        _CONFIG['kafka_topics']['workspace_events'],
-        _CONFIG['kafka_topics']['re_admin_events']
-    ]
-    log('INFO', f"Subscribing to: {topics}")
-    log('INFO', f"Client group: {_CONFIG['kafka_clientgroup']}")
-    log('INFO', f"Kafka server: {_CONFIG['kafka_server']}")
-    consumer = Consumer({
-        'bootstrap.servers': _CONFIG['kafka_server'],
-        'group.id': _CONFIG['kafka_clientgroup'],
-        'auto.offset.reset': 'earliest',
-        'enable.auto.commit': True
-    })
-    consumer.subscribe(topics)
-    while True:
-        msg = consumer.poll(timeout=0.5)
-        if msg is None:
-            continue
-        if msg.error():
-            if msg.error().code() == KafkaError._PARTITION_EOF:
-                log('INFO', 'End of stream.')
-            else:
-                log('ERROR', f"Kafka message error: {msg.error()}")
-            continue
-        val = msg.value().decode('utf-8')
+# Set when we receive a SIGTERM and should stop polling for new messages
+_SHUTDOWN = threading.Event()
+
+# Config key of the topic consumed by each lane. Each lane has its own
+# consumers, so a flood of admin events cannot delay live workspace events.
+_LANE_TOPICS = {'live': 'workspace_events', 'admin': 're_admin_events'}
+
+# Events for which we skip object versions that the ledger says were already imported
+_LEDGER_EVENTS = {'IMPORT', 'NEW_VERSION', 'IMPORT_NONEXISTENT'}
+
+# Partitions currently assigned to this consumer, as (topic, partition) pairs. With
+# cooperative rebalancing, assign and revoke callbacks only receive the changes.
+_OWNED = set()  # type: set
+
+
+def run(lane='live', pause_event=None, worker_idx=0, consumer_factory=Consumer):
+    """
+    Run the main event loop, ie. the Kafka Consumer, dispatching to self._handle_message.
+    `lane` is 'live' to consume workspace events or 'admin' to consume RE admin
+    events; see _LANE_TOPICS. While `pause_event` (a multiprocessing.Event) is
+    set, all of our partitions are paused. `worker_idx` is this worker's index
+    within the supervisor's WorkerGroup, and is used to derive a stable static
+    group membership ID. `consumer_factory` creates the consumer from its
+    configuration, such as a fake consumer in tests.
+    """
+    config = get_config()
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    # Start or stop a cProfile profile on demand
+    signal.signal(signal.SIGUSR1, trace.toggle_profile)
+    topics = [config['kafka_topics'][_LANE_TOPICS[lane]]]
+    # Events per second to limit ourselves to, or 0 for no limit
+    rate_limit = config['admin_rate_limit'] if lane == 'admin' else 0
+    log('INFO', f"Subscribing to: {topics} ({lane} lane)")
+    log('INFO', f"Client group: {config['kafka_clientgroup']}")
+    log('INFO', f"Kafka server: {config['kafka_server']}")
+    consumer = consumer_factory(_consumer_config(lane, worker_idx))
+    consumer.subscribe(topics, on_assign=_on_assign, on_revoke=_on_revoke, on_lost=_on_lost)
+    paused = False
+    ready_at = time.time()  # when the rate limit allows us to handle more events
+    while not _SHUTDOWN.is_set():
+        if pause_event is not None:
+            paused = _set_paused(consumer, pause_event.is_set(), paused)
+        # Read a batch of messages so that redundant events can be coalesced
+        kafka_msgs = consumer.consume(
+            num_messages=config['coalesce_batch_size'],
+            timeout=config['coalesce_window']
+        )
+        received = []
+        msgs = []
+        for kafka_msg in kafka_msgs:
+            if kafka_msg.error():
+                if kafka_msg.error().code() == KafkaError._PARTITION_EOF:
+                    log('INFO', 'End of stream.')
+                else:
+                    log('ERROR', f"Kafka message error: {kafka_msg.error()}")
+                continue
+            received.append(kafka_msg)
+            val = kafka_msg.value().decode('utf-8')
+            try:
+                msg = json.loads(val)
+                log('INFO', f'New message: {msg}')
+                msgs.append(msg)
+            except Exception as err:
+                _log_error(err, val)
+        coalesced = coalesce(msgs)
+        if len(coalesced) < len(msgs):
+            log('INFO', f'Coalesced {len(msgs)} events into {len(coalesced)}')
+        if coalesced:
+            try:
+                with trace.collect():
+                    _handle_batch(coalesced)
+            except UNAVAILABLE_ERRORS as err:
+                # Nothing is lost: read the same events again once RE is back
+                log('ERROR', f"{err}; retrying {len(received)} events in {config['unavailable_retry_interval']}s")
+                _rewind(consumer, received)
+                _SHUTDOWN.wait(config['unavailable_retry_interval'])
+                continue
+        for kafka_msg in received:
+            consumer.store_offsets(message=kafka_msg)
+        if rate_limit and coalesced:
+            ready_at = max(ready_at, time.time()) + len(coalesced) / rate_limit
+            _SHUTDOWN.wait(ready_at - time.time())
+    _close(consumer)
+
+
+def _handle_batch(msgs):
+    """
+    Handle a list of events, saving the documents for all of them together.
+    If they cannot all be saved, each event is handled again on its own, so
+    that only the events whose documents are rejected fail.
+    Returns the number of events that failed. Raises one of
+    re_client.UNAVAILABLE_ERRORS if RE is unavailable, in which case the
+    events should be retried.
+    """
+    batch = DocBatch()
+    errors = 0
+    for msg in msgs:
+        try:
+            with trace.event(msg):
+                _handle_msg(msg, batch)
+        except UNAVAILABLE_ERRORS:
+            raise
+        except Exception as err:
+            _log_error(err, msg)
+            errors += 1
+    try:
+        batch.flush()
+    except UNAVAILABLE_ERRORS:
+        raise
+    except Exception as err:
+        log('ERROR', f'Unable to save the documents for {len(msgs)} events together ({err}); '
+                     'saving them one event at a time')
+        return _handle_each(msgs)
+    return errors
+
+
+def _handle_each(msgs):
+    """
+    Handle and save each of a list of events on its own, after saving them
+    together failed. Returns the number of events that failed.
+    """
+    errors = 0
+    for msg in msgs:
         try:
-            msg = json.loads(val)
-            log('INFO', f'New message: {msg}')
-            _handle_msg(msg)
+            with trace.event(msg):
+                # Some of the documents may have been saved, so they cannot be used to skip any versions
+                _handle_msg({**msg, 'force': True})
+        except UNAVAILABLE_ERRORS:
+            raise
         except Exception as err:
-            log('ERROR', '=' * 80)
-            log('ERROR', f"Error importing:\n{type(err)} - {err}")
-            log('ERROR', msg)
-            log('ERROR', err)
-            # Prints to stderr
-            traceback.print_exc()
-            log('ERROR', '=' * 80)
+            _log_error(err, msg)
+            errors += 1
+    return errors
+
+
+def _rewind(consumer, kafka_msgs):
+    """Seek back to the first of a list of messages in each partition, so that they are read again."""
+    starts = {}  # type: dict
+    for kafka_msg in kafka_msgs:
+        tp = (kafka_msg.topic(), kafka_msg.partition())
+        starts[tp] = min(starts.get(tp, kafka_msg.offset()), kafka_msg.offset())
+    for ((topic, partition), offset) in starts.items():
+        consumer.seek(TopicPartition(topic, partition, offset))
+
+
+def _set_paused(consumer, pause, paused):
+    """
+    Pause or resume all of a consumer's assigned partitions, given whether we
+    want to be paused and whether we already are. Returns the new paused state.
+    """
+    partitions = consumer.assignment()
+    if pause:
+        # Partitions assigned since we paused are not paused yet, so this is repeated
+        consumer.pause(partitions)
+        if not paused:
+            log('INFO', f'Pausing partitions: {_format_partitions(partitions)}')
+    elif paused:
+        log('INFO', f'Resuming partitions: {_format_partitions(partitions)}')
+        consumer.resume(partitions)
+    return pause
+
+
+def _log_error(err, msg):
+    """Log an error from handling a message, with its traceback."""
+    log('ERROR', '=' * 80)
+    log('ERROR', f"Error importing:\n{type(err)} - {err}")
+    log('ERROR', msg)
+    log('ERROR', err)
+    # Prints to stderr
+    traceback.print_exc()
+    log('ERROR', '=' * 80)
+
+
+def _consumer_config(lane, worker_idx):
+    """Get the confluent_kafka Consumer configuration for a worker in a lane."""
+    config = get_config()
+    conf = {
+        'bootstrap.servers': config['kafka_server'],
+        'group.id': config['kafka_clientgroup'],
+        'auto.offset.reset': 'earliest',
+        'enable.auto.commit': True,
+        # Offsets are stored only once a message has been handled, so that
+        # in-flight messages are not committed if we stop part way through.
+        'enable.auto.offset.store': False,
+        'partition.assignment.strategy': config['kafka_assignment_strategy'],
+        'session.timeout.ms': int(config['kafka_session_timeout'] * 1000)
+    }
+    if config['kafka_instance_id_prefix']:
+        # Static membership: a restarted worker rejoins with the same ID within
+        # the session timeout and gets its old partitions back without a rebalance.
+        if lane == 'live':
+            instance_id = f"{config['kafka_instance_id_prefix']}-{worker_idx}"
+        else:
+            instance_id = f"{config['kafka_instance_id_prefix']}-{lane}-{worker_idx}"
+        log('INFO', f"Group instance ID: {instance_id}")
+        conf['group.instance.id'] = instance_id
+    return conf
+
+
+def _on_assign(consumer, partitions):
+    log('INFO', f"Assigned partitions: {_format_partitions(partitions)}")
+    _OWNED.update((tp.topic, tp.partition) for tp in partitions)
+    _log_ownership()
+
+
+def _on_revoke(consumer, partitions):
+    """Commit the offsets of all handled messages before we lose any partitions."""
+    log('INFO', f"Revoking partitions: {_format_partitions(partitions)}")
+    _commit(consumer)
+    _OWNED.difference_update((tp.topic, tp.partition) for tp in partitions)
+    _log_ownership()
+
+
+def _on_lost(consumer, partitions):
+    """Partitions were lost without a clean revoke; another member may already own them."""
+    log('ERROR', f"Lost partitions: {_format_partitions(partitions)}")
+    _OWNED.difference_update((tp.topic, tp.partition) for tp in partitions)
+    _log_ownership()
+
+
+def _log_ownership():
+    """Log the partitions this consumer now owns, so each node's share of the topic can be seen."""
+    config = get_config()
+    owned = ', '.join(f'{topic}[{partition}]' for (topic, partition) in sorted(_OWNED))
+    log('INFO', f"Node {config['node_index']} of {config['node_count']} consumer now owns "
+                f"{len(_OWNED)} partitions: {owned}")
+
+
+def _format_partitions(partitions):
+    return ', '.join(f'{tp.topic}[{tp.partition}]' for tp in partitions)
+
+
+def _handle_sigterm(signum, frame):
+    """
+    Stop polling after the current message is finished. If we have not exited
+    within the shutdown timeout, the default SIGALRM action terminates us.
+    """
+    log('INFO', 'Received SIGTERM; finishing in-flight work and shutting down..')
+    _SHUTDOWN.set()
+    signal.alarm(max(int(get_config()['shutdown_timeout']), 1))
+
+
+def _close(consumer):
+    """Commit the offsets of all handled messages and leave the consumer group."""
+    _commit(consumer)
     consumer.close()
+    log('INFO', 'Consumer closed.')
+
+
+def _commit(consumer):
+    """Synchronously commit the offsets of all handled messages."""
+    try:
+        consumer.commit(asynchronous=False)
+    except KafkaException as err:
+        # _NO_OFFSET means there was nothing new to commit
+        if err.args[0].code() != KafkaError._NO_OFFSET:
+            log('ERROR', f'Error committing offsets: {err}')
 
 
-def _handle_msg(msg):
-    """Receive a kafka message."""
+def _handle_msg(msg, batch=None):
+    """
+    Receive a kafka message.
+    If a DocBatch is given, imported documents are added to it and the caller
+    must flush it; otherwise they are saved before returning.
+    """
     event_type = msg.get('evtype')
     wsid = msg.get('wsid')
     if not wsid:
@@ -65,10 +292,13 @@ def _handle_msg(msg):
     if not event_type:
         raise RuntimeError(f"Missing 'evtype' in event: {msg}")
     log('INFO', f'Received {msg["evtype"]} for {wsid}/{msg.get("objid", "?")}')
+    if event_type in ['SET_GLOBAL_PERMISSION', 'WORKSPACE_DELETE_STATE_CHANGE']:
+        # These change the workspace info, so any cached copy is stale
+        invalidate_workspace_info(wsid)
     if event_type in ['IMPORT', 'NEW_VERSION', 'COPY_OBJECT', 'RENAME_OBJECT']:
-        _import_obj(msg)
+        _import_obj(msg, batch)
     elif event_type == 'IMPORT_NONEXISTENT':
-        _import_nonexistent(msg)
+        _import_nonexistent(msg, batch)
     elif event_type == 'OBJECT_DELETE_STATE_CHANGE':
         _delete_obj(msg)
     elif event_type == 'WORKSPACE_DELETE_STATE_CHANGE':
@@ -81,20 +311,82 @@ def _handle_msg(msg):
         raise RuntimeError(f"Unrecognized event {event_type}.")
 
 
-def _import_obj(msg):
-    log('INFO', 'Downloading obj')
-    obj_info = download_info(msg['wsid'], msg['objid'], msg.get('ver'))
-    import_object(obj_info)
+def _import_obj(msg, batch=None):
+    """
+    Import one or more versions of an object. Coalesced events have a list of
+    versions in 'vers', which are all fetched in one request.
+    """
+    ledger = _get_ledger()
+    vers = _get_vers(msg)
+    if ledger and msg['evtype'] in _LEDGER_EVENTS and not msg.get('force'):
+        # Versions are immutable, so skip any we have imported before, unless
+        # the event was queued by src/reconcile.py because RE is missing them
+        vers = [v for v in vers if v is None or not ledger.contains(_get_upa(msg, v))]
+        if not vers:
+            log('INFO', 'All versions already imported.')
+            return
+    log('INFO', f'Downloading obj versions {vers}')
+    flush = batch is None
+    if batch is None:
+        batch = DocBatch()
+    imported = set()
+    for obj_info in download_infos(msg['wsid'], msg['objid'], vers):
+        # A latest-version (None) request may resolve to a version that was also requested explicitly
+        upa = ':'.join(str(obj_info['info'][i]) for i in (6, 0, 4))
+        if upa in imported:
+            continue
+        imported.add(upa)
+        import_object(obj_info, batch)
+        if ledger:
+            # Only record the version once its documents have been saved
+            batch.on_flush(functools.partial(ledger.add, upa))
+    if flush:
+        batch.flush()
+
+
+def _import_nonexistent(msg, batch=None):
+    """Import object versions only if they do not exist in RE already, unless the event is forced."""
+    if msg.get('force'):
+        _import_obj(msg, batch)
+        return
+    ledger = _get_ledger()
+    missing = []
+    for ver in _get_vers(msg):
+        upa = _get_upa(msg, ver)
+        log('INFO', f'_import_nonexistent on {upa}')  # TODO
+        if ledger and ledger.contains(upa):
+            continue
+        _id = 'wsfull_object_version/' + upa
+        if not check_doc_existence(_id):
+            missing.append(ver)
+        elif ledger:
+            ledger.add(upa)
+    if missing:
+        _import_obj({**msg, 'vers': missing}, batch)
+
+
+def _get_upa(msg, ver):
+    """Get the RE key for an object version, such as '1:2:3'."""
+    return ':'.join([str(p) for p in [msg['wsid'], msg['objid'], ver]])
+
+
+@functools.lru_cache(maxsize=1)
+def _get_ledger():
+    """
+    Open the ledger of imported object versions, if one is configured.
+    This is opened lazily so that each worker process gets its own connection.
+    """
+    config = get_config()
+    if not config['ledger_path']:
+        return None
+    return Ledger(config['ledger_path'], bloom_bits=config['ledger_bloom_bits'])
 
 
-def _import_nonexistent(msg):
-    """Import an object only if it does not exist in RE already."""
-    upa = ':'.join([str(p) for p in [msg['wsid'], msg['objid'], msg['ver']]])
-    log('INFO', f'_import_nonexistent on {upa}')  # TODO
-    _id = 'wsfull_object_version/' + upa
-    exists = check_doc_existence(_id)
-    if not exists:
-        _import_obj(msg)
+def _get_vers(msg):
+    """Get the list of versions for an event, which may have been coalesced."""
+    if 'vers' in msg:
+        return msg['vers']
+    return [msg.get('ver')]
 
 
 def _delete_obj(msg):
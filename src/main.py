@@ -2,28 +2,115 @@
 This is the entrypoint for running the app. A parent supervisor process that
 launches and monitors child processes and threads.
 """
+import signal
+import threading
 import time
 
-from src.utils.worker_group import WorkerGroup
+from src.utils.worker_group import WorkerGroup, get_context
+from src.utils.autoscaler import Autoscaler
 from src.utils.config import get_config
 from src.utils.wait_for_services import wait_for_services
 from src.utils.logger import log
 from src import kafka_consumer
 
-_CONFIG = get_config()
+# Set when the supervisor receives a SIGTERM
+_SHUTDOWN = threading.Event()
 
 
 def main():
     """
     Starts all subprocesses with ongoing healthchecks.
-    Number of subprocesses can be configured with the env var 'KBASE_SECURE_CONFIG_PARAM_NUM_CONSUMERS'
+    Live workspace events and RE admin events are consumed by separate groups
+    of processes (lanes). The number of live consumers is scaled between
+    'KBASE_SECURE_CONFIG_PARAM_MIN_CONSUMERS' and 'KBASE_SECURE_CONFIG_PARAM_NUM_CONSUMERS'
+    based on the consumer group lag, and the admin lane is paused while the
+    live lag is above 'KBASE_SECURE_CONFIG_PARAM_ADMIN_PAUSE_LAG'.
+    Several supervisors (nodes) can share the consumer group; each one runs
+    at most its share of the partitions' worth of live consumers.
     """
+    config = get_config()
+    signal.signal(signal.SIGTERM, lambda signum, frame: _SHUTDOWN.set())
+    # Pass on requests to profile the workers (see src/utils/trace.py). Installed before anything
+    # else, since SIGUSR1 would otherwise kill the supervisor while it waits for services.
+    groups = []  # type: list
+    signal.signal(signal.SIGUSR1, _forward_signal(groups))
+    log('INFO', f"Starting node {config['node_index']} of {config['node_count']}")
     wait_for_services()
-    consumers = WorkerGroup(target=kafka_consumer.run, args=(), count=_CONFIG['num_consumers'])  # type: ignore
-    while True:
+    min_count = min(config['min_consumers'], config['num_consumers'])
+    # Workers are forked from a server that has already imported the consumer and its dependencies
+    context = get_context(preload=['src.kafka_consumer'])
+    # Set while the admin lane should be paused
+    admin_paused = context.Event()
+    live_consumers = WorkerGroup(
+        target=kafka_consumer.run,
+        args=('live', None),
+        count=min_count,
+        backoff_max=config['restart_backoff_max'],
+        crash_loop_count=config['crash_loop_count'],
+        context=context
+    )
+    admin_consumers = WorkerGroup(
+        target=kafka_consumer.run,
+        args=('admin', admin_paused),
+        count=config['num_admin_consumers'],
+        backoff_max=config['restart_backoff_max'],
+        crash_loop_count=config['crash_loop_count'],
+        context=context
+    )
+    # Tracks the lag of the live lane, for both autoscaling and pausing the admin lane
+    live_lag = Autoscaler(
+        kafka_server=config['kafka_server'],
+        group_id=config['kafka_clientgroup'],
+        topics=[config['kafka_topics']['workspace_events']],
+        min_count=min_count,
+        max_count=config['num_consumers'],
+        target_drain_secs=config['autoscale_target_drain'],
+        node_count=config['node_count']
+    )
+    groups.extend([live_consumers, admin_consumers])
+    autoscale = min_count < config['num_consumers']
+    next_scale = time.time()
+    while not _SHUTDOWN.is_set():
         # Monitor processes/threads and restart any that have crashed
-        consumers.health_check()
-        time.sleep(5)
+        live_consumers.health_check()
+        admin_consumers.health_check()
+        lag = live_lag.update()
+        if lag is not None and config['admin_pause_lag']:
+            _pause_admin_lane(admin_paused, lag)
+        if autoscale and time.time() >= next_scale:
+            live_consumers.scale(live_lag.desired_count(live_consumers.count))
+            next_scale = time.time() + config['autoscale_interval']
+        _SHUTDOWN.wait(5)
+    # Give consumers time to finish in-flight work, commit, and leave the group
+    log('INFO', 'Received SIGTERM; stopping consumers..')
+    deadline = time.time() + config['shutdown_timeout'] + 1
+    for group in (live_consumers, admin_consumers):
+        group.terminate()
+    for group in (live_consumers, admin_consumers):
+        group.join(deadline)
+    log('INFO', 'All consumers stopped.')
+
+
+def _forward_signal(groups):
+    """Get a signal handler that sends the signal on to every worker in a list of WorkerGroups."""
+    def handler(signum, frame):
+        for group in groups:
+            group.send_signal(signum)
+    return handler
+
+
+def _pause_admin_lane(admin_paused, live_lag):
+    """
+    Pause the admin lane when the live lag passes the threshold, and resume it
+    once the live lag drops to half of the threshold.
+    """
+    threshold = get_config()['admin_pause_lag']
+    if live_lag > threshold and not admin_paused.is_set():
+        log('INFO', f'Live lag is {live_lag}; pausing the admin lane.')
+        admin_paused.set()
+    elif live_lag <= threshold / 2 and admin_paused.is_set():
+        log('INFO', f'Live lag is {live_lag}; resuming the admin lane.')
+        admin_paused.clear()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,139 @@
+"""
+Find object versions that are missing or stale in RE, and queue them for import.
+
+For each workspace in a range, we stream the workspace's object versions from
+listObjects alongside a single RE query for the keys and hashes of its
+wsfull_object_version documents, and compare them with a hash set. A version is
+missing if RE has no document for it, and stale if the document has a
+different hash or is marked as deleted. Only those versions are queued, as
+IMPORT events on the RE admin events topic, so repairing the gaps left by
+dropped events costs a fraction of a full backfill.
+
+The events are marked with 'force', so that consumers import them even if
+their local ledger says they were imported already.
+
+Only the workspaces in this node's shard are checked (see src.utils.sharding),
+so the same range can be reconciled from every node.
+
+Usage:
+    python -m src.reconcile [--dry-run] <min wsid> <max wsid>
+"""
+import argparse
+import json
+from confluent_kafka import Producer
+
+from src.generate_workspace_objs import list_objects
+from src.utils.config import get_config
+from src.utils.logger import log
+from src.utils.re_client import query_iter
+from src.utils.sharding import claim_workspaces
+from src.utils.ws_info_cache import get_workspace_info
+
+
+_VERSIONS_QUERY = """
+FOR v IN wsfull_object_version
+    FILTER v.workspace_id == @wsid
+    RETURN [v._key, v.hash, v.deleted]
+"""
+
+
+def reconcile(min_wsid, max_wsid, dry_run=False):
+    """
+    Queue imports for the missing and stale object versions in a range of
+    workspace IDs (inclusive), skipping workspaces outside this node's shard.
+    Returns a dict of counts.
+    """
+    counts = {'workspaces': 0, 'versions': 0, 'missing': 0, 'stale': 0, 'errors': 0}
+    producer = None if dry_run else Producer({'bootstrap.servers': get_config()['kafka_server']})
+    for wsid in claim_workspaces(range(min_wsid, max_wsid + 1)):
+        try:
+            ws_info = get_workspace_info(wsid)
+        except Exception as err:
+            # Workspace IDs in the range may have been deleted, or never used
+            log('INFO', f'Skipping workspace {wsid}: {err}')
+            continue
+        counts['workspaces'] += 1
+        for (obj_infos, err) in _diff_workspace(ws_info, counts):
+            if err:
+                log('ERROR', f'Error reconciling workspace {wsid}: {err}')
+                counts['errors'] += 1
+                continue
+            for (info, reason) in obj_infos:
+                counts[reason] += 1
+                log('INFO', f'{info.upa()} is {reason}')
+                if producer is not None:
+                    _queue_import(producer, info)
+        log('INFO', f'Reconciled workspace {wsid}; totals so far: {counts}')
+    if producer is not None:
+        producer.flush()
+    return counts
+
+
+def diff_versions(obj_infos, re_versions):
+    """
+    Compare a list of ObjectInfo tuples from the workspace against a dict of
+    wsfull_object_version key to (hash, deleted) from RE. Returns a list of
+    pairs of (ObjectInfo, reason) where reason is 'missing' or 'stale'.
+    """
+    out = []
+    for info in obj_infos:
+        existing = re_versions.get(info.upa(':'))
+        if existing is None:
+            out.append((info, 'missing'))
+        elif existing[0] != info.chsum or existing[1]:
+            out.append((info, 'stale'))
+    return out
+
+
+def _diff_workspace(ws_info, counts):
+    """
+    Yield pairs of (result, err) for chunks of a workspace's object versions,
+    where `result` is the output of diff_versions.
+    """
+    try:
+        re_versions = {key: (chsum, deleted)
+                       for (key, chsum, deleted) in query_iter(_VERSIONS_QUERY, {'wsid': ws_info[0]})}
+    except Exception as err:
+        yield (None, f'Unable to fetch the versions in RE: {err}')
+        return
+    for (obj_infos, err) in list_objects(ws_info, show_deleted=False):
+        if err:
+            yield (None, f'Unable to list objects: {err}')
+            continue
+        counts['versions'] += len(obj_infos)
+        yield (diff_versions(obj_infos, re_versions), None)
+
+
+def _queue_import(producer, info):
+    """Produce an IMPORT event for an object version to the RE admin events topic."""
+    msg = {'evtype': 'IMPORT', 'wsid': info.wsid, 'objid': info.objid, 'ver': info.version, 'force': True}
+    # Keyed by object so that all of an object's events go to the same partition, in order
+    key = f'{info.wsid}:{info.objid}'
+    while True:
+        try:
+            producer.produce(get_config()['kafka_topics']['re_admin_events'], json.dumps(msg), key=key,
+                             on_delivery=_delivery_report)
+            break
+        except BufferError:
+            # The local queue is full; wait for some deliveries
+            producer.poll(1)
+    producer.poll(0)
+
+
+def _delivery_report(err, msg):
+    if err is not None:
+        log('ERROR', f'Message delivery failed: {err}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue imports for object versions that are missing or stale in RE.')
+    parser.add_argument('min_wsid', type=int, help='first workspace ID to check')
+    parser.add_argument('max_wsid', type=int, help='last workspace ID to check (inclusive)')
+    parser.add_argument('--dry-run', action='store_true', help='only count the versions that would be imported')
+    args = parser.parse_args()
+    counts = reconcile(args.min_wsid, args.max_wsid, dry_run=args.dry_run)
+    log('INFO', f'Finished: {counts}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+Re-handle the events in a window of a Kafka topic, such as after fixing a bug
+in the import transforms.
+
+The topic's partitions are read from a start offset or timestamp up to the end
+of the topic as of when the replay started (or up to a timestamp), in large
+batches. Each batch is coalesced and split by object across a pool of worker
+processes, which each import their share with a single DocBatch (see
+kafka_consumer._handle_batch). Events for the same object always go to the
+same worker, in order.
+
+With several nodes, each replays its share of the partitions (see
+src.utils.sharding), unless explicit offsets are given.
+
+Replays use their own consumer group, so the live consumers' offsets are never
+touched, and the group's committed offsets record how far a replay got (see
+--resume). Once a batch has any failed events, no more offsets are committed
+for the partitions it was read from, so that --resume retries from that batch.
+The ledger of imported versions is ignored for replayed events, since they
+are usually replayed because their documents were wrong.
+
+Usage:
+    python -m src.replay --since 2020-01-01T00:00:00+0000 [--until <timestamp>]
+    python -m src.replay --offsets 0:1234 1:5678
+    python -m src.replay --resume
+"""
+import argparse
+import json
+import time
+from confluent_kafka import Consumer, KafkaError, TopicPartition, OFFSET_INVALID
+
+from src.kafka_consumer import _handle_batch
+from src.utils.coalesce import coalesce
+from src.utils.config import get_config
+from src.utils.formatting import ts_to_epoch
+from src.utils.logger import log
+from src.utils.sharding import owns_partition
+from src.utils.worker_group import get_context
+
+
+def replay(topic, starts, until=None, group=None, batch_size=10000, processes=8, progress_interval=10):
+    """
+    Replay the events in a topic.
+    Args:
+        topic - topic name
+        starts - 'resume' to start from the replay group's committed offsets,
+            a ms epoch to start from the first offset at or after a time, or
+            a dict of partition to start offset (other partitions are skipped)
+        until - ms epoch to stop at, instead of the end of the topic
+        group - consumer group ID; defaults to the configured group with a '-replay' suffix
+        batch_size - max number of events to read and import at once
+        processes - number of worker processes importing each batch
+        progress_interval - seconds between progress logs
+    Returns the number of events replayed and the number that failed.
+    """
+    config = get_config()
+    consumer = Consumer({
+        'bootstrap.servers': config['kafka_server'],
+        'group.id': group or config['kafka_clientgroup'] + '-replay',
+        'enable.auto.commit': False,
+        'enable.auto.offset.store': False,
+    })
+    try:
+        ends = _end_offsets(consumer, topic, until)
+        partitions = [tp for tp in _start_offsets(consumer, topic, starts) if tp.offset < ends[tp.partition]]
+        if not partitions:
+            log('INFO', 'Nothing to replay.')
+            return (0, 0)
+        windows = [f'{topic}[{tp.partition}] {tp.offset}..{ends[tp.partition]}' for tp in partitions]
+        log('INFO', f"Replaying {', '.join(windows)}")
+        consumer.assign(partitions)
+        positions = {tp.partition: tp.offset for tp in partitions}  # next offset to handle, per partition
+        context = get_context(preload=['src.kafka_consumer'])
+        with context.Pool(processes) as pool:
+            return _run(consumer, pool, processes, positions, ends, batch_size, progress_interval)
+    finally:
+        consumer.close()
+
+
+def _run(consumer, pool, processes, positions, ends, batch_size, progress_interval):
+    """Read and import batches until every partition reaches its end offset."""
+    start_time = time.time()
+    logged_at = start_time
+    (replayed, errors) = (0, 0)
+    failed_partitions = set()  # partitions with failed events, whose offsets are no longer committed
+    while any(positions[p] < ends[p] for p in positions):
+        received = []
+        msgs = []
+        kafka_msgs = consumer.consume(num_messages=batch_size, timeout=1)
+        if not kafka_msgs:
+            # Offsets can have gaps (such as from compaction), so the last message may be before the end
+            for tp in consumer.position(consumer.assignment()):
+                positions[tp.partition] = max(positions[tp.partition], tp.offset)
+        for kafka_msg in kafka_msgs:
+            if kafka_msg.error():
+                if kafka_msg.error().code() != KafkaError._PARTITION_EOF:
+                    log('ERROR', f'Kafka message error: {kafka_msg.error()}')
+                continue
+            partition = kafka_msg.partition()
+            if kafka_msg.offset() >= ends[partition]:
+                # Stop reading past the end of the window
+                consumer.pause([TopicPartition(kafka_msg.topic(), partition)])
+                continue
+            positions[partition] = kafka_msg.offset() + 1
+            received.append(kafka_msg)
+            try:
+                msgs.append({**json.loads(kafka_msg.value().decode('utf-8')), 'force': True})
+            except Exception as err:
+                log('ERROR', f'Skipping invalid message at offset {kafka_msg.offset()}: {err}')
+                errors += 1
+        chunks = [chunk for chunk in split_by_object(coalesce(msgs), processes) if chunk]
+        failed = sum(pool.map(_handle_batch, chunks, chunksize=1))
+        if failed:
+            errors += failed
+            failed_partitions.update(kafka_msg.partition() for kafka_msg in received)
+        replayed += len(received)
+        handled = [kafka_msg for kafka_msg in received if kafka_msg.partition() not in failed_partitions]
+        for kafka_msg in handled:
+            consumer.store_offsets(message=kafka_msg)
+        if handled:
+            # Record our progress, so that an interrupted replay can be resumed
+            consumer.commit(asynchronous=False)
+        now = time.time()
+        if now - logged_at >= progress_interval:
+            logged_at = now
+            remaining = sum(max(ends[p] - positions[p], 0) for p in positions)
+            log('INFO', f'Replayed {replayed} events ({replayed / (now - start_time):.0f}/s), '
+                        f'{errors} errors, {remaining} remaining')
+    log('INFO', f'Replayed {replayed} events in {time.time() - start_time:.0f}s, with {errors} errors')
+    if failed_partitions:
+        log('ERROR', f'Offsets were not committed past the failed events in partitions {sorted(failed_partitions)}; '
+                     'use --resume to retry them')
+    return (replayed, errors)
+
+
+def split_by_object(msgs, count):
+    """
+    Split a list of events into `count` lists, keeping all the events for an
+    object (or for a workspace, if they have no object) together and in order.
+    """
+    chunks = [[] for _ in range(count)]  # type: list
+    for msg in msgs:
+        chunks[hash((msg.get('wsid'), msg.get('objid'))) % count].append(msg)
+    return chunks
+
+
+def _start_offsets(consumer, topic, starts):
+    """Get the list of TopicPartitions to start replaying from."""
+    if isinstance(starts, dict):
+        return [TopicPartition(topic, p, offset) for (p, offset) in sorted(starts.items())]
+    # Each node replays its own share of the partitions
+    partitions = [TopicPartition(topic, p) for p in sorted(consumer.list_topics(topic).topics[topic].partitions)
+                  if owns_partition(p)]
+    if starts == 'resume':
+        committed = consumer.committed(partitions, timeout=30)
+        unstarted = [tp.partition for tp in committed if tp.offset == OFFSET_INVALID]
+        if unstarted:
+            raise RuntimeError(f'The replay group has no committed offsets for partitions {unstarted}')
+        return committed
+    return _offsets_for_time(consumer, partitions, starts)
+
+
+def _end_offsets(consumer, topic, until):
+    """
+    Get a dict of partition to the offset to stop replaying at: the first
+    offset at or after `until`, or the end of the partition right now.
+    """
+    ends = {}
+    for p in consumer.list_topics(topic).topics[topic].partitions:
+        ends[p] = consumer.get_watermark_offsets(TopicPartition(topic, p), timeout=30)[1]
+    if until is not None:
+        for tp in _offsets_for_time(consumer, [TopicPartition(topic, p) for p in ends], until):
+            ends[tp.partition] = min(ends[tp.partition], tp.offset)
+    return ends
+
+
+def _offsets_for_time(consumer, partitions, epoch):
+    """
+    Look up the first offset at or after a ms epoch in each partition. The
+    offset is the end of the partition if it has no messages that recent.
+    """
+    found = consumer.offsets_for_times([TopicPartition(tp.topic, tp.partition, epoch) for tp in partitions],
+                                       timeout=30)
+    out = []
+    for tp in found:
+        if tp.offset < 0:
+            # Nothing at or after the timestamp
+            tp = TopicPartition(tp.topic, tp.partition, consumer.get_watermark_offsets(tp, timeout=30)[1])
+        out.append(tp)
+    return out
+
+
+def _parse_offset(val):
+    (partition, offset) = val.split(':')
+    return (int(partition), int(offset))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the events in a window of a Kafka topic.')
+    start = parser.add_mutually_exclusive_group(required=True)
+    start.add_argument('--since', help='start from this time, such as 2020-01-01T00:00:00+0000')
+    start.add_argument('--offsets', nargs='+', type=_parse_offset, metavar='PARTITION:OFFSET',
+                       help='start from these offsets, skipping any other partitions')
+    start.add_argument('--resume', action='store_true', help="start from the replay group's committed offsets")
+    parser.add_argument('--until', help='stop at this time, rather than at the current end of the topic')
+    parser.add_argument('--topic', default='workspace_events', choices=['workspace_events', 're_admin_events'],
+                        help='which configured topic to replay')
+    parser.add_argument('--group', help='consumer group ID for the replay (default: the client group + "-replay")')
+    parser.add_argument('--batch-size', type=int, default=10000, help='max events to read and import at once')
+    parser.add_argument('--processes', type=int, default=8, help='number of worker processes importing events')
+    args = parser.parse_args()
+    if args.resume:
+        starts = 'resume'
+    elif args.offsets:
+        starts = dict(args.offsets)
+    else:
+        starts = ts_to_epoch(args.since)
+    (replayed, errors) = replay(
+        get_config()['kafka_topics'][args.topic],
+        starts,
+        until=ts_to_epoch(args.until) if args.until else None,
+        group=args.group,
+        batch_size=args.batch_size,
+        processes=args.processes
+    )
+    if errors:
+        log('ERROR', f'{errors} of {replayed} events failed; see above.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,517 @@
+"""
+In-process fakes of the workspace, the RE API (and ArangoDB behind it), and
+Kafka, so that the whole path from an event to the documents in RE can be
+tested and benchmarked without any services running.
+
+    services = use_fakes(self)  # in a unittest.TestCase
+    kafka_consumer._handle_batch([{'evtype': 'NEW_VERSION', 'wsid': 41347, 'objid': 5, 'ver': 1}])
+    services.db.get('wsfull_object', '41347:5')
+
+FakeDatabase keeps documents in memory with the same on_duplicate semantics
+and import counts as ArangoDB's bulk import, and answers the queries that
+this service sends (any other query is rejected, so a new query fails
+loudly until it is added here). FakeWorkspace answers requests from the
+mock_workspace fixtures used by the docker-compose mock workspace.
+"""
+import contextlib
+import copy
+import glob
+import itertools
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+from confluent_kafka import OFFSET_INVALID, TIMESTAMP_CREATE_TIME, TopicPartition
+
+from src import compact_edges, reconcile
+from src.utils import re_client
+from src.utils.config import get_config
+from src.utils.http import set_session_factory
+
+_FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'mock_services', 'mock_workspace')
+# Prefix of the env vars that config parameters are read from
+_ENV_PREFIX = 'KBASE_SECURE_CONFIG_PARAM_'
+# Config parameters that get_config() requires, matching the docker-compose test environment
+_REQUIRED_PARAMS = {'WS_TOKEN': 'admin_token', 'RE_TOKEN': 'admin_token'}
+
+
+@contextlib.contextmanager
+def fake_config(**params):
+    """
+    Set config parameters (such as MAX_FIELD_BYTES=100), along with the tokens
+    that get_config() requires, restoring the environment afterwards.
+    """
+    params = {**_REQUIRED_PARAMS, **params}
+    prev = {name: os.environ.get(_ENV_PREFIX + name) for name in params}
+    os.environ.update({_ENV_PREFIX + name: str(val) for (name, val) in params.items()})
+    get_config.cache_clear()
+    try:
+        yield
+    finally:
+        for (name, val) in prev.items():
+            if val is None:
+                del os.environ[_ENV_PREFIX + name]
+            else:
+                os.environ[_ENV_PREFIX + name] = val
+        get_config.cache_clear()
+
+
+def use_fakes(test, services=None, **params):
+    """
+    Send a unittest.TestCase's requests to fake services (a new FakeServices
+    by default) with the given config parameters (see fake_config), until the
+    test finishes. Returns the FakeServices.
+    """
+    services = services or FakeServices()
+    config = fake_config(**params)
+    config.__enter__()
+    test.addCleanup(config.__exit__, None, None, None)
+    set_session_factory(services.session)
+    test.addCleanup(set_session_factory)
+    return services
+
+
+@dataclass
+class FakeResponse:
+    status_code: int
+    body: Any
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return json.dumps(self.body)
+
+    def json(self):
+        return copy.deepcopy(self.body)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        text = self.text
+        for start in range(0, len(text), chunk_size):
+            yield text[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise RuntimeError(f'Error response ({self.status_code}): {self.text}')
+
+
+class FakeQueryError(Exception):
+    """A query that the fake does not support, or that failed."""
+
+
+@dataclass
+class FakeDatabase:
+    colls: Dict[str, Dict[str, dict]] = field(default_factory=dict)  # map of collection name to _key to doc
+    page_size: int = field(default=1000)  # results per page of a query cursor
+    rejected: Set[Tuple[str, str]] = field(default_factory=set)  # (collection, _key) of documents that saves reject
+    cursors: Dict[str, List] = field(init=False, default_factory=dict)  # remaining results of open cursors
+    lock: Any = field(init=False, default_factory=threading.Lock)
+    revs: Any = field(init=False, default_factory=itertools.count)
+
+    def get(self, coll, key):
+        """Get a copy of a document, or None."""
+        with self.lock:
+            return copy.deepcopy(self.colls.get(coll, {}).get(key))
+
+    def save(self, coll, docs, on_duplicate='update'):
+        """Save documents like ArangoDB's bulk import, returning its counts."""
+        result = {'created': 0, 'errors': 0, 'empty': 0, 'updated': 0, 'ignored': 0, 'details': []}
+        with self.lock:
+            stored = self.colls.setdefault(coll, {})
+            for (idx, doc) in enumerate(docs):
+                existing = stored.get(doc['_key'])
+                if (coll, doc['_key']) in self.rejected:
+                    result['errors'] += 1
+                    result['details'].append(f'at position {idx}: document rejected')
+                elif existing is None:
+                    result['created'] += 1
+                    self._put(coll, dict(doc))
+                elif on_duplicate == 'update':
+                    result['updated'] += 1
+                    self._put(coll, _merge(existing, doc))
+                elif on_duplicate == 'replace':
+                    result['updated'] += 1
+                    self._put(coll, dict(doc))
+                elif on_duplicate == 'ignore':
+                    result['ignored'] += 1
+                else:
+                    result['errors'] += 1
+                    result['details'].append(f'at position {idx}: unique constraint violated')
+        return result
+
+    def query(self, query, bind_vars):
+        """Run one of the known queries, returning the list of results."""
+        handler = _QUERIES.get(_normalize(query))
+        if handler is None:
+            raise FakeQueryError(f'Query not supported by the fake database: {query}')
+        with self.lock:
+            return copy.deepcopy(handler(self, bind_vars))
+
+    def query_page(self, query=None, bind_vars=None, cursor_id=None):
+        """Run a query, or continue one, returning a page of results in the RE API's format."""
+        if cursor_id is None:
+            results = self.query(query, bind_vars or {})
+            count = len(results)
+        else:
+            results = self.cursors.pop(cursor_id)
+            count = len(results)
+        page = {'results': results[:self.page_size], 'count': count, 'has_more': count > self.page_size}
+        if page['has_more']:
+            page['cursor_id'] = str(next(self.revs))
+            self.cursors[page['cursor_id']] = results[self.page_size:]
+        return page
+
+    def _put(self, coll, doc):
+        doc['_id'] = f"{coll}/{doc['_key']}"
+        doc['_rev'] = str(next(self.revs))
+        self.colls[coll][doc['_key']] = doc
+
+    def _docs(self, coll):
+        return self.colls.get(coll, {}).values()
+
+
+def _merge(old, new):
+    """Merge a document into another, like an ArangoDB update (which merges objects recursively)."""
+    out = dict(old)
+    for (key, val) in new.items():
+        if isinstance(val, dict) and isinstance(out.get(key), dict):
+            out[key] = _merge(out[key], val)
+        else:
+            out[key] = val
+    return out
+
+
+def _normalize(query):
+    return ' '.join(query.split())
+
+
+def _upsert_max(db, bind_vars):
+    coll = bind_vars['@coll']
+    field_name = bind_vars['field']
+    stored = db.colls.setdefault(coll, {})
+    for doc in bind_vars['docs']:
+        existing = stored.get(doc['_key'])
+        if existing is None:
+            db._put(coll, dict(doc))
+        elif doc[field_name] > existing[field_name]:
+            db._put(coll, _merge(existing, doc))
+    return []
+
+
+def _remove(db, bind_vars):
+    for key in bind_vars['keys']:
+        db.colls.get(bind_vars['@coll'], {}).pop(key, None)
+    return []
+
+
+def _find_edge(db, coll, from_id, to_id):
+    return [e for e in db._docs(coll) if e['_from'] == from_id and e['_to'] == to_id][:1]
+
+
+# Handlers for each query that this service sends, keyed by the query with normalized whitespace
+_QUERIES = {_normalize(query): handler for (query, handler) in [
+    (re_client._GET_DOC_QUERY, lambda db, bv: [d for d in db._docs(bv['@coll']) if d['_key'] == bv['key']]),
+    (re_client._DOC_EXISTS_QUERY, lambda db, bv: [1 for d in db._docs(bv['@coll']) if d['_key'] == bv['key']]),
+    (re_client._GET_EDGE_QUERY, lambda db, bv: _find_edge(db, bv['@coll'], bv['from'], bv['to'])),
+    (re_client._GET_DOCS_QUERY, lambda db, bv: [d for d in db._docs(bv['@coll']) if d['_key'] in bv['keys']]),
+    (re_client._GET_EDGES_QUERY, lambda db, bv: [e for (from_id, to_id) in bv['pairs']
+                                                 for e in _find_edge(db, bv['@coll'], from_id, to_id)]),
+    (re_client._UPSERT_MAX_QUERY, _upsert_max),
+    (reconcile._VERSIONS_QUERY, lambda db, bv: [[v['_key'], v['hash'], v.get('deleted')]
+                                                for v in db._docs('wsfull_object_version')
+                                                if v['workspace_id'] == bv['wsid']]),
+    (compact_edges._SCAN_QUERY, lambda db, bv: sorted(db._docs(bv['@coll']), key=lambda e: (e['_from'], e['_to']))),
+    (compact_edges._REMOVE_QUERY, _remove),
+]}
+
+
+@dataclass
+class FakeWorkspace:
+    """
+    Answers workspace JSON RPC requests from mock_json_service fixture files.
+    listObjects administration requests are answered from `object_infos`, at
+    most `list_limit` results at a time.
+    """
+    fixture_dir: str = field(default=_FIXTURE_DIR)
+    object_infos: List[list] = field(default_factory=list)
+    list_limit: int = 10000
+    fixtures: List[dict] = field(init=False)
+    calls: List[dict] = field(init=False, default_factory=list)  # the body of each request
+
+    def __post_init__(self):
+        self.fixtures = []
+        for path in sorted(glob.glob(os.path.join(self.fixture_dir, '*.json'))):
+            with open(path) as fd:
+                self.fixtures.append(json.load(fd))
+
+    def handle(self, body):
+        """Get the response for a JSON RPC request body."""
+        self.calls.append(body)
+        if body.get('method') == 'Workspace.administer' and body['params'][0]['command'] == 'listObjects':
+            return self._list_objects(body['params'][0]['params'])
+        for fixture in self.fixtures:
+            if fixture['body'] == body:
+                return FakeResponse(int(fixture['response']['status']), fixture['response']['body'])
+        return FakeResponse(500, {'version': '1.1', 'error': {'message': f'No fixture for request: {body}'}})
+
+    def _list_objects(self, params):
+        max_obj_id = params.get('maxObjectID', float('inf'))
+        infos = sorted(
+            info for info in self.object_infos
+            if info[6] in params['ids'] and params.get('minObjectID', 1) <= info[0] <= max_obj_id
+        )
+        return FakeResponse(200, {'version': '1.1', 'result': [infos[:self.list_limit]]})
+
+
+@dataclass
+class FakeServices:
+    """Routes requests to the fake workspace and database, by the configured URLs."""
+    db: FakeDatabase = field(default_factory=FakeDatabase)
+    workspace: FakeWorkspace = field(default_factory=FakeWorkspace)
+    re_api_errors: List[FakeResponse] = field(default_factory=list)  # responses to the next RE API requests
+
+    def session(self):
+        """Session factory for src.utils.http.set_session_factory."""
+        return FakeSession(self)
+
+    def fail_re_api(self, status, message, count=1):
+        """Respond to the next `count` RE API requests with an error instead of handling them."""
+        self.re_api_errors.extend(FakeResponse(status, {'error': message}) for _ in range(count))
+
+    def handle(self, method, url, params=None, data=None):
+        config = get_config()
+        params = params or {}
+        body = _read_body(data)
+        if url.rstrip('/') == config['ws_url']:
+            return self.workspace.handle(json.loads(body))
+        path = urlparse(url).path
+        try:
+            if url.startswith(config['re_api_url']):
+                if self.re_api_errors:
+                    return self.re_api_errors.pop(0)
+                return self._handle_re_api(method, path, params, body)
+            if url.startswith(config['arango_url']):
+                return self._handle_arango(method, path, params, body)
+        except FakeQueryError as err:
+            return FakeResponse(400, {'error': str(err)})
+        return FakeResponse(404, {'error': f'Unknown URL: {method} {url}'})
+
+    def _handle_re_api(self, method, path, params, body):
+        if method == 'get' and path in ('', '/'):
+            return FakeResponse(200, {'status': 'ok'})
+        if method == 'put' and path == '/api/v1/documents':
+            docs = [json.loads(line) for line in body.splitlines() if line.strip()]
+            result = self.db.save(params['collection'], docs, params.get('on_duplicate', 'error'))
+            return FakeResponse(200, {**result, 'error': False})
+        if method == 'post' and path == '/api/v1/query_results':
+            if 'cursor_id' in params:
+                return FakeResponse(200, self.db.query_page(cursor_id=params['cursor_id']))
+            bind_vars = json.loads(body)
+            query = bind_vars.pop('query')
+            return FakeResponse(200, self.db.query_page(query, bind_vars))
+        return FakeResponse(404, {'error': f'Unknown RE API endpoint: {method} {path}'})
+
+    def _handle_arango(self, method, path, params, body):
+        endpoint = path.split('/', 3)[-1]  # strip the /_db/<name> prefix
+        if method == 'post' and endpoint == '_api/import':
+            docs = [json.loads(line) for line in body.splitlines() if line.strip()]
+            result = self.db.save(params['collection'], docs, params.get('onDuplicate', 'error'))
+            return FakeResponse(201, {**result, 'error': False})
+        if method == 'post' and endpoint == '_api/cursor':
+            req = json.loads(body)
+            return FakeResponse(201, {'result': self.db.query(req['query'], req.get('bindVars', {}))})
+        return FakeResponse(404, {'error': f'Unknown ArangoDB endpoint: {method} {path}'})
+
+
+@dataclass
+class FakeSession:
+    """Stand-in for requests.Session that sends every request to FakeServices."""
+    services: FakeServices
+
+    def request(self, method, url, params=None, data=None, timeout=None, **kwargs):
+        if timeout is None:
+            # A request without a timeout could hang forever
+            raise AssertionError(f'No timeout for request: {method} {url}')
+        return self.services.handle(method.lower(), url, params, data)
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('put', url, **kwargs)
+
+
+def _read_body(data):
+    """Read a request body given as a string, bytes, a file, or an iterable of bytes."""
+    if data is None:
+        return ''
+    if hasattr(data, 'read'):
+        data = data.read()
+    elif not isinstance(data, (str, bytes)):
+        data = b''.join(data)
+    return data.decode('utf-8') if isinstance(data, bytes) else data
+
+
+@dataclass
+class FakeMessage:
+    """Stand-in for confluent_kafka.Message."""
+    _topic: str
+    _partition: int
+    _offset: int
+    _key: Optional[bytes]
+    _value: bytes
+    _timestamp: int = field(default=0)  # ms epoch
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def timestamp(self):
+        return (TIMESTAMP_CREATE_TIME, self._timestamp)
+
+    def error(self):
+        return None
+
+
+@dataclass
+class FakeKafka:
+    """
+    In-memory topics with a Producer and Consumer that implement the parts of
+    the confluent_kafka API this service uses. Each topic has a single
+    partition, and consumers in the same group share committed offsets.
+    Messages can be removed from a topic's list to leave gaps in its offsets,
+    as compaction does.
+    """
+    topics: Dict[str, List[FakeMessage]] = field(default_factory=dict)
+    ends: Dict[str, int] = field(default_factory=dict)  # map of topic to the offset of the next message produced
+    committed: Dict[Any, int] = field(default_factory=dict)  # map of (group, topic) to the next offset to consume
+
+    def producer(self, conf=None):
+        return FakeProducer(self)
+
+    def consumer(self, conf=None):
+        return FakeConsumer(self, (conf or {}).get('group.id', 'fake'))
+
+
+@dataclass
+class FakeProducer:
+    kafka: FakeKafka
+
+    def produce(self, topic, value, key=None, on_delivery=None, callback=None, timestamp=0):
+        offset = self.kafka.ends.get(topic, 0)
+        to_bytes = (lambda val: val.encode('utf-8') if isinstance(val, str) else val)
+        msg = FakeMessage(topic, 0, offset, to_bytes(key), to_bytes(value), timestamp)
+        self.kafka.topics.setdefault(topic, []).append(msg)
+        self.kafka.ends[topic] = offset + 1
+        for report in (on_delivery, callback):
+            if report is not None:
+                report(None, msg)
+
+    def poll(self, timeout=None):
+        return 0
+
+    def flush(self, timeout=None):
+        return 0
+
+
+@dataclass
+class FakeConsumer:
+    kafka: FakeKafka
+    group: str
+    subscribed: List[str] = field(default_factory=list)
+    positions: Dict[str, int] = field(default_factory=dict)  # map of topic to the next offset to read
+    stored: Dict[str, int] = field(default_factory=dict)  # map of topic to the next offset to commit
+    paused: Set[str] = field(default_factory=set)
+
+    def subscribe(self, topics, **kwargs):
+        self.subscribed = list(topics)
+
+    def assign(self, partitions):
+        self.subscribed = [tp.topic for tp in partitions]
+        self.positions.update({tp.topic: tp.offset for tp in partitions if tp.offset >= 0})
+
+    def consume(self, num_messages=1, timeout=-1):
+        """Read up to `num_messages` messages from the subscribed topics, without waiting."""
+        out = []  # type: list
+        for topic in self.subscribed:
+            if topic in self.paused:
+                continue
+            pos = self._position(topic)
+            msgs = [msg for msg in self.kafka.topics.get(topic, []) if msg.offset() >= pos][:num_messages - len(out)]
+            # Past the last message, the position is the end of the topic
+            self.positions[topic] = msgs[-1].offset() + 1 if msgs else max(pos, self.kafka.ends.get(topic, 0))
+            out.extend(msgs)
+        return out
+
+    def position(self, partitions):
+        return [TopicPartition(tp.topic, tp.partition, self._position(tp.topic)) for tp in partitions]
+
+    def seek(self, partition):
+        self.positions[partition.topic] = partition.offset
+
+    def store_offsets(self, message=None, offsets=None):
+        self.stored[message.topic()] = message.offset() + 1
+
+    def commit(self, asynchronous=True, **kwargs):
+        for (topic, offset) in self.stored.items():
+            self.kafka.committed[(self.group, topic)] = offset
+
+    def committed(self, partitions, timeout=None):
+        return [TopicPartition(tp.topic, tp.partition, self.kafka.committed.get((self.group, tp.topic), OFFSET_INVALID))
+                for tp in partitions]
+
+    def list_topics(self, topic=None, timeout=None):
+        topics = {name: SimpleNamespace(partitions={0: None}) for name in self.kafka.topics if topic in (None, name)}
+        return SimpleNamespace(topics=topics)
+
+    def get_watermark_offsets(self, partition, timeout=None):
+        msgs = self.kafka.topics.get(partition.topic, [])
+        return (msgs[0].offset() if msgs else 0, self.kafka.ends.get(partition.topic, 0))
+
+    def offsets_for_times(self, partitions, timeout=None):
+        """Find the first offset with a timestamp at or after each partition's offset field, or -1."""
+        out = []
+        for tp in partitions:
+            found = [msg.offset() for msg in self.kafka.topics.get(tp.topic, []) if msg.timestamp()[1] >= tp.offset]
+            out.append(TopicPartition(tp.topic, tp.partition, found[0] if found else -1))
+        return out
+
+    def assignment(self):
+        return [TopicPartition(topic, 0) for topic in self.subscribed]
+
+    def pause(self, partitions):
+        self.paused.update(tp.topic for tp in partitions)
+
+    def resume(self, partitions):
+        self.paused.difference_update(tp.topic for tp in partitions)
+
+    def close(self):
+        self.commit()
+
+    def _position(self, topic):
+        return self.positions.get(topic, self.kafka.committed.get((self.group, topic), 0))
@@ -0,0 +1,43 @@
+import time
+import unittest
+
+from src.utils.autoscaler import Autoscaler, compute_desired
+
+
+class TestAutoscaler(unittest.TestCase):
+
+    def test_compute_desired(self):
+        """Test that we scale up at once to drain the lag in time, and scale down one worker at a time."""
+        # Each of 2 workers handles 10 msgs/s, so draining 1200 msgs in 60s takes 2 workers
+        self.assertEqual(compute_desired(2, 1200, 20, 60), 2)
+        self.assertEqual(compute_desired(2, 3000, 20, 60), 5)
+        self.assertEqual(compute_desired(2, 3001, 20, 60), 6)
+        # Fewer workers would do, but only one is removed per check
+        self.assertEqual(compute_desired(5, 600, 20, 60), 4)
+        self.assertEqual(compute_desired(5, 0, 20, 60), 4)
+        # No throughput measurement yet
+        self.assertEqual(compute_desired(2, 6000, None, 60), 3)
+        self.assertEqual(compute_desired(2, 6000, 0, 60), 3)
+        self.assertEqual(compute_desired(0, 6000, 20, 60), 1)
+
+    def test_desired_count(self):
+        """Test that the desired count is clamped between the min, the max, and this node's share of partitions."""
+        scaler = Autoscaler('localhost:1', 'test', ['topic'], min_count=2, max_count=6, node_count=2)
+        try:
+            # Kafka could not be reached
+            self.assertEqual(scaler.desired_count(4), 4)
+            (scaler.lag, scaler.committed, scaler.num_partitions) = (10 ** 6, 1000, 20)
+            # Without a rate yet, a single worker is added
+            self.assertEqual(scaler.desired_count(3), 4)
+            # 100 msgs/s by 4 workers is far too slow, but we stop at max_count
+            (scaler.prev_committed, scaler.prev_time) = (0, time.time() - 10)
+            self.assertEqual(scaler.desired_count(4), 6)
+            # This node's share of 6 partitions is 3
+            (scaler.num_partitions, scaler.prev_committed) = (6, None)
+            self.assertEqual(scaler.desired_count(3), 3)
+            # Never below min_count, even with more nodes than partitions
+            (scaler.lag, scaler.num_partitions) = (0, 1)
+            self.assertEqual(scaler.desired_count(3), 2)
+            self.assertEqual(scaler.desired_count(2), 2)
+        finally:
+            scaler.consumer.close()
@@ -0,0 +1,31 @@
+import os
+import tempfile
+import unittest
+
+from src.test.fakes import use_fakes
+from src.utils.bulk_loader import BulkLoader
+from src.utils.re_client import REUnavailable
+
+
+class TestBulkLoader(unittest.TestCase):
+
+    def test_load(self):
+        """Test that documents are saved in batches per collection."""
+        services = use_fakes(self)
+        loader = BulkLoader(batch_size=2, threads=2)
+        for idx in range(5):
+            loader.add('wsfull_object', {'_key': str(idx)})
+        loader.add('wsfull_object_hash', {'_key': 'a'})
+        self.assertEqual(loader.close(), {'wsfull_object': 5, 'wsfull_object_hash': 1})
+        self.assertEqual(len(services.db.colls['wsfull_object']), 5)
+
+    def test_unavailable(self):
+        """Test that documents are never spooled, so that an outage fails the load."""
+        with tempfile.TemporaryDirectory() as spool_dir:
+            services = use_fakes(self, SPOOL_DIR=spool_dir)
+            services.fail_re_api(503, 'Service unavailable')
+            loader = BulkLoader()
+            loader.add('wsfull_object', {'_key': '1'})
+            with self.assertRaises(REUnavailable):
+                loader.close()
+            self.assertEqual(os.listdir(spool_dir), [])
@@ -0,0 +1,56 @@
+import unittest
+
+from src.utils.coalesce import coalesce
+
+
+class TestCoalesce(unittest.TestCase):
+
+    def test_merge_versions(self):
+        """Test that many import events for one object are merged into one event."""
+        msgs = [
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2, 'ver': 1},
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 3, 'ver': 1},
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2, 'ver': 2},
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2, 'ver': 2},
+            {'evtype': 'RENAME_OBJECT', 'wsid': 1, 'objid': 2},
+        ]
+        self.assertEqual(coalesce(msgs), [
+            {'evtype': 'RENAME_OBJECT', 'wsid': 1, 'objid': 2, 'vers': [1, 2, None]},
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 3, 'vers': [1]},
+        ])
+
+    def test_keep_order_around_delete(self):
+        """Test that imports are not merged across a deletion state change, and are kept."""
+        delete = {'evtype': 'OBJECT_DELETE_STATE_CHANGE', 'wsid': 1, 'objid': 2}
+        msgs = [
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2, 'ver': 1},
+            {'evtype': 'IMPORT_NONEXISTENT', 'wsid': 1, 'objid': 2, 'ver': 1},
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2, 'ver': 2},
+            delete,
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2, 'ver': 3},
+        ]
+        self.assertEqual(coalesce(msgs), [
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2, 'vers': [1, 2]},
+            delete,
+            {'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2, 'vers': [3]},
+        ])
+
+    def test_nonexistent_superseded(self):
+        """Test that IMPORT_NONEXISTENT skips versions that are imported unconditionally."""
+        msgs = [
+            {'evtype': 'IMPORT_NONEXISTENT', 'wsid': 1, 'objid': 2, 'ver': 1},
+            {'evtype': 'IMPORT_NONEXISTENT', 'wsid': 1, 'objid': 2, 'ver': 3},
+            {'evtype': 'IMPORT', 'wsid': 1, 'objid': 2, 'ver': 1},
+        ]
+        self.assertEqual(coalesce(msgs), [
+            {'evtype': 'IMPORT_NONEXISTENT', 'wsid': 1, 'objid': 2, 'vers': [3]},
+            {'evtype': 'IMPORT', 'wsid': 1, 'objid': 2, 'vers': [1]},
+        ])
+
+    def test_passthrough(self):
+        """Test that workspace-level events are left alone."""
+        msgs = [
+            {'evtype': 'SET_GLOBAL_PERMISSION', 'wsid': 1},
+            {'evtype': 'SET_GLOBAL_PERMISSION', 'wsid': 1},
+        ]
+        self.assertEqual(coalesce(msgs), msgs)
@@ -0,0 +1,46 @@
+import unittest
+
+from src import compact_edges
+from src.test.fakes import use_fakes
+from src.utils.documents import edge_key
+
+
+class TestCompactEdges(unittest.TestCase):
+
+    def setUp(self):
+        self.services = use_fakes(self)
+
+    def _add_edges(self, coll, edges):
+        for (key, from_id, to_id, extra) in edges:
+            self.services.db.save(coll, [{'_key': key, '_from': from_id, '_to': to_id, **extra}])
+
+    def test_compact_wsprov(self):
+        """Test that duplicate wsprov edges collapse into one per key, and the legacy keys are removed."""
+        self.assertIn('wsprov_links', compact_edges._EDGE_COLLS)
+        self.assertIn('wsprov_copied_into', compact_edges._EDGE_COLLS)
+        (obj1, obj2, obj3) = ('wsprov_object/1:1:1', 'wsprov_object/1:2:1', 'wsprov_object/1:3:1')
+        self._add_edges('wsprov_links', [
+            ('1', obj1, obj2, {'type': 'reference'}),
+            ('2', obj1, obj2, {'type': 'reference'}),
+            ('3', obj1, obj2, {'type': 'provenance'}),
+            (edge_key(obj1, obj3, 'reference'), obj1, obj3, {'type': 'reference'}),
+        ])
+        self._add_edges('wsprov_copied_into', [('4', obj1, obj2, {}), ('5', obj1, obj2, {})])
+        counts = compact_edges.compact('wsprov_links')
+        self.assertEqual(counts, {'scanned': 4, 'rewritten': 2, 'removed': 3})
+        self.assertEqual(sorted(self.services.db.colls['wsprov_links']), sorted([
+            edge_key(obj1, obj2, 'reference'), edge_key(obj1, obj2, 'provenance'), edge_key(obj1, obj3, 'reference'),
+        ]))
+        counts = compact_edges.compact('wsprov_copied_into')
+        self.assertEqual(counts, {'scanned': 2, 'rewritten': 1, 'removed': 2})
+        self.assertEqual(list(self.services.db.colls['wsprov_copied_into']), [edge_key(obj1, obj2)])
+        # Compacting again changes nothing
+        self.assertEqual(compact_edges.compact('wsprov_links')['rewritten'], 0)
+
+    def test_dry_run(self):
+        """Test that a dry run only counts the edges that would change."""
+        self._add_edges('wsprov_copied_into', [('1', 'wsprov_object/1:1:1', 'wsprov_object/1:2:1', {}),
+                                               ('2', 'wsprov_object/1:1:1', 'wsprov_object/1:2:1', {})])
+        counts = compact_edges.compact('wsprov_copied_into', dry_run=True)
+        self.assertEqual(counts['removed'], 2)
+        self.assertEqual(sorted(self.services.db.colls['wsprov_copied_into']), ['1', '2'])
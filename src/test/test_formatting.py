@@ -0,0 +1,19 @@
+import unittest
+
+from src.utils.formatting import epoch_to_ts, ts_to_epoch
+
+
+class TestFormatting(unittest.TestCase):
+
+    def test_ts_to_epoch(self):
+        """Test that timestamps are converted with their own UTC offset, not the local timezone."""
+        epoch = 1577836800000  # 2020-01-01T00:00:00Z
+        self.assertEqual(ts_to_epoch('2020-01-01T00:00:00+0000'), epoch)
+        self.assertEqual(ts_to_epoch('2020-01-01T05:30:00+0530'), epoch)
+        self.assertEqual(ts_to_epoch('2019-12-31T16:00:00-0800'), epoch)
+
+    def test_epoch_to_ts(self):
+        """Test that epochs are formatted as UTC timestamps that convert back to the same epoch."""
+        self.assertEqual(epoch_to_ts(1577836800000), '2020-01-01T00:00:00+0000')
+        self.assertEqual(epoch_to_ts(ts_to_epoch('2020-06-01T12:00:00-0400')), '2020-06-01T16:00:00+0000')
+        self.assertEqual(ts_to_epoch(epoch_to_ts(1591012800999)), 1591012800000)
@@ -0,0 +1,160 @@
+"""
+Run events through the consumer's handlers against the in-process fakes in
+src/test/fakes.py, without Kafka, the RE API, or the workspace.
+"""
+import json
+import signal
+import unittest
+
+from src import kafka_consumer
+from src.test.fakes import FakeConsumer, FakeDatabase, FakeKafka, FakeServices, use_fakes
+from src.utils.coalesce import coalesce
+from src.utils.config import get_config
+from src.utils.re_client import REClient
+
+
+class _StopWhenIdle(FakeConsumer):
+    """Fake consumer that shuts down the consumer loop once it has read every message."""
+
+    def consume(self, num_messages=1, timeout=-1):
+        msgs = super().consume(num_messages, timeout)
+        if not msgs:
+            kafka_consumer._SHUTDOWN.set()
+        return msgs
+
+
+class TestHandleMsg(unittest.TestCase):
+
+    def setUp(self):
+        self.services = use_fakes(self)
+
+    def test_new_version_event(self):
+        """Test a full object import, checking for all associated documents."""
+        kafka_consumer._handle_msg({'evtype': 'NEW_VERSION', 'wsid': 41347, 'objid': 5, 'ver': 1})
+        db = self.services.db
+        self.assertEqual(db.get('wsfull_object', '41347:5')['deleted'], False)
+        self.assertEqual(db.get('wsfull_object_hash', '0e8d1a5090be7c4e9ccf6d37c09d0eab')['type'], 'MD5')
+        ver_doc = db.get('wsfull_object_version', '41347:5:1')
+        self.assertEqual(ver_doc['name'], 'Narrative.1553621013004')
+        self.assertEqual(ver_doc['size'], 26938)
+        latest = db.get('wsfull_latest_version_of', '41347:5')
+        self.assertEqual((latest['_from'], latest['version']), ('wsfull_object_version/41347:5:1', 1))
+        edges = {
+            'wsfull_copied_from': [('wsfull_object_version/41347:5:1', 'wsfull_object_version/1:2:3')],
+            'wsfull_version_of': [('wsfull_object_version/41347:5:1', 'wsfull_object/41347:5')],
+            'wsfull_ws_contains_obj': [('wsfull_workspace/41347', 'wsfull_object/41347:5')],
+            'wsfull_obj_created_with_method': [
+                ('wsfull_object_version/41347:5:1', 'wsfull_method_version/narrative:3.10.0:UNKNOWN')
+            ],
+            'wsfull_obj_created_with_module': [
+                ('wsfull_object_version/41347:5:1', 'wsfull_module_version/narrative:3.10.0')
+            ],
+            'wsfull_obj_instance_of_type': [
+                ('wsfull_object_version/41347:5:1', 'wsfull_type_version/KBaseNarrative.Narrative-4.0')
+            ],
+            'wsfull_owner_of': [('wsfull_user/username', 'wsfull_object_version/41347:5:1')],
+            'wsfull_refers_to': [('wsfull_object_version/41347:5:1', 'wsfull_object_version/1:1:1'),
+                                 ('wsfull_object_version/41347:5:1', 'wsfull_object_version/2:2:2')],
+            'wsfull_prov_descendant_of': [('wsfull_object_version/41347:5:1', 'wsfull_object_version/1:1:1'),
+                                          ('wsfull_object_version/41347:5:1', 'wsfull_object_version/2:2:2')],
+        }
+        client = REClient()
+        for (coll, pairs) in edges.items():
+            self.assertEqual(sorted(client.get_edges(coll, pairs)), sorted(pairs), coll)
+        method_edge = client.get_edges('wsfull_obj_created_with_method', edges['wsfull_obj_created_with_method'])
+        self.assertIsNone(list(method_edge.values())[0]['method_params'])
+
+    def test_kafka_batch(self):
+        """Test that a batch of events read from Kafka is imported together, and IMPORT_NONEXISTENT is skipped."""
+        kafka = FakeKafka()
+        producer = kafka.producer()
+        topic = get_config()['kafka_topics']['workspace_events']
+        for event in [{'evtype': 'NEW_VERSION', 'wsid': 41347, 'objid': 5, 'ver': 1},
+                      {'evtype': 'RENAME_OBJECT', 'wsid': 41347, 'objid': 5, 'ver': 1},
+                      {'evtype': 'IMPORT_NONEXISTENT', 'wsid': 41347, 'objid': 6, 'ver': 1}]:
+            producer.produce(topic, json.dumps(event))
+        consumer = kafka.consumer({'group.id': 'test'})
+        consumer.subscribe([topic])
+        msgs = [json.loads(msg.value()) for msg in consumer.consume(num_messages=100)]
+        self.assertEqual(kafka_consumer._handle_batch(coalesce(msgs)), 0)
+        # The two events for object 5 are coalesced into one workspace request
+        self.assertEqual(len(self.services.workspace.calls), 2)
+        obj_doc = self.services.db.get('wsfull_object', '41347:6')
+        self.assertEqual(obj_doc['object_id'], 6)
+        self.assertEqual(kafka_consumer._handle_batch([{'evtype': 'IMPORT_NONEXISTENT', 'wsid': 41347,
+                                                        'objid': 6, 'ver': 1}]), 0)
+        self.assertEqual(self.services.db.get('wsfull_object', '41347:6')['_rev'], obj_doc['_rev'])
+        self.assertEqual(len(self.services.workspace.calls), 2)
+
+    def test_missing_version(self):
+        """Test that a merged event still imports its versions when one of them has been deleted."""
+        errors = kafka_consumer._handle_batch([{'evtype': 'NEW_VERSION', 'wsid': 41347, 'objid': 5, 'vers': [1, 2]}])
+        self.assertEqual(errors, 0)
+        self.assertIsNotNone(self.services.db.get('wsfull_object_version', '41347:5:1'))
+        # One request for both versions, and then one for each
+        self.assertEqual(len(self.services.workspace.calls), 3)
+
+    def test_version_error(self):
+        """Test that a merged event fails when a version cannot be fetched for any other reason."""
+        # There is no fixture for version 3, so the fake workspace responds with a generic error
+        errors = kafka_consumer._handle_batch([{'evtype': 'NEW_VERSION', 'wsid': 41347, 'objid': 5, 'vers': [1, 3]}])
+        self.assertEqual(errors, 1)
+        self.assertIsNone(self.services.db.get('wsfull_object_version', '41347:5:1'))
+
+    def test_query_cursor(self):
+        """Test that bulk lookups page through the RE API's cursor."""
+        self.services = use_fakes(self, FakeServices(db=FakeDatabase(page_size=2)))
+        client = REClient(batch_size=3)
+        result = client.save_many([
+            ('wsfull_object', [{'_key': str(idx), 'object_id': idx} for idx in range(7)], 'update'),
+            ('wsfull_object_hash', [{'_key': 'a', 'type': 'MD5'}], 'update'),
+        ])
+        self.assertEqual(result['wsfull_object']['created'], 7)
+        docs = client.get_docs('wsfull_object', [str(idx) for idx in range(10)])
+        self.assertEqual(sorted(docs), [str(idx) for idx in range(7)])
+        self.assertEqual(self.services.db.cursors, {})
+
+    def test_consumer_loop(self):
+        """Test that run() imports the events it consumes, and stores and commits their offsets."""
+        for signum in (signal.SIGTERM, signal.SIGUSR1):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        self.addCleanup(kafka_consumer._SHUTDOWN.clear)
+        kafka = FakeKafka()
+        topic = get_config()['kafka_topics']['workspace_events']
+        for event in [{'evtype': 'NEW_VERSION', 'wsid': 41347, 'objid': 5, 'ver': 1},
+                      'not json',
+                      {'evtype': 'IMPORT_NONEXISTENT', 'wsid': 41347, 'objid': 6, 'ver': 1}]:
+            kafka.producer().produce(topic, event if isinstance(event, str) else json.dumps(event))
+        group = get_config()['kafka_clientgroup']
+        kafka_consumer.run(consumer_factory=lambda conf: _StopWhenIdle(kafka, conf['group.id']))
+        self.assertEqual(kafka.committed, {(group, topic): 3})
+        self.assertIsNotNone(self.services.db.get('wsfull_object_version', '41347:5:1'))
+        self.assertIsNotNone(self.services.db.get('wsfull_object', '41347:6'))
+
+    def test_rejected_doc(self):
+        """Test that a rejected document only fails its own event, and the rest of the batch is saved."""
+        self.services.db.rejected.add(('wsfull_object', '41347:6'))
+        errors = kafka_consumer._handle_batch([{'evtype': 'NEW_VERSION', 'wsid': 41347, 'objid': 5, 'ver': 1},
+                                               {'evtype': 'IMPORT_NONEXISTENT', 'wsid': 41347, 'objid': 6, 'ver': 1}])
+        self.assertEqual(errors, 1)
+        self.assertIsNotNone(self.services.db.get('wsfull_object_version', '41347:5:1'))
+        # The upserts for the saved event are not skipped
+        self.assertEqual(self.services.db.get('wsfull_latest_version_of', '41347:5')['version'], 1)
+        self.assertIsNone(self.services.db.get('wsfull_object', '41347:6'))
+
+    def test_unavailable_retry(self):
+        """Test that events are read again, rather than committed, when RE is unavailable."""
+        for signum in (signal.SIGTERM, signal.SIGUSR1):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        self.addCleanup(kafka_consumer._SHUTDOWN.clear)
+        self.services = use_fakes(self, UNAVAILABLE_RETRY_INTERVAL=0)
+        self.services.fail_re_api(503, 'Service unavailable')
+        kafka = FakeKafka()
+        topic = get_config()['kafka_topics']['workspace_events']
+        kafka.producer().produce(topic, json.dumps({'evtype': 'NEW_VERSION', 'wsid': 41347, 'objid': 5, 'ver': 1}))
+        kafka_consumer.run(consumer_factory=lambda conf: _StopWhenIdle(kafka, conf['group.id']))
+        self.assertEqual(self.services.re_api_errors, [])
+        self.assertEqual(list(kafka.committed.values()), [1])
+        self.assertEqual(self.services.db.get('wsfull_object', '41347:5')['deleted'], False)
+        # Each attempt fetched the object from the workspace
+        self.assertEqual(len(self.services.workspace.calls), 2)
@@ -7,8 +7,6 @@ from src.utils.config import get_config
 from src.utils.re_client import get_doc, get_edge
 from src.utils.logger import log
 
-_CONFIG = get_config()
-
 
 class TestIntegration(unittest.TestCase):
 
@@ -16,9 +14,10 @@ class TestIntegration(unittest.TestCase):
     def setUpClass(cls):
         # Initialize specs
         log('INFO', 'Initializing specs for the RE API..')
+        config = get_config()
         resp = requests.put(
-            _CONFIG['re_api_url'] + '/api/v1/specs',
-            headers={'Authorization': _CONFIG['ws_token']},
+            config['re_api_url'] + '/api/v1/specs',
+            headers={'Authorization': config['ws_token']},
             params={'init_collections': '1'}
         )
         resp.raise_for_status()
@@ -62,6 +61,14 @@ class TestIntegration(unittest.TestCase):
             'wsfull_object/41347:5'  # to
         )
         self.assertTrue(ver_edge)
+        # Check for wsfull_latest_version_of
+        latest_edge = _wait_for_edge(
+            'wsfull_latest_version_of',  # collection
+            'wsfull_object_version/41347:5:1',  # from
+            'wsfull_object/41347:5'  # to
+        )
+        self.assertEqual(latest_edge['_key'], '41347:5')
+        self.assertEqual(latest_edge['version'], 1)
         # Check for wsfull_ws_contains_obj
         contains_edge = _wait_for_edge(
             'wsfull_ws_contains_obj',  # collection
@@ -127,7 +134,7 @@ class TestIntegration(unittest.TestCase):
     def test_import_nonexistent_existing(self):
         """Test IMPORT_NONEXISTENT events."""
         _produce({'evtype': 'IMPORT_NONEXISTENT', 'wsid': 41347, 'objid': 6, 'ver': 1})
-        admin_topic = _CONFIG['kafka_topics']['re_admin_events']
+        admin_topic = get_config()['kafka_topics']['re_admin_events']
         obj_doc1 = _wait_for_doc('wsfull_object', '41347:6')
         self.assertEqual(obj_doc1['object_id'], 6)
         _produce({'evtype': 'IMPORT_NONEXISTENT', 'wsid': 41347, 'objid': 5, 'ver': 1}, admin_topic)
@@ -135,8 +142,11 @@ class TestIntegration(unittest.TestCase):
         self.assertEqual(obj_doc1['_rev'], obj_doc2['_rev'])
 
 
-def _produce(data, topic=_CONFIG['kafka_topics']['workspace_events']):
-    producer = Producer({'bootstrap.servers': _CONFIG['kafka_server']})
+def _produce(data, topic=None):
+    config = get_config()
+    if topic is None:
+        topic = config['kafka_topics']['workspace_events']
+    producer = Producer({'bootstrap.servers': config['kafka_server']})
     producer.produce(topic, json.dumps(data), callback=_delivery_report)
     producer.poll(60)
 
@@ -0,0 +1,34 @@
+import unittest
+import json
+
+from src.utils.json_stream import iter_array
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def test_iter_array_chunked(self):
+        """Test that array entries are decoded correctly regardless of where chunks are split."""
+        data = [{'info': [i, 'name' * i, 123456789], 'refs': []} for i in range(20)]
+        text = json.dumps({'version': '1.1', 'result': [{'data': data}]})
+        for size in [1, 2, 7, 64, len(text)]:
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            self.assertEqual(list(iter_array(chunks, ['result', 0, 'data'])), data)
+
+    def test_iter_array_nested_list(self):
+        """Test iterating over a list inside a list, such as a listObjects result."""
+        text = '{"version": "1.1", "result": [[[1, "a"], [22, "b"]]]}'
+        chunks = [text[i:i + 3] for i in range(0, len(text), 3)]
+        self.assertEqual(list(iter_array(chunks, ['result', 0])), [[1, 'a'], [22, 'b']])
+
+    def test_iter_array_empty(self):
+        self.assertEqual(list(iter_array(['{"result": [ [ ] ]}'], ['result', 0])), [])
+
+    def test_iter_array_error_response(self):
+        """Test that a JSON RPC error response raises."""
+        text = json.dumps({'version': '1.1', 'error': {'message': 'oops'}})
+        with self.assertRaises(ValueError):
+            list(iter_array([text], ['result', 0]))
+
+    def test_iter_array_missing_path(self):
+        with self.assertRaises(ValueError):
+            list(iter_array(['{"result": []}'], ['result', 0]))
@@ -0,0 +1,28 @@
+import os
+import tempfile
+import unittest
+
+from src.utils.ledger import Ledger
+
+
+class TestLedger(unittest.TestCase):
+
+    def test_add_contains(self):
+        """Test that imported versions are recorded, and shared between ledger instances."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'ledger.db')
+            ledger = Ledger(path, bloom_bits=1024)
+            self.assertFalse(ledger.contains('1:2:3'))
+            ledger.add('1:2:3')
+            self.assertTrue(ledger.contains('1:2:3'))
+            self.assertFalse(ledger.contains('1:2:4'))
+            # Another process opening the same ledger sees the same data
+            self.assertTrue(Ledger(path, bloom_bits=1024).contains('1:2:3'))
+
+    def test_rebuild_bloom(self):
+        """Test that a missing Bloom filter file is rebuilt from the database."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'ledger.db')
+            Ledger(path, bloom_bits=1024).add('1:2:3')
+            os.remove(path + '.bloom')
+            self.assertTrue(Ledger(path, bloom_bits=1024).contains('1:2:3'))
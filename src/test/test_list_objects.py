@@ -0,0 +1,51 @@
+import unittest
+
+from src import generate_workspace_objs
+from src.generate_workspace_objs import list_objects
+from src.test.fakes import FakeServices, FakeWorkspace, use_fakes
+
+_WSID = 41347
+
+
+def _info(obj_id, ver):
+    return [obj_id, f'obj{obj_id}', 'Module.Type-1.0', '2020-01-01T00:00:00+0000', ver, 'user', _WSID,
+            'ws', 'chsum', 1, {}]
+
+
+class TestListObjects(unittest.TestCase):
+
+    def _list(self, infos, **kwargs):
+        """List the objects in a fake workspace that returns at most 4 results per request."""
+        limit = generate_workspace_objs._LIST_OBJECTS_LIMIT
+        generate_workspace_objs._LIST_OBJECTS_LIMIT = 4
+        self.addCleanup(setattr, generate_workspace_objs, '_LIST_OBJECTS_LIMIT', limit)
+        services = FakeServices(workspace=FakeWorkspace(object_infos=infos, list_limit=4))
+        use_fakes(self, services)
+        (listed, errors) = ([], [])
+        for (chunk, err) in list_objects([_WSID], show_deleted=False, **kwargs):
+            if err is not None:
+                errors.append(err)
+            else:
+                listed.extend((info.objid, info.version) for info in chunk)
+        return (listed, errors)
+
+    def test_versions_across_pages(self):
+        """Test that an object whose versions are split across pages is listed completely, once."""
+        infos = [_info(1, 1), _info(1, 2), _info(2, 1), _info(2, 2), _info(2, 3), _info(3, 1)]
+        (listed, errors) = self._list(infos)
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(listed), [(1, 1), (1, 2), (2, 1), (2, 2), (2, 3), (3, 1)])
+
+    def test_max_obj_id(self):
+        """Test that objects past max_obj_id are not listed."""
+        infos = [_info(1, 1), _info(1, 2), _info(2, 1), _info(2, 2), _info(2, 3), _info(3, 1)]
+        (listed, errors) = self._list(infos, min_obj_id=2, max_obj_id=2)
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(listed), [(2, 1), (2, 2), (2, 3)])
+
+    def test_too_many_versions(self):
+        """Test that an object with more versions than fit on a page is reported, and listing continues."""
+        infos = [_info(1, ver) for ver in range(1, 6)] + [_info(2, 1)]
+        (listed, errors) = self._list(infos)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(sorted(listed), [(1, 1), (1, 2), (1, 3), (1, 4), (2, 1)])
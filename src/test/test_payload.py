@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.test.fakes import fake_config
+from src.utils import payload
+from src.utils.config import get_config
+from src.utils.payload import dump_doc, split_payload
+
+
+class TestPayload(unittest.TestCase):
+
+    def setUp(self):
+        payload.COUNTS.clear()
+
+    def test_split_payload(self):
+        """Test that documents are split into requests within the byte budget, in order."""
+        lines = [json.dumps({'_key': str(idx), 'val': 'x' * (idx * 10)}) for idx in range(10)]
+        chunks = list(split_payload(lines, 100))
+        self.assertEqual([line for chunk in chunks for line in chunk], lines)
+        for chunk in chunks:
+            # Only a document that is too large by itself may go over the budget
+            self.assertTrue(len('\n'.join(chunk)) <= 100 or len(chunk) == 1)
+        self.assertEqual(len(chunks[-1]), 1)
+        self.assertEqual(list(split_payload([], 100)), [])
+
+    def test_drop(self):
+        """Test that only the oversized fields of a large document are saved as null, and counted."""
+        doc = {'_key': '1:2:3', '_from': 'a/1', '_to': 'b/2', 'method_params': ['x' * 200], 'name': 'small'}
+        with fake_config(MAX_FIELD_BYTES=100, OVERSIZED_FIELD_POLICY='drop'):
+            small = {'_key': '1', 'name': 'small'}
+            self.assertEqual(json.loads(dump_doc('edges', small)), small)
+            saved = json.loads(dump_doc('edges', doc))
+        self.assertIsNone(saved['method_params'])
+        self.assertEqual(saved['oversized_fields'], {'method_params': {'bytes': len(json.dumps(doc['method_params']))}})
+        self.assertEqual((saved['_key'], saved['_from'], saved['_to'], saved['name']), ('1:2:3', 'a/1', 'b/2', 'small'))
+        self.assertEqual(payload.COUNTS, {'drop': 1})
+        # The original document is left alone
+        self.assertEqual(len(doc['method_params'][0]), 200)
+
+    def test_still_oversized(self):
+        """Test that a document that is large overall, with no single oversized field, is saved as-is."""
+        doc = {'_key': '1', **{f'field{idx}': 'x' * 50 for idx in range(5)}}
+        with fake_config(MAX_FIELD_BYTES=100, OVERSIZED_FIELD_POLICY='drop'):
+            line = dump_doc('coll', doc)
+            self.assertEqual(json.loads(line), doc)
+            self.assertGreater(len(line), 100)
+            # Only the one oversized field is dropped, so the document may still be over the limit
+            big = {**doc, 'big': 'y' * 200}
+            saved = json.loads(dump_doc('coll', big))
+        self.assertEqual(saved, {**doc, 'big': None, 'oversized_fields': {'big': {'bytes': 202}}})
+        self.assertGreater(len(json.dumps(saved)), 100)
+        self.assertEqual(payload.COUNTS, {'drop': 1})
+
+    def test_offload(self):
+        """Test that oversized fields are written to files under OFFLOAD_DIR, named by the document key."""
+        doc = {'_key': 'a/b', 'data': {'val': 'x' * 200}, 'other': ['y' * 200]}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with fake_config(MAX_FIELD_BYTES=100, OVERSIZED_FIELD_POLICY='offload', OFFLOAD_DIR=tmp_dir):
+                saved = json.loads(dump_doc('coll', doc))
+            self.assertEqual((saved['data'], saved['other']), (None, None))
+            for name in ('data', 'other'):
+                note = saved['oversized_fields'][name]
+                self.assertEqual(note['offloaded_to'], os.path.join(tmp_dir, 'coll', f'a%2Fb.{name}.json'))
+                self.assertEqual(note['bytes'], len(json.dumps(doc[name])))
+                with open(note['offloaded_to']) as fd:
+                    self.assertEqual(json.load(fd), doc[name])
+            # No temporary files are left behind
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp_dir, 'coll'))), ['a%2Fb.data.json', 'a%2Fb.other.json'])
+        self.assertEqual(payload.COUNTS, {'offload': 2})
+
+    def test_policy_errors(self):
+        """Test that the 'none' policy saves documents as-is, and invalid settings raise when loaded."""
+        doc = {'_key': '1', 'data': 'x' * 200}
+        with fake_config(MAX_FIELD_BYTES=100, OVERSIZED_FIELD_POLICY='none'):
+            self.assertEqual(json.loads(dump_doc('coll', doc)), doc)
+        with fake_config(MAX_FIELD_BYTES=100, OVERSIZED_FIELD_POLICY='offload', OFFLOAD_DIR=''):
+            with self.assertRaises(RuntimeError):
+                get_config()
+        with fake_config(MAX_FIELD_BYTES=100, OVERSIZED_FIELD_POLICY='truncate'):
+            with self.assertRaises(RuntimeError):
+                get_config()
+        self.assertEqual(payload.COUNTS, {})
@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+
+from src.test.fakes import use_fakes
+from src.utils.re_client import AsyncREClient, REBulkError, REClient, REUnavailable, _check_counts, _merge_results
+
+
+class _FakeClient(REClient):
+    """Answers queries from a list of documents, recording the bind vars of each query."""
+
+    def __init__(self, docs, **kwargs):
+        super().__init__(**kwargs)
+        self.docs = docs
+        self.queries = []
+
+    def _query_pages(self, query, bind_vars):
+        self.queries.append(bind_vars)
+        if 'keys' in bind_vars:
+            results = [d for d in self.docs if d['_key'] in bind_vars['keys']]
+        else:
+            results = [d for d in self.docs if [d['_from'], d['_to']] in bind_vars['pairs']]
+        # Two pages, as if the RE API had returned a cursor
+        yield results[:1]
+        yield results[1:]
+
+
+class TestREClient(unittest.TestCase):
+
+    def test_get_docs_batches(self):
+        """Test that bulk lookups are split into queries of at most batch_size keys."""
+        docs = [{'_key': str(idx), '_from': f'a/{idx}', '_to': 'b/1'} for idx in range(5)]
+        client = _FakeClient(docs, batch_size=2)
+        found = client.get_docs('coll', ['0', '1', '3', '4', 'missing'])
+        self.assertEqual(sorted(found), ['0', '1', '3', '4'])
+        self.assertEqual([q['keys'] for q in client.queries], [['0', '1'], ['3', '4'], ['missing']])
+        edges = client.get_edges('edges', [('a/2', 'b/1'), ('a/9', 'b/1')])
+        self.assertEqual(list(edges), [('a/2', 'b/1')])
+
+    def test_async_client(self):
+        """Test that the async client runs lookups concurrently and streams query pages."""
+        docs = [{'_key': str(idx)} for idx in range(3)]
+        client = AsyncREClient(_FakeClient(docs))
+
+        async def run():
+            results = await asyncio.gather(client.get_docs('coll', ['0']), client.get_docs('coll', ['1', '2']))
+            streamed = [doc['_key'] async for doc in client.query_iter('query', {'keys': ['0', '2']})]
+            return (results, streamed)
+
+        (results, streamed) = asyncio.get_event_loop().run_until_complete(run())
+        self.assertEqual([sorted(r) for r in results], [['0'], ['1', '2']])
+        self.assertEqual(streamed, ['0', '2'])
+
+    def test_check_counts(self):
+        """Test that a bulk save response with errors raises, even though the request succeeded."""
+        _check_counts('coll', {'created': 2, 'updated': 1, 'errors': 0})
+        with self.assertRaises(REBulkError) as ctx:
+            _check_counts('coll', {'created': 1, 'errors': 1, 'details': ['at position 1: unique constraint']})
+        self.assertIn('unique constraint', str(ctx.exception))
+
+    def test_merge_results(self):
+        """Test that the counts from a save split into several requests are added up."""
+        merged = _merge_results([
+            {'created': 2, 'updated': 0, 'errors': 1, 'details': ['a'], 'error': False},
+            {'created': 1, 'updated': 3, 'errors': 0, 'details': [], 'error': False},
+        ])
+        self.assertEqual(merged, {'created': 3, 'updated': 3, 'errors': 1, 'details': ['a'], 'error': False})
+        self.assertEqual(_merge_results([[1], [], [2]]), [1, 2])
+
+    def test_query_unavailable(self):
+        """Test that queries raise REUnavailable while the RE API is down, and RuntimeError for other errors."""
+        services = use_fakes(self)
+        services.fail_re_api(503, 'Service unavailable')
+        with self.assertRaises(REUnavailable):
+            REClient().query('return 1', {})
+        services.fail_re_api(400, 'Syntax error')
+        with self.assertRaises(RuntimeError) as ctx:
+            REClient().query('return 1', {})
+        self.assertNotIsInstance(ctx.exception, REUnavailable)
@@ -0,0 +1,35 @@
+import unittest
+
+from src.reconcile import _diff_workspace, diff_versions
+from src.test.fakes import use_fakes
+from src.utils.documents import ObjectInfo
+
+
+def _info(objid, ver, chsum):
+    return ObjectInfo(objid, 'obj', 'Mod.Type-1.0', '2019-01-01T00:00:00+0000', ver, 'user', 1, 'ws', chsum, 10, {})
+
+
+class TestReconcile(unittest.TestCase):
+
+    def test_diff_versions(self):
+        """Test that versions missing from RE, or with a different hash or deleted, are found."""
+        infos = [_info(1, 1, 'a'), _info(1, 2, 'b'), _info(2, 1, 'c'), _info(3, 1, 'd')]
+        re_versions = {
+            '1:1:1': ('a', False),
+            '1:1:2': ('x', False),
+            '1:3:1': ('d', True),
+            '1:4:1': ('e', False),  # no longer listed by the workspace; ignored
+        }
+        diff = [(info.upa(), reason) for (info, reason) in diff_versions(infos, re_versions)]
+        self.assertEqual(diff, [('1/1/2', 'stale'), ('1/2/1', 'missing'), ('1/3/1', 'stale')])
+
+    def test_query_error(self):
+        """Test that a failed query for a workspace's versions in RE is reported as an error."""
+        services = use_fakes(self)
+        services.fail_re_api(500, 'Query failed')
+        counts = {'versions': 0}
+        results = list(_diff_workspace((1, 'ws', 'user', '2019-01-01T00:00:00+0000', 10), counts))
+        self.assertEqual(len(results), 1)
+        self.assertIsNone(results[0][0])
+        self.assertIn('Query failed', results[0][1])
+        self.assertEqual(counts, {'versions': 0})
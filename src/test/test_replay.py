@@ -0,0 +1,85 @@
+import json
+import unittest
+
+from src.replay import _end_offsets, _run, _start_offsets, split_by_object
+from src.test.fakes import FakeKafka, use_fakes
+
+_TOPIC = 'workspaceevents'
+
+
+class _SerialPool:
+    """Stand-in for a multiprocessing Pool that handles each chunk in this process."""
+
+    def map(self, func, iterable, chunksize=None):
+        return [func(item) for item in iterable]
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.services = use_fakes(self)
+        self.kafka = FakeKafka()
+
+    def _produce(self, objids):
+        """Produce a NEW_VERSION event for version 1 of each object, with timestamps 1000ms apart."""
+        for (idx, objid) in enumerate(objids):
+            event = {'evtype': 'NEW_VERSION', 'wsid': 41347, 'objid': objid, 'ver': 1}
+            self.kafka.producer().produce(_TOPIC, json.dumps(event), timestamp=idx * 1000)
+
+    def _replay(self, consumer, starts, until=None):
+        ends = _end_offsets(consumer, _TOPIC, until)
+        partitions = _start_offsets(consumer, _TOPIC, starts)
+        consumer.assign(partitions)
+        positions = {tp.partition: tp.offset for tp in partitions}
+        return _run(consumer, _SerialPool(), 2, positions, ends, batch_size=2, progress_interval=0)
+
+    def test_run_window(self):
+        """Test that only the events between two times are replayed, across a gap in the offsets."""
+        self._produce([5, 6, 5, 6, 5, 6])
+        # Remove offset 2, as compaction would
+        del self.kafka.topics[_TOPIC][2]
+        consumer = self.kafka.consumer({'group.id': 'replay'})
+        # Offsets 1 to 4, without 2
+        self.assertEqual(self._replay(consumer, starts=1000, until=4500), (3, 0))
+        self.assertEqual(self.kafka.committed, {('replay', _TOPIC): 5})
+        self.assertEqual(consumer.paused, {_TOPIC})
+        # Offsets 1 and 3 (both object 6) are read together and coalesced into one request
+        self.assertEqual(len(self.services.workspace.calls), 2)
+        # Resuming finds nothing left before the end of the window
+        self.assertEqual(self._replay(self.kafka.consumer({'group.id': 'replay'}), 'resume', until=4500), (0, 0))
+
+    def test_run_gap_at_end(self):
+        """Test that the replay finishes when the last offsets before the end were compacted away."""
+        self._produce([5, 6, 5])
+        del self.kafka.topics[_TOPIC][2]
+        self.assertEqual(self._replay(self.kafka.consumer({'group.id': 'replay'}), starts=0), (2, 0))
+        self.assertEqual(self.kafka.committed, {('replay', _TOPIC): 2})
+
+    def test_run_failure(self):
+        """Test that offsets are not committed past a batch with failed events, so that resuming retries it."""
+        # There is no workspace fixture for object 7
+        self._produce([5, 6, 7, 5, 6])
+        self.assertEqual(self._replay(self.kafka.consumer({'group.id': 'replay'}), starts=0), (5, 1))
+        self.assertEqual(self.kafka.committed, {('replay', _TOPIC): 2})
+        consumer = self.kafka.consumer({'group.id': 'replay'})
+        self.assertEqual([tp.offset for tp in _start_offsets(consumer, _TOPIC, 'resume')], [2])
+
+    def test_resume_unstarted(self):
+        """Test that resuming a replay that never committed anything fails."""
+        self._produce([5])
+        with self.assertRaises(RuntimeError):
+            _start_offsets(self.kafka.consumer({'group.id': 'replay'}), _TOPIC, 'resume')
+
+    def test_split_by_object(self):
+        """Test that each object's events end up in one chunk, in their original order."""
+        msgs = [{'evtype': 'NEW_VERSION', 'wsid': wsid, 'objid': objid, 'ver': ver}
+                for ver in range(3) for wsid in range(4) for objid in range(5)]
+        msgs.append({'evtype': 'SET_GLOBAL_PERMISSION', 'wsid': 1})
+        chunks = split_by_object(msgs, 3)
+        self.assertEqual(len(chunks), 3)
+        self.assertLess(max(map(len, chunks)), len(msgs))
+        self.assertEqual(sum(map(len, chunks)), len(msgs))
+        for chunk in chunks:
+            for msg in chunk:
+                obj_msgs = [m for m in msgs if (m['wsid'], m.get('objid')) == (msg['wsid'], msg.get('objid'))]
+                self.assertEqual([m for m in chunk if m in obj_msgs], obj_msgs)
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import time
+import unittest
+
+from src.test.fakes import fake_config
+from src.utils.config import get_config
+from src.utils.sharding import Lease, owns_workspace
+
+
+class TestLease(unittest.TestCase):
+
+    def test_acquire_release(self):
+        """Test that a lease is exclusive until released, and that an expired lease can be taken over."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'ws-1.lease')
+            first = Lease(path, ttl=60, owner='a')
+            second = Lease(path, ttl=60, owner='b')
+            self.assertTrue(first.acquire())
+            self.assertFalse(second.acquire())
+            self.assertEqual(second.holder(), 'a')
+            first.release()
+            self.assertIsNone(first.holder())
+            self.assertTrue(second.acquire())
+            # Pretend that the holder died without releasing the lease
+            second.released.set()
+            os.utime(path, (time.time() - 120, time.time() - 120))
+            third = Lease(path, ttl=60, owner='c')
+            self.assertTrue(third.acquire())
+            self.assertEqual(third.holder(), 'c')
+            second.release()
+            self.assertEqual(third.holder(), 'c')
+            third.release()
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+
+class TestShards(unittest.TestCase):
+
+    def test_node_config(self):
+        """Test that workspaces are split between nodes, and an invalid node count or index raises when loaded."""
+        with fake_config(NODE_COUNT=3, NODE_INDEX=2):
+            self.assertEqual([wsid for wsid in range(10) if owns_workspace(wsid)], [2, 5, 8])
+        for (count, index) in [(0, 0), (3, 3), (3, -1)]:
+            with fake_config(NODE_COUNT=count, NODE_INDEX=index):
+                with self.assertRaises(RuntimeError):
+                    get_config()
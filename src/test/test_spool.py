@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.utils.spool import Spool, SpoolFull
+
+
+class _Unavailable(Exception):
+    pass
+
+
+class TestSpool(unittest.TestCase):
+
+    def test_append_drain(self):
+        """Test that spooled documents are replayed in order, and the segments removed."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool = Spool(tmp_dir, max_bytes=2 ** 20, segment_bytes=20)
+            self.assertFalse(spool.pending('wsfull_object'))
+            for idx in range(4):
+                spool.append('wsfull_object', 'update', [json.dumps({'_key': str(idx)})])
+            spool.append('wsfull_latest_version_of', 'max-version', [json.dumps({'_key': 'x', 'version': 1})])
+            self.assertTrue(spool.pending('wsfull_object'))
+            self.assertFalse(spool.pending('wsfull_object_version'))
+            sent = []
+            spool.drain(lambda coll, op, docs: sent.append((coll, op, [json.loads(d)['_key'] for d in docs])))
+            self.assertEqual(sent, [
+                ('wsfull_latest_version_of', 'max-version', ['x']),
+                ('wsfull_object', 'update', ['0', '1']),
+                ('wsfull_object', 'update', ['2', '3']),
+            ])
+            self.assertFalse(spool.pending('wsfull_object'))
+
+    def test_drain_errors(self):
+        """Test that segments are kept for a retryable error, and set aside for any other error."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool = Spool(tmp_dir, max_bytes=2 ** 20)
+            spool.append('wsfull_object', 'update', ['{"_key": "1"}'])
+
+            def unavailable(coll, op, docs):
+                raise _Unavailable()
+            with self.assertRaises(_Unavailable):
+                spool.drain(unavailable, (_Unavailable,))
+            # The segment stays claimed, so new documents queue up behind it
+            self.assertTrue(spool.pending('wsfull_object'))
+            spool.append('wsfull_object', 'update', ['{"_key": "2"}'])
+            sent = []
+            spool.drain(lambda coll, op, docs: sent.extend(docs))
+            self.assertEqual(sent, ['{"_key": "1"}', '{"_key": "2"}'])
+            spool.append('wsfull_object', 'update', ['{"_key": "3"}'])
+
+            def invalid(coll, op, docs):
+                raise RuntimeError('Invalid document')
+            spool.drain(invalid, (_Unavailable,))
+            self.assertFalse(spool.pending('wsfull_object'))
+            self.assertEqual(len(os.listdir(os.path.join(tmp_dir, 'failed'))), 1)
+
+    def test_drain_order(self):
+        """Test that segments from several processes are replayed in the order they were started."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool = Spool(tmp_dir, max_bytes=2 ** 20)
+            # Segments started by other processes, with pids that sort the other way as text
+            for (started, pid, key) in [(200, 99, 'b'), (100, 1000, 'a'), (300, 5, 'c')]:
+                with open(os.path.join(tmp_dir, f'wsfull_object.update.{started:020d}.{pid}.ndjson'), 'w') as fd:
+                    fd.write(json.dumps({'_key': key}) + '\n')
+            spool.append('wsfull_object', 'update', [json.dumps({'_key': 'd'})])
+            sent = []
+            spool.drain(lambda coll, op, docs: sent.extend(json.loads(d)['_key'] for d in docs))
+            self.assertEqual(sent, ['a', 'b', 'c', 'd'])
+
+    def test_full(self):
+        """Test that appends raise, rather than block, while the spool is over its size limit."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool = Spool(tmp_dir, max_bytes=10)
+            spool.append('wsfull_object', 'update', [json.dumps({'_key': '1', 'name': 'x' * 10})])
+            with self.assertRaises(SpoolFull):
+                spool.append('wsfull_object', 'update', ['{"_key": "2"}'])
+            spool.drain(lambda coll, op, docs: None)
+            spool.append('wsfull_object', 'update', ['{"_key": "2"}'])
+            self.assertTrue(spool.pending('wsfull_object'))
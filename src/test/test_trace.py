@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.test.fakes import use_fakes
+from src.utils import trace
+from src.utils.re_client import save_many
+
+
+class TestTrace(unittest.TestCase):
+
+    def test_collect_spans(self):
+        """Test that spans in a sampled batch are written with the trace ID of their event."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for _ in range(2):
+                with trace.collect(tmp_dir, sample_rate=1):
+                    with trace.event({'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2}):
+                        with trace.span('inner', coll='wsfull_object'):
+                            pass
+                    with trace.span('flush'):
+                        pass
+            path = os.path.join(tmp_dir, f'trace-{os.getpid()}.json')
+            with open(path) as fd:
+                contents = fd.read()
+            # The array is left unterminated so that it can be appended to
+            events = json.loads(contents.rstrip(',\n') + ']')
+            self.assertEqual([ev['name'] for ev in events], ['inner', 'event', 'flush'] * 2)
+            (inner, event, flush) = events[:3]
+            self.assertEqual(inner['args']['coll'], 'wsfull_object')
+            self.assertEqual(inner['args']['trace_id'], event['args']['trace_id'])
+            self.assertEqual(event['args']['evtype'], 'NEW_VERSION')
+            self.assertNotIn('trace_id', flush['args'])
+            self.assertNotEqual(event['args']['trace_id'], events[4]['args']['trace_id'])
+            self.assertTrue(all(ev['ph'] == 'X' and ev['dur'] >= 0 for ev in events))
+
+    def test_not_sampled(self):
+        """Test that nothing is recorded when a batch is not sampled."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with trace.collect(tmp_dir, sample_rate=0):
+                with trace.event({'evtype': 'NEW_VERSION', 'wsid': 1}):
+                    trace.traced(lambda: None)()
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+    def test_parallel_saves(self):
+        """Test that RE saves made on other threads by save_many are recorded in the caller's trace."""
+        use_fakes(self)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with trace.collect(tmp_dir, sample_rate=1):
+                with trace.event({'evtype': 'NEW_VERSION', 'wsid': 1, 'objid': 2}):
+                    save_many([('wsfull_object', [{'_key': '1:2'}], 'update'),
+                               ('wsfull_object_hash', [{'_key': 'abc'}], 'update')], spool=False)
+            with open(os.path.join(tmp_dir, f'trace-{os.getpid()}.json')) as fd:
+                events = json.loads(fd.read().rstrip(',\n') + ']')
+        saves = [ev for ev in events if ev['name'] == 're.save']
+        self.assertEqual(sorted(ev['args']['coll'] for ev in saves), ['wsfull_object', 'wsfull_object_hash'])
+        event = [ev for ev in events if ev['name'] == 'event'][0]
+        self.assertTrue(all(ev['args']['trace_id'] == event['args']['trace_id'] for ev in saves))
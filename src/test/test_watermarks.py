@@ -0,0 +1,29 @@
+import os
+import tempfile
+import unittest
+
+from src.utils.documents import ObjectInfo
+from src.utils.formatting import ts_to_epoch
+from src.utils.watermarks import Watermark, WatermarkStore
+
+
+def _info(objid, save_date):
+    return ObjectInfo(objid, 'obj', 'Mod.Type-1.0', save_date, 1, 'user', 1, 'ws', 'x', 10, {})
+
+
+class TestWatermarks(unittest.TestCase):
+
+    def test_advance_and_store(self):
+        """Test that a watermark only moves forward, and is stored per workspace."""
+        watermark = Watermark()
+        watermark.advance(_info(5, '2019-01-02T00:00:00+0000'))
+        watermark.advance(_info(3, '2019-01-03T00:00:00+0000'))
+        watermark.advance(_info(4, '2019-01-01T00:00:00+0000'))
+        self.assertEqual(watermark.max_objid, 5)
+        self.assertEqual(watermark.max_epoch, ts_to_epoch('2019-01-03T00:00:00+0000'))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = WatermarkStore(os.path.join(tmp_dir, 'watermarks.db'))
+            self.assertIsNone(store.get(1))
+            store.set(1, watermark)
+            self.assertEqual(store.get(1), watermark)
+            self.assertIsNone(store.get(2))
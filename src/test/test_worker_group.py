@@ -0,0 +1,97 @@
+import unittest
+from dataclasses import dataclass, field
+
+from src.utils.worker_group import WorkerGroup
+
+
+@dataclass
+class _FakeProcess:
+    """Stand-in for a multiprocessing.Process that is alive until it is told to crash."""
+    target: object
+    args: tuple
+    daemon: bool
+    alive: bool = field(default=False)
+    exitcode: int = field(default=None)
+
+    def start(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def crash(self):
+        (self.alive, self.exitcode) = (False, 1)
+
+    def terminate(self):
+        (self.alive, self.exitcode) = (False, -15)
+
+
+class _FakeContext:
+    """Multiprocessing context that records the processes it starts."""
+
+    def __init__(self):
+        self.started = []
+
+    def Process(self, target, args, daemon):
+        proc = _FakeProcess(target, args, daemon)
+        self.started.append(proc)
+        return proc
+
+
+class TestWorkerGroup(unittest.TestCase):
+
+    def test_restart_backoff(self):
+        """Test that crashed workers are restarted after a delay that doubles with each recent crash."""
+        context = _FakeContext()
+        group = WorkerGroup(print, ('arg',), count=2, backoff_max=3, crash_loop_count=10, context=context)
+        self.assertEqual([p.args for p in context.started], [('arg', 0), ('arg', 1)])
+        delays = []
+        for _ in range(4):
+            group.workers[1].proc.crash()
+            group.health_check()
+            worker = group.workers[1]
+            self.assertIsNone(worker.proc)
+            delays.append(round(worker.restart_at - worker.crashes[-1]))
+            # Still waiting to restart
+            group.health_check()
+            self.assertIsNone(worker.proc)
+            worker.restart_at = 0
+            group.health_check()
+            self.assertTrue(worker.proc.is_alive())
+            self.assertEqual(worker.proc.args, ('arg', 1))
+        self.assertEqual(delays, [1, 2, 3, 3])
+        # The other worker was left alone
+        self.assertIs(group.workers[0].proc, context.started[0])
+        self.assertEqual(len(context.started), 6)
+
+    def test_crash_loop(self):
+        """Test that a worker crashing too often within the window raises an error, and older crashes expire."""
+        context = _FakeContext()
+        group = WorkerGroup(print, (), count=1, crash_loop_count=3, crash_loop_window=300, context=context)
+        worker = group.workers[0]
+        for _ in range(2):
+            worker.proc.crash()
+            group.health_check()
+            worker.restart_at = 0
+            group.health_check()
+        # Crashes from before the window are forgotten
+        worker.crashes[0] -= 301
+        worker.proc.crash()
+        group.health_check()
+        self.assertEqual(len(worker.crashes), 2)
+        worker.restart_at = 0
+        group.health_check()
+        worker.proc.crash()
+        with self.assertRaises(RuntimeError):
+            group.health_check()
+
+    def test_scale(self):
+        """Test that scaling starts new workers with the next indexes, and stops the last ones."""
+        context = _FakeContext()
+        group = WorkerGroup(print, (), count=1, context=context)
+        group.scale(3)
+        self.assertEqual([w.proc.args for w in group.workers], [(0,), (1,), (2,)])
+        group.scale(1)
+        self.assertEqual(len(group.workers), 1)
+        self.assertFalse(context.started[2].is_alive())
+        self.assertTrue(context.started[0].is_alive())
@@ -0,0 +1,68 @@
+"""
+Minimal ArangoDB HTTP client for writing documents directly, bypassing the RE API.
+
+This is only meant for trusted deployments, such as initial loads, where the
+extra hop and parsing in the RE API are the bottleneck. Documents are sent to
+ArangoDB's bulk import endpoint as a stream of NDJSON, with the same
+on_duplicate semantics as the RE API (which passes them through to ArangoDB).
+API docs: https://www.arangodb.com/docs/stable/http/bulk-imports.html
+"""
+import json
+import requests
+
+from .config import get_config
+from .http import get_session
+
+
+# Response statuses that mean ArangoDB is temporarily down
+_UNAVAILABLE_STATUSES = {502, 503, 504}
+
+
+class ArangoUnavailable(RuntimeError):
+    """ArangoDB could not be reached, or is temporarily unable to handle requests."""
+
+
+def import_docs(coll_name, lines, on_duplicate='update'):
+    """
+    Bulk-import documents into a collection.
+    Args:
+        coll_name - collection name
+        lines - iterable of documents as JSON strings, or a file of NDJSON
+            opened in binary mode; either is streamed rather than joined in memory
+        on_duplicate - 'update', 'replace', 'ignore', or 'error'
+    Returns the import counts, such as {'created': 1, 'updated': 0, 'errors': 0, ...}
+    """
+    if isinstance(lines, list):
+        # Let requests send it in one go, rather than a chunk per line
+        body = '\n'.join(lines).encode('utf-8')
+    elif hasattr(lines, 'read'):
+        body = lines
+    else:
+        body = (line.encode('utf-8') + b'\n' for line in lines)
+    params = {'collection': coll_name, 'type': 'documents', 'onDuplicate': on_duplicate, 'details': 'true'}
+    resp = _request('post', '/_api/import', data=body, params=params)
+    if not resp.ok:
+        raise RuntimeError(f'Error response from ArangoDB: {resp.text}')
+    return resp.json()
+
+
+def query(aql, bind_vars):
+    """Run an AQL query, returning the first batch of results."""
+    resp = _request('post', '/_api/cursor', data=json.dumps({'query': aql, 'bindVars': bind_vars}))
+    if not resp.ok:
+        raise RuntimeError(f'Error response from ArangoDB: {resp.text}')
+    return resp.json()['result']
+
+
+def _request(method, path, **kwargs):
+    """Make a request to the configured database, raising ArangoUnavailable if ArangoDB is down."""
+    config = get_config()
+    url = f"{config['arango_url']}/_db/{config['arango_db']}{path}"
+    try:
+        resp = get_session().request(method, url, auth=(config['arango_user'], config['arango_pass']),
+                                     timeout=config['request_timeout'], **kwargs)
+    except (requests.ConnectionError, requests.Timeout) as err:
+        raise ArangoUnavailable(f'Unable to reach ArangoDB: {err}')
+    if resp.status_code in _UNAVAILABLE_STATUSES:
+        raise ArangoUnavailable(f'ArangoDB unavailable ({resp.status_code}): {resp.text}')
+    return resp
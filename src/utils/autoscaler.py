@@ -0,0 +1,111 @@
+"""
+Decide how many consumer processes to run based on consumer group lag.
+"""
+import math
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+from confluent_kafka import Consumer, TopicPartition
+
+from src.utils.logger import log
+
+
+@dataclass
+class Autoscaler:
+    kafka_server: str
+    group_id: str
+    topics: List[str]
+    min_count: int
+    max_count: int
+    # How many seconds we would like it to take to drain the current lag
+    target_drain_secs: float = field(default=60)
+    # Number of supervisors sharing the partitions; each runs at most its share of consumers
+    node_count: int = field(default=1)
+    consumer: Consumer = field(init=False)
+    lag: Optional[int] = field(init=False, default=None)  # lag as of the last update(), if it succeeded
+    committed: int = field(init=False, default=0)  # total committed offset as of the last update()
+    num_partitions: int = field(init=False, default=0)
+    prev_committed: Optional[int] = field(init=False, default=None)
+    prev_time: float = field(init=False, default=0)
+
+    def __post_init__(self):
+        # This consumer never subscribes, so it does not join the group; it is
+        # only used to read partition metadata and the group's committed offsets.
+        self.consumer = Consumer({
+            'bootstrap.servers': self.kafka_server,
+            'group.id': self.group_id,
+            'enable.auto.commit': False
+        })
+
+    def update(self):
+        """
+        Fetch the group's current lag on our topics, which is also returned.
+        Returns None if Kafka cannot be reached.
+        """
+        try:
+            (self.lag, self.committed, self.num_partitions) = get_lag(self.consumer, self.topics)
+        except Exception as err:
+            log('ERROR', f'Unable to fetch consumer lag: {err}')
+            self.lag = None
+        return self.lag
+
+    def desired_count(self, current):
+        """
+        Get the number of workers we want to run, given the current number of
+        workers and the lag from the last call to update(). Falls back to the
+        current count if the lag is unknown.
+        """
+        if self.lag is None:
+            return current
+        now = time.time()
+        rate = None
+        if self.prev_committed is not None and now > self.prev_time:
+            rate = max(self.committed - self.prev_committed, 0) / (now - self.prev_time)
+        self.prev_committed = self.committed
+        self.prev_time = now
+        # More consumers than this node's share of the partitions would sit idle
+        upper = max(min(self.max_count, math.ceil(self.num_partitions / self.node_count)), self.min_count)
+        desired = compute_desired(current, self.lag, rate, self.target_drain_secs)
+        desired = min(max(desired, self.min_count), upper)
+        log('INFO', f'Consumer lag: {self.lag}, rate: {rate} msgs/s, partitions: {self.num_partitions}, '
+                    f'workers: {current} -> {desired}')
+        return desired
+
+
+def compute_desired(current, lag, rate, target_drain_secs):
+    """
+    Compute the number of workers needed to drain `lag` messages within
+    `target_drain_secs`, given the current group-wide consumption `rate` in
+    messages per second (None if unknown). We scale up all at once but scale
+    down one worker at a time to avoid thrashing.
+    """
+    if lag <= 0:
+        return current - 1
+    if not rate or not current:
+        # No throughput measurement yet; add a single worker
+        return current + 1
+    per_worker = rate / current
+    needed = math.ceil(lag / (per_worker * target_drain_secs))
+    if needed < current:
+        return current - 1
+    return needed
+
+
+def get_lag(consumer, topics):
+    """
+    Get the total lag, total committed offset, and total partition count for a
+    consumer's group across a list of topics.
+    """
+    partitions = []
+    for topic in topics:
+        metadata = consumer.list_topics(topic, timeout=10).topics[topic]
+        partitions.extend(TopicPartition(topic, p) for p in metadata.partitions)
+    lag = 0
+    committed_total = 0
+    for tp in consumer.committed(partitions, timeout=10):
+        (low, high) = consumer.get_watermark_offsets(tp, timeout=10)
+        # A negative offset means nothing has been committed for the partition yet
+        committed = tp.offset if tp.offset >= 0 else low
+        committed_total += committed
+        lag += max(high - committed, 0)
+    return (lag, committed_total, len(partitions))
@@ -0,0 +1,65 @@
+"""
+Save a stream of (collection, document) pairs, such as the output of the
+document generators, in large batches with several collections loading in
+parallel.
+
+Only one batch per collection is in flight at a time, so the documents for
+each collection are saved in the order they were added. Documents are written
+with the configured writer backend (see re_client._send), and never spooled:
+callers such as backfills record their progress once close() returns, and exit
+soon after, so any error must be raised rather than left in the spool.
+"""
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from src.utils.documents import Edge
+from src.utils.logger import log
+from src.utils.re_client import save
+
+
+@dataclass
+class BulkLoader:
+    batch_size: int = field(default=10000)  # number of documents to save in each request
+    threads: int = field(default=4)  # max number of collections to load at once
+    executor: ThreadPoolExecutor = field(init=False)
+    pending: Dict[str, List] = field(init=False, default_factory=dict)  # documents not yet submitted, per collection
+    in_flight: Dict[str, Future] = field(init=False, default_factory=dict)  # latest submitted batch, per collection
+    counts: Dict[str, int] = field(init=False, default_factory=dict)  # documents submitted, per collection
+
+    def __post_init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def add(self, coll, doc):
+        """Add a document (a dict, or an Edge) to save to a collection."""
+        docs = self.pending.setdefault(coll, [])
+        docs.append(doc)
+        if len(docs) >= self.batch_size:
+            self._submit(coll)
+
+    def close(self):
+        """Save all remaining documents and wait for every batch to finish. Raises the first error."""
+        for coll in list(self.pending):
+            self._submit(coll)
+        try:
+            for future in self.in_flight.values():
+                future.result()
+        finally:
+            self.executor.shutdown()
+        return self.counts
+
+    def _submit(self, coll):
+        docs = self.pending.pop(coll)
+        prev = self.in_flight.get(coll)
+        if prev is not None:
+            # Keep each collection's batches in order; this also raises any error from the last one
+            prev.result()
+        self.counts[coll] = self.counts.get(coll, 0) + len(docs)
+        self.in_flight[coll] = self.executor.submit(_save_batch, coll, docs)
+
+
+def _save_batch(coll, docs):
+    # Edges have deterministic keys, so they are replaced; vertices are updated (see DocBatch)
+    on_duplicate = 'replace' if isinstance(docs[0], Edge) else 'update'
+    log('INFO', f'Saving {len(docs)} documents to {coll}')
+    save(coll, docs, on_duplicate=on_duplicate, spool=False)
@@ -0,0 +1,67 @@
+"""
+Collapse redundant workspace events for the same object within a batch.
+
+Kafka often delivers bursts of events for a single object, such as many
+NEW_VERSION events in a row, or a RENAME_OBJECT followed by NEW_VERSION. Rather
+than fetching and importing the object once per event, we merge all the import
+events for an object into a single event with a list of versions ('vers'), so
+they can be fetched from the workspace in one request. Imports are never
+merged across a deletion state change of the same object (which may be an
+undelete), so every event is still handled in order relative to it.
+"""
+
+# Events that import an object version (the version is optional and defaults to the latest)
+_IMPORT_EVENTS = {'IMPORT', 'NEW_VERSION', 'COPY_OBJECT', 'RENAME_OBJECT'}
+# Imports an object version only if it does not already exist
+_IMPORT_NONEXISTENT = 'IMPORT_NONEXISTENT'
+_DELETE_OBJ = 'OBJECT_DELETE_STATE_CHANGE'
+
+
+def coalesce(msgs):
+    """
+    Coalesce a list of event messages, preserving the relative order of events for each object.
+    Merged import events have a 'vers' list instead of a 'ver' field, where a
+    version of None means the latest version. For each object, there will be at
+    most one unconditional import and one IMPORT_NONEXISTENT event before,
+    between, and after its deletion state change events, and IMPORT_NONEXISTENT
+    will not repeat versions that are imported unconditionally.
+    """
+    out = []  # type: list
+    # Map of (wsid, objid) to the index in `out` of the pending merged import events for that object
+    pending = {}  # type: dict
+    # Slots of merged import events that were closed by a deletion state change
+    closed = []  # type: list
+    for msg in msgs:
+        evtype = msg.get('evtype')
+        key = (msg.get('wsid'), msg.get('objid'))
+        if evtype in _IMPORT_EVENTS or evtype == _IMPORT_NONEXISTENT:
+            conditional = evtype == _IMPORT_NONEXISTENT
+            slots = pending.setdefault(key, {})
+            if conditional not in slots:
+                merged = {k: v for (k, v) in msg.items() if k != 'ver'}
+                merged['vers'] = []
+                slots[conditional] = len(out)
+                out.append(merged)
+            merged = out[slots[conditional]]
+            # The latest event's fields take precedence
+            merged.update({k: v for (k, v) in msg.items() if k != 'ver'})
+            ver = msg.get('ver')
+            if ver not in merged['vers']:
+                merged['vers'].append(ver)
+        elif evtype == _DELETE_OBJ:
+            # Imports after this start a new merged event, so they stay in order with the state change
+            slots = pending.pop(key, None)
+            if slots is not None:
+                closed.append(slots)
+            out.append(msg)
+        else:
+            out.append(msg)
+    # Remove versions from conditional imports that are already imported unconditionally
+    for slots in closed + list(pending.values()):
+        if True in slots and False in slots:
+            imported = out[slots[False]]['vers']
+            cond = out[slots[True]]
+            cond['vers'] = [v for v in cond['vers'] if v not in imported]
+            if not cond['vers']:
+                out[slots[True]] = None
+    return [msg for msg in out if msg is not None]
@@ -4,6 +4,9 @@ import functools
 # Prefix used by KBase when setting dynamic service env vars
 _ENV_PREFIX = "KBASE_SECURE_CONFIG_PARAM_"
 
+# Ways of handling oversized fields (see src/utils/payload.py)
+_OVERSIZED_FIELD_POLICIES = ('none', 'drop', 'offload')
+
 
 def _get_env(name, default):
     """Get an env var with the kbase sdk prefix."""
@@ -20,16 +23,119 @@ def get_config():
     re_url = _get_env('RE_URL', 'http://re_api:5000').strip('/')
     # Get the URL of the workspace API
     ws_url = _get_env('WORKSPACE_URL', 'http://workspace:5000').strip('/')
-    return {
+    config = {
         'ws_url': ws_url,
         're_api_url': re_url,
         'ws_token': ws_token,
         're_token': re_token,
-        'num_consumers': _get_env('NUM_CONSUMERS', 8),
+        # Max number of consumer processes for live workspace events
+        'num_consumers': int(_get_env('NUM_CONSUMERS', 8)),
+        # Min number of consumer processes for live workspace events; set equal to NUM_CONSUMERS to disable autoscaling
+        'min_consumers': int(_get_env('MIN_CONSUMERS', 1)),
+        # Number of consumer processes for the admin lane (the re_admin_events topic), which is
+        # kept separate from the live workspace events so that reindexing cannot delay them
+        'num_admin_consumers': int(_get_env('NUM_ADMIN_CONSUMERS', 1)),
+        # Max events per second handled by each admin consumer; 0 for no limit
+        'admin_rate_limit': float(_get_env('ADMIN_RATE_LIMIT', 0)),
+        # Lag on the live workspace events topic above which the admin lane is paused; it is
+        # resumed once the live lag drops to half of this. 0 to never pause the admin lane.
+        'admin_pause_lag': int(_get_env('ADMIN_PAUSE_LAG', 1000)),
+        # Seconds between autoscaling checks
+        'autoscale_interval': float(_get_env('AUTOSCALE_INTERVAL', 30)),
+        # Number of seconds in which we want to be able to drain the consumer lag
+        'autoscale_target_drain': float(_get_env('AUTOSCALE_TARGET_DRAIN', 60)),
+        # Max seconds to wait before restarting a crashed worker
+        'restart_backoff_max': float(_get_env('RESTART_BACKOFF_MAX', 60)),
+        # Number of crashes of a single worker within 5 minutes before the supervisor gives up
+        'crash_loop_count': int(_get_env('CRASH_LOOP_COUNT', 5)),
+        # Seconds that consumers have to finish in-flight work and exit after a SIGTERM
+        'shutdown_timeout': float(_get_env('SHUTDOWN_TIMEOUT', 25)),
+        # Max number of events to read at once and coalesce (see src/utils/coalesce.py)
+        'coalesce_batch_size': int(_get_env('COALESCE_BATCH_SIZE', 100)),
+        # Max seconds to wait while filling a batch of events
+        'coalesce_window': float(_get_env('COALESCE_WINDOW', 1)),
+        # Seconds to wait for a response from the workspace, RE API, or ArangoDB before giving up on a request
+        'request_timeout': float(_get_env('REQUEST_TIMEOUT', 120)),
+        # Seconds to wait before reading a batch of events again when RE was unavailable
+        'unavailable_retry_interval': float(_get_env('UNAVAILABLE_RETRY_INTERVAL', 5)),
+        # Path of a SQLite database of imported object versions, shared by all consumers; empty to disable
+        'ledger_path': _get_env('LEDGER_PATH', ''),
+        # Number of bits in the ledger's Bloom filter; 0 to disable the filter
+        'ledger_bloom_bits': int(_get_env('LEDGER_BLOOM_BITS', 2 ** 24)),
+        # Path of a SQLite cache of workspace info, shared by all processes; empty for a per-process cache
+        'ws_info_cache_path': _get_env('WS_INFO_CACHE_PATH', ''),
+        # Seconds before cached workspace info is re-fetched
+        'ws_info_cache_ttl': float(_get_env('WS_INFO_CACHE_TTL', 300)),
+        # Where documents are written: 're_api' for the RE API, or 'arango' to use ArangoDB's bulk import
+        # API directly, bypassing the RE API. Only use 'arango' for trusted deployments, such as initial loads.
+        'writer_backend': _get_env('WRITER_BACKEND', 're_api'),
+        'arango_url': _get_env('ARANGO_URL', 'http://arangodb:8529').strip('/'),
+        'arango_db': _get_env('ARANGO_DB', '_system'),
+        'arango_user': _get_env('ARANGO_USER', 'root'),
+        'arango_pass': _get_env('ARANGO_PASS', ''),
+        # Number of supervisors (nodes) sharing the work, and this node's index from 0 to node_count - 1.
+        # Live consumers are capped at this node's share of the partitions, and backfill and reconcile
+        # jobs only process the workspaces in this node's shard (see src/utils/sharding.py).
+        'node_count': int(_get_env('NODE_COUNT', 1)),
+        'node_index': int(_get_env('NODE_INDEX', 0)),
+        # Directory shared by all nodes where jobs hold a lease on each workspace they are processing,
+        # so that overlapping jobs skip it; empty to disable
+        'lease_dir': _get_env('LEASE_DIR', ''),
+        # Seconds after which a lease that has not been renewed is considered abandoned
+        'lease_ttl': float(_get_env('LEASE_TTL', 600)),
+        # Path of a SQLite database of per-workspace high-water marks for incremental backfills
+        'watermark_path': _get_env('WATERMARK_PATH', 'watermarks.db'),
+        # Max size in bytes of a single request saving documents; larger saves are split (see src/utils/payload.py)
+        'max_payload_bytes': int(_get_env('MAX_PAYLOAD_BYTES', 2 ** 23)),
+        # Documents larger than this many bytes have their fields over this size handled by the oversized
+        # field policy: 'none' to save them as-is, 'drop' to save them as null, or 'offload' to write
+        # them to files under offload_dir and save them as null
+        'max_field_bytes': int(_get_env('MAX_FIELD_BYTES', 2 ** 20)),
+        'oversized_field_policy': _get_env('OVERSIZED_FIELD_POLICY', 'none'),
+        'offload_dir': _get_env('OFFLOAD_DIR', ''),
+        # Directory of a local spool for documents that could not be saved while the RE API was
+        # unavailable (see src/utils/spool.py); empty to disable
+        'spool_dir': _get_env('SPOOL_DIR', ''),
+        # Documents are not spooled while the spool is larger than this many bytes; RE is treated as unavailable
+        'spool_max_bytes': int(_get_env('SPOOL_MAX_BYTES', 2 ** 30)),
+        # Seconds between attempts to replay spooled documents
+        'spool_drain_interval': float(_get_env('SPOOL_DRAIN_INTERVAL', 5)),
+        # Directory to write sampled traces of event handling to (see src/utils/trace.py); empty to disable
+        'trace_dir': _get_env('TRACE_DIR', ''),
+        # Fraction of batches of events to trace
+        'trace_sample_rate': float(_get_env('TRACE_SAMPLE_RATE', 0.01)),
+        # Directory to write profiles started and stopped with SIGUSR1 to; empty for the temp directory
+        'profile_dir': _get_env('PROFILE_DIR', ''),
+        # Max number of objects to fetch details for in a single getObjects request
+        'ws_chunk_size': int(_get_env('WS_CHUNK_SIZE', 100)),
         'kafka_server': _get_env('KAFKA_SERVER', 'kafka'),
         'kafka_clientgroup': _get_env('KAFKA_CLIENTGROUP', 'releng_sync'),
+        # Partition assignment strategy for the consumer group, such as 'cooperative-sticky' or 'range,roundrobin'
+        'kafka_assignment_strategy': _get_env('KAFKA_ASSIGNMENT_STRATEGY', 'cooperative-sticky'),
+        # Prefix for static group membership IDs, which are '<prefix>-<worker index>' for live
+        # consumers and '<prefix>-admin-<worker index>' for admin consumers.
+        # Must be unique per supervisor (eg. the pod name). Leave empty to disable static membership.
+        'kafka_instance_id_prefix': _get_env('KAFKA_INSTANCE_ID_PREFIX', ''),
+        # Seconds before the group considers a silent consumer dead and rebalances its partitions
+        'kafka_session_timeout': float(_get_env('KAFKA_SESSION_TIMEOUT', 45)),
         'kafka_topics': {
             'workspace_events': _get_env('KAFKA_WORKSPACE_TOPIC', 'workspaceevents'),
             're_admin_events': _get_env('RE_WS_ADMIN_TOPIC', 're_admin_events'),
         }
     }
+    _validate(config)
+    return config
+
+
+def _validate(config):
+    """Raise a RuntimeError for invalid settings, so that they are caught at startup."""
+    policy = config['oversized_field_policy']
+    if policy not in _OVERSIZED_FIELD_POLICIES:
+        raise RuntimeError(f'OVERSIZED_FIELD_POLICY must be one of {_OVERSIZED_FIELD_POLICIES}, not {policy!r}')
+    if policy == 'offload' and not config['offload_dir']:
+        raise RuntimeError('OFFLOAD_DIR must be set to offload oversized fields')
+    if config['node_count'] < 1:
+        raise RuntimeError(f"NODE_COUNT must be at least 1, not {config['node_count']}")
+    if not 0 <= config['node_index'] < config['node_count']:
+        raise RuntimeError(f"NODE_INDEX must be from 0 to NODE_COUNT - 1 ({config['node_count'] - 1}), "
+                           f"not {config['node_index']}")
@@ -0,0 +1,79 @@
+"""
+Collect documents for several collections and save them in bulk.
+
+Documents are deduplicated by `_key` within the batch (the last one added
+wins), and each collection is saved with a single request when the batch is
+flushed, with several collections saving in parallel. Vertices are saved with on_duplicate 'update', so fields set
+elsewhere are kept. Edges have deterministic keys, so they are saved with
+on_duplicate 'replace'.
+
+Documents added with `add_max` are only saved if they have a greater value for
+some field than the existing document (such as a latest-version pointer). Only
+the greatest document per key in the batch is sent, using one conditional
+upsert query per collection.
+"""
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+
+from src.utils.documents import Edge
+from src.utils.logger import log
+from src.utils.re_client import save_many, upsert_max
+from src.utils.trace import traced
+
+
+@dataclass
+class DocBatch:
+    docs: Dict[str, dict] = field(default_factory=dict)  # map of collection name to a map of _key to doc
+    # map of (collection name, field name) to a map of _key to doc, for docs added with add_max
+    max_docs: Dict[Tuple[str, str], dict] = field(default_factory=dict)
+    callbacks: List[Callable] = field(default_factory=list)  # functions to call after a flush that saved everything
+
+    def add(self, coll, doc):
+        """Add a document (a dict with a '_key', or an Edge) to a collection."""
+        key = doc.key if isinstance(doc, Edge) else doc['_key']
+        self.docs.setdefault(coll, {})[key] = doc
+
+    def add_max(self, coll, doc, field_name):
+        """
+        Add a document (a dict with a '_key') that should only overwrite an
+        existing document if its `field_name` value is greater.
+        """
+        docs = self.max_docs.setdefault((coll, field_name), {})
+        existing = docs.get(doc['_key'])
+        if existing is None or doc[field_name] > existing[field_name]:
+            docs[doc['_key']] = doc
+
+    def on_flush(self, callback):
+        """
+        Call `callback` once everything currently in the batch has been saved.
+        It is not called if any documents were spooled instead (see re_client.save).
+        """
+        self.callbacks.append(callback)
+
+    @traced
+    def flush(self):
+        """Save all documents, one request per collection, and empty the batch."""
+        (docs, self.docs) = (self.docs, {})
+        (max_docs, self.max_docs) = (self.max_docs, {})
+        (callbacks, self.callbacks) = (self.callbacks, [])
+        batches = []
+        for (coll, coll_docs) in docs.items():
+            values = list(coll_docs.values())
+            on_duplicate = 'replace' if isinstance(values[0], Edge) else 'update'
+            log('INFO', f'Saving {len(values)} documents to {coll}')
+            batches.append((coll, values, on_duplicate))
+        results = list(save_many(batches).values()) if batches else []
+        for ((coll, field_name), coll_docs) in max_docs.items():
+            log('INFO', f'Upserting {len(coll_docs)} documents to {coll} by {field_name}')
+            results.append(upsert_max(coll, list(coll_docs.values()), field_name))
+        if any(result is None for result in results):
+            # Some documents were spooled rather than saved, so they may still never be saved
+            if callbacks:
+                log('INFO', 'Documents were spooled; skipping the callbacks for this batch')
+            return
+        for callback in callbacks:
+            callback()
+
+    def __len__(self):
+        return (sum(len(coll_docs) for coll_docs in self.docs.values()) +
+                sum(len(coll_docs) for coll_docs in self.max_docs.values()))
@@ -0,0 +1,82 @@
+"""
+Compact in-memory representations of workspace object info and arango edges.
+
+Workspace object_info tuples are wrapped in a namedtuple so fields can be
+accessed by name without copying. Edges hold their collection names and keys
+separately, so the long collection prefixes of `_from` and `_to` are shared
+(interned) strings rather than a fresh concatenation for every edge. Edges are
+only converted into dicts when they are serialized.
+
+Every edge gets a deterministic `_key` derived from its `_from` and `_to`, so
+saving the same edge twice overwrites it rather than creating a duplicate.
+"""
+import hashlib
+from typing import NamedTuple, Optional
+
+
+class ObjectInfo(NamedTuple):
+    """
+    Workspace object_info tuple
+    https://kbase.us/services/ws/docs/Workspace.html#typedefWorkspace.object_info
+    """
+    objid: int
+    name: str
+    type: str
+    save_date: str
+    version: int
+    saved_by: str
+    wsid: int
+    workspace: str
+    chsum: str
+    size: int
+    meta: dict
+
+    def upa(self, delimiter='/'):
+        """Get the upa, such as "1/2/3"."""
+        return delimiter.join([str(self.wsid), str(self.objid), str(self.version)])
+
+
+class Edge(NamedTuple):
+    """An arango edge document, eg. from 'wsfull_object_version/1:2:3' to 'wsfull_object/1:2'."""
+    from_coll: str
+    from_key: str
+    to_coll: str
+    to_key: str
+    data: Optional[dict] = None  # any extra fields for the document
+
+    @property
+    def from_id(self):
+        return self.from_coll + '/' + self.from_key
+
+    @property
+    def to_id(self):
+        return self.to_coll + '/' + self.to_key
+
+    @property
+    def key(self):
+        """Deterministic _key for the edge, unique per pair of _from and _to within a collection."""
+        return edge_key(self.from_id, self.to_id)
+
+    def to_doc(self):
+        """Convert into a document dict for saving."""
+        doc = {'_key': self.key, '_from': self.from_id, '_to': self.to_id}
+        if self.data:
+            doc.update(self.data)
+        return doc
+
+
+def edge_key(from_id, to_id, *extra):
+    """
+    Get a deterministic _key for an edge document from its _from and _to IDs.
+    Any `extra` values distinguish edges of different kinds between the same
+    two vertices in one collection, such as the 'type' of a wsprov_links edge.
+    """
+    parts = [from_id, to_id] + [str(val) for val in extra]
+    return hashlib.blake2b('\n'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def to_doc(doc):
+    """Convert an Edge into a dict, passing other documents through as-is."""
+    if isinstance(doc, Edge):
+        return doc.to_doc()
+    return doc
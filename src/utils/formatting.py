@@ -1,9 +1,14 @@
-import time
+from datetime import datetime, timezone
 
 
 def ts_to_epoch(ts):
-    """Convert a string timestamp into a ms epoch integer."""
-    return int(time.mktime(time.strptime(ts, "%Y-%m-%dT%H:%M:%S%z"))) * 1000
+    """Convert a string timestamp, with a UTC offset, into a ms epoch integer."""
+    return int(datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S%z").timestamp()) * 1000
+
+
+def epoch_to_ts(epoch):
+    """Convert a ms epoch integer from ts_to_epoch back into a workspace string timestamp, in UTC."""
+    return datetime.fromtimestamp(epoch // 1000, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+0000")
 
 
 def _get_module_ver_hash(prov):
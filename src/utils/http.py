@@ -0,0 +1,35 @@
+"""
+Lazily created HTTP sessions, so that connections to the workspace, RE API,
+and ArangoDB are kept alive and reused between requests.
+
+Each thread gets its own session, created on first use, and a forked worker
+process never reuses its parent's session (or its open connections).
+"""
+import os
+import threading
+import requests
+
+_LOCAL = threading.local()
+
+# Function that creates a new session; see set_session_factory
+_FACTORY = requests.Session
+
+
+def get_session():
+    """Get the requests Session for this thread and process."""
+    key = (os.getpid(), _FACTORY)
+    if getattr(_LOCAL, 'key', None) != key:
+        _LOCAL.session = _FACTORY()
+        _LOCAL.key = key
+    return _LOCAL.session
+
+
+def set_session_factory(factory=requests.Session):
+    """
+    Create sessions with `factory` instead of requests.Session, such as to
+    send every request to in-process fakes in tests (see src/test/fakes.py).
+    Sessions created by the previous factory are replaced on their next use.
+    Call with no arguments to restore the default.
+    """
+    global _FACTORY
+    _FACTORY = factory
@@ -0,0 +1,151 @@
+"""
+Incremental parsing of large JSON responses.
+
+Workspace responses such as `listObjects` can hold 10k rows, and `getObjects`
+can hold very large provenance data. Rather than loading the whole response
+body with `resp.json()`, we walk down to a single nested array and decode its
+elements one at a time, so memory use is bounded by the largest element.
+"""
+import json
+
+_WHITESPACE = ' \t\n\r'
+_DECODER = json.JSONDecoder()
+
+
+def iter_array(chunks, path):
+    """
+    Yield each element of a JSON array nested inside a streamed JSON document.
+    Args:
+        chunks - iterable of text chunks making up a single JSON document
+        path - list of object keys (strings) and array indexes (integers) leading to the array
+    Example:
+        iter_array(chunks, ['result', 0, 'data']) yields every entry in doc['result'][0]['data']
+    Raises a ValueError if the document does not match the path, or if the
+    document has a top-level "error" key before the path is found.
+    """
+    reader = _Reader(iter(chunks))
+    for step in path:
+        if isinstance(step, int):
+            _seek_index(reader, step)
+        else:
+            _seek_key(reader, step)
+    reader.expect('[')
+    if reader.peek() == ']':
+        return
+    while True:
+        yield reader.decode_value()
+        delim = reader.next_char()
+        if delim == ']':
+            return
+        if delim != ',':
+            raise ValueError(f'Expected "," or "]" in JSON array, got {delim!r}')
+
+
+def _seek_key(reader, key):
+    """Advance the reader to the value for `key` in the current JSON object."""
+    reader.expect('{')
+    while True:
+        if reader.peek() == '}':
+            raise ValueError(f'Key {key!r} not found in JSON object')
+        found = reader.decode_value()
+        reader.expect(':')
+        if found == key:
+            return
+        val = reader.decode_value()
+        if found == 'error':
+            raise ValueError(f'Error in JSON response: {val}')
+        delim = reader.next_char()
+        if delim == '}':
+            raise ValueError(f'Key {key!r} not found in JSON object')
+        if delim != ',':
+            raise ValueError(f'Expected "," or "}}" in JSON object, got {delim!r}')
+
+
+def _seek_index(reader, idx):
+    """Advance the reader to the element at `idx` in the current JSON array."""
+    reader.expect('[')
+    for _ in range(idx):
+        if reader.peek() == ']':
+            raise ValueError(f'Index {idx} out of range in JSON array')
+        reader.decode_value()
+        reader.expect(',')
+    if reader.peek() == ']':
+        raise ValueError(f'Index {idx} out of range in JSON array')
+
+
+class _Reader:
+    """Buffered reader over an iterator of text chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buf = ''
+        self.pos = 0
+        self.done = False
+
+    def _fill(self):
+        """Read another chunk into the buffer, dropping consumed text. Returns False at end of input."""
+        if self.done:
+            return False
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.done = True
+            return False
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode('utf-8')
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _grow(self):
+        """
+        Double the amount of unconsumed buffered text (or read to the end).
+        Growing geometrically keeps re-decoding of a large, partially read
+        value linear in its size.
+        """
+        target = 2 * max(len(self.buf) - self.pos, 1)
+        grew = False
+        while len(self.buf) - self.pos < target and self._fill():
+            grew = True
+        return grew
+
+    def _skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        self._skip_whitespace()
+        if self.pos >= len(self.buf):
+            raise ValueError('Unexpected end of JSON input')
+        return self.buf[self.pos]
+
+    def next_char(self):
+        """Consume and return the next non-whitespace character."""
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def expect(self, char):
+        found = self.next_char()
+        if found != char:
+            raise ValueError(f'Expected {char!r} in JSON input, got {found!r}')
+
+    def decode_value(self):
+        """Decode one complete JSON value, reading more input as needed."""
+        self._skip_whitespace()
+        while True:
+            try:
+                (val, end) = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._grow():
+                    raise
+                continue
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.done and self._fill():
+                continue
+            self.pos = end
+            return val
@@ -0,0 +1,96 @@
+"""
+A local ledger of object versions that have already been imported into RE.
+
+Object versions in the workspace are immutable, so once a version has been
+imported we never need to download or save it again. The ledger is a SQLite
+table shared by all the worker processes on a host, fronted by a Bloom filter
+in a shared memory-mapped file. The Bloom filter answers most lookups for
+versions that have never been imported without touching SQLite. It can have
+false positives, which are confirmed against SQLite, but no false negatives
+other than the harmless case of two processes racing to set bits in the same
+byte (which only causes an unneeded re-import).
+
+The ledger must be cleared if the RE database is reset, or if the import
+transforms change in a way that requires re-importing existing versions.
+"""
+import hashlib
+import mmap
+import os
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from src.utils.local_store import connect
+
+
+@dataclass
+class Ledger:
+    path: str  # path of the SQLite database; the Bloom filter is stored at path + '.bloom'
+    bloom_bits: int = field(default=2 ** 24)  # size of the Bloom filter; 0 disables it
+    bloom_hashes: int = field(default=7)
+    conn: Any = field(init=False)
+    bloom: Optional['_BloomFilter'] = field(init=False, default=None)
+
+    def __post_init__(self):
+        self.conn = connect(self.path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS imported (upa TEXT PRIMARY KEY) WITHOUT ROWID')
+        if self.bloom_bits:
+            (self.bloom, created) = _BloomFilter.open(self.path + '.bloom', self.bloom_bits, self.bloom_hashes)
+            if created:
+                # Populate a new filter with anything already in the ledger
+                for (upa,) in self.conn.execute('SELECT upa FROM imported'):
+                    self.bloom.add(upa)
+
+    def contains(self, upa):
+        """Check whether an object version (such as '1:2:3') has been imported."""
+        if self.bloom is not None and not self.bloom.might_contain(upa):
+            return False
+        row = self.conn.execute('SELECT 1 FROM imported WHERE upa = ?', (upa,)).fetchone()
+        return row is not None
+
+    def add(self, upa):
+        """Record that an object version has been imported."""
+        self.conn.execute('INSERT OR IGNORE INTO imported (upa) VALUES (?)', (upa,))
+        if self.bloom is not None:
+            self.bloom.add(upa)
+
+
+@dataclass
+class _BloomFilter:
+    bits: mmap.mmap
+    num_bits: int
+    num_hashes: int
+
+    @classmethod
+    def open(cls, path, num_bits, num_hashes):
+        """
+        Open or create a Bloom filter backed by a file that is mapped into memory
+        and shared with other processes. Returns a pair of (filter, created).
+        """
+        num_bytes = (num_bits + 7) // 8
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+            created = True
+        except FileExistsError:
+            fd = os.open(path, os.O_RDWR)
+            created = False
+        try:
+            # Another process may have created the file but not yet sized it
+            if os.fstat(fd).st_size < num_bytes:
+                os.ftruncate(fd, num_bytes)
+            bits = mmap.mmap(fd, num_bytes)
+        finally:
+            os.close(fd)
+        return (cls(bits, num_bytes * 8, num_hashes), created)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos // 8] |= 1 << (pos % 8)
+
+    def might_contain(self, item):
+        return all(self.bits[pos // 8] & (1 << (pos % 8)) for pos in self._positions(item))
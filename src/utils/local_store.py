@@ -0,0 +1,19 @@
+"""
+Local SQLite storage that can be shared by all the worker processes on a host.
+"""
+import sqlite3
+
+
+def connect(path):
+    """
+    Open a SQLite database that is safe for concurrent use by several processes.
+    Each process must open its own connection (never share one across a fork).
+    Use a `path` of ':memory:' for a private, in-process database.
+    """
+    # isolation_level=None puts the connection in autocommit mode
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if path != ':memory:':
+        # Write-ahead logging allows readers and a writer to run concurrently
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
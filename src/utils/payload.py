@@ -0,0 +1,104 @@
+"""
+Keep the requests that save documents to a predictable size.
+
+Saves are split into requests of at most MAX_PAYLOAD_BYTES, so a batch with a
+few large documents becomes several requests rather than one huge one.
+
+A document can also be too large by itself, usually because of one field,
+such as the method_params copied from provenance into
+wsfull_obj_created_with_method edges. When a document is larger than
+MAX_FIELD_BYTES, each of its fields larger than that is handled according to
+OVERSIZED_FIELD_POLICY:
+    none - save the field as-is
+    drop - save the field as null
+    offload - write the field's value to a JSON file under OFFLOAD_DIR, and save it as null
+In the last two cases, the document gets an 'oversized_fields' field recording
+the original size of each field and, if offloaded, where it was written.
+Each action is counted, and the counts are logged as they change.
+"""
+import json
+import os
+from collections import Counter
+from urllib.parse import quote
+
+from src.utils.config import get_config
+from src.utils.logger import log
+
+# Number of oversized fields handled with each policy in this process
+COUNTS = Counter()  # type: Counter
+
+# Fields that identify a document, which are never removed
+_ID_FIELDS = {'_key', '_from', '_to'}
+
+# How each policy is described in the logs
+_ACTIONS = {'drop': 'Dropped', 'offload': 'Offloaded'}
+
+
+def split_payload(lines, max_bytes):
+    """
+    Split a list of documents as JSON strings into lists that are at most
+    `max_bytes` once joined with linebreaks. A document larger than that by
+    itself is sent on its own.
+    """
+    chunk = []  # type: list
+    size = 0
+    for line in lines:
+        if chunk and size + len(line) + 1 > max_bytes:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        yield chunk
+
+
+def dump_doc(coll_name, doc):
+    """
+    Serialize a document for saving to a collection, applying the oversized
+    field policy if the document is larger than MAX_FIELD_BYTES.
+    """
+    line = json.dumps(doc)
+    config = get_config()
+    # json.dumps escapes any non-ASCII characters, so the length is the size in bytes
+    if len(line) <= config['max_field_bytes'] or config['oversized_field_policy'] == 'none':
+        return line
+    doc = dict(doc)
+    oversized = {}
+    for (name, val) in doc.items():
+        if name in _ID_FIELDS:
+            continue
+        val_json = json.dumps(val)
+        if len(val_json) > config['max_field_bytes']:
+            oversized[name] = _handle_field(config, coll_name, doc['_key'], name, val_json)
+    if not oversized:
+        return line
+    for name in oversized:
+        doc[name] = None
+    doc['oversized_fields'] = oversized
+    return json.dumps(doc)
+
+
+def _handle_field(config, coll_name, key, name, val_json):
+    """Drop or offload a field's value (as JSON), returning a note of what was done for the document."""
+    policy = config['oversized_field_policy']
+    note = {'bytes': len(val_json)}
+    if policy == 'offload':
+        note['offloaded_to'] = _offload(config['offload_dir'], coll_name, key, name, val_json)
+    COUNTS[policy] += 1
+    log('INFO', f'{_ACTIONS[policy]} field {name} ({len(val_json)} bytes) of {coll_name}/{key}; '
+                f'oversized fields handled so far: {dict(COUNTS)}')
+    return note
+
+
+def _offload(offload_dir, coll_name, key, name, val_json):
+    """Write a field's value to a file, returning its path."""
+    dir_path = os.path.join(offload_dir, coll_name)
+    os.makedirs(dir_path, exist_ok=True)
+    path = os.path.join(dir_path, f"{quote(key, safe='')}.{name}.json")
+    # Write to a temporary file and rename, so a partly written file is never visible
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as fd:
+        fd.write(val_json)
+    os.rename(tmp_path, path)
+    return path
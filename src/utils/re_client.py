@@ -1,111 +1,480 @@
 """
 Relation Engine API client
+
+REClient provides bulk reads and writes; AsyncREClient wraps it for asyncio.
+The module-level functions use a shared REClient.
 """
+import asyncio
+import functools
 import json
 import os
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Optional
 from urllib.parse import urljoin
 
+from . import arango_client
 from .config import get_config
+from .http import get_session
+from .documents import to_doc
+from .logger import log
+from .payload import dump_doc, split_payload
+from .spool import Spool, SpoolFull
+from .trace import bind, span, traced
+
+
+class REUnavailable(RuntimeError):
+    """The RE API could not be reached, or is temporarily unable to handle requests."""
+
+
+# Response statuses that mean the RE API (or ArangoDB behind it) is temporarily down
+_UNAVAILABLE_STATUSES = {502, 503, 504}
+# Errors for which documents are spooled, for each writer backend
+UNAVAILABLE_ERRORS = (REUnavailable, arango_client.ArangoUnavailable)
+
+
+class REBulkError(RuntimeError):
+    """A bulk save was accepted, but some of its documents could not be saved."""
 
-_CONFIG = get_config()
+    def __init__(self, coll_name, result):
+        self.coll_name = coll_name
+        self.result = result
+        details = '; '.join(result.get('details', [])[:5])
+        super().__init__(f"{result['errors']} documents could not be saved to {coll_name}: {details}")
+
+
+_GET_DOC_QUERY = """
+for v in @@coll filter v._key == @key limit 1 return v
+"""
+
+_DOC_EXISTS_QUERY = """
+for d in @@coll filter d._key == @key limit 1 return 1
+"""
+
+_GET_EDGE_QUERY = """
+for v in @@coll
+    filter v._from == @from AND v._to == @to
+    limit 1
+    return v
+"""
+
+_GET_DOCS_QUERY = """
+FOR d IN @@coll
+    FILTER d._key IN @keys
+    RETURN d
+"""
+
+_GET_EDGES_QUERY = """
+FOR p IN @pairs
+    FOR e IN @@coll
+        FILTER e._from == p[0] AND e._to == p[1]
+        LIMIT 1
+        RETURN e
+"""
+
+_UPSERT_MAX_QUERY = """
+FOR d IN @docs
+    UPSERT {_key: d._key}
+    INSERT d
+    UPDATE (d[@field] > OLD[@field] ? d : {})
+    IN @@coll
+"""
 
 
 def get_doc(coll, key):
     """Fetch a doc in a collection by key."""
-    resp = requests.post(
-        _CONFIG['re_api_url'] + '/api/v1/query_results',
-        data=json.dumps({
-            'query': "for v in @@coll filter v._key == @key limit 1 return v",
-            '@coll': coll,
-            'key': key
-        }),
-        headers={'Authorization': _CONFIG['re_token']}
-    )
-    if not resp.ok:
-        raise RuntimeError(resp.text)
-    return resp.json()
+    return _CLIENT.query(_GET_DOC_QUERY, {'@coll': coll, 'key': key})
+
+
+def query_iter(query, bind_vars):
+    """
+    Run an AQL query, yielding each result. Large result sets are fetched a
+    page at a time using the RE API's cursor.
+    """
+    return _CLIENT.query_iter(query, bind_vars)
 
 
+@traced
 def check_doc_existence(_id):
     """Check if a doc exists in RE already by full ID."""
-    (coll, key) = _id.split('/')
-    query = """
-    for d in @@coll filter d._key == @key limit 1 return 1
-    """
-    resp = requests.post(
-        _CONFIG['re_api_url'] + '/api/v1/query_results',
-        data=json.dumps({
-            'query': query,
-            '@coll': coll,
-            'key': key
-        }),
-        headers={'Authorization': _CONFIG['re_token']}
-    )
-    if not resp.ok:
-        raise RuntimeError(resp.text)
-    return resp.json()['count'] > 0
+    return _CLIENT.check_doc_existence(_id)
 
 
 def get_edge(coll, from_key, to_key):
     """Fetch an edge by from and to keys."""
-    query = """
-    for v in @@coll
-        filter v._from == @from AND v._to == @to
-        limit 1
-        return v
-    """
-    resp = requests.post(
-        _CONFIG['re_api_url'] + '/api/v1/query_results',
-        data=json.dumps({
-            'query': query,
-            '@coll': coll,
-            'from': from_key,
-            'to': to_key
-        }),
-        headers={'Authorization': _CONFIG['re_token']}
-    )
-    if not resp.ok:
-        raise RuntimeError(resp.text)
-    return resp.json()
+    return _CLIENT.query(_GET_EDGE_QUERY, {'@coll': coll, 'from': from_key, 'to': to_key})
 
 
-def save(coll_name, docs):
+@dataclass
+class REClient:
+    """
+    Client for reading and writing documents in RE. Writes use the configured
+    writer backend and spool (see save()); reads always go through the RE API.
+    """
+    batch_size: int = field(default=1000)  # max keys (or edge endpoints) looked up in each query
+    threads: int = field(default=4)  # max number of collections to save at once in save_many
+    executor: Optional[ThreadPoolExecutor] = field(default=None, init=False)
+
+    def save(self, coll_name, docs, on_duplicate='update', spool=True):
+        """Bulk-save documents to a collection; see the module-level save()."""
+        # convert the docs into strings, which are saved separated by linebreaks
+        lines = [dump_doc(coll_name, to_doc(d)) for d in docs]
+        return _write(coll_name, on_duplicate, lines, spool)
+
+    def save_many(self, batches, spool=True):
+        """
+        Bulk-save documents to several collections at once, one request per
+        collection, with up to `threads` requests in flight.
+        Args:
+            batches - list of (collection name, docs, on_duplicate)
+            spool - spool the documents while RE is unavailable; see save()
+        Returns a dict of collection name to the import counts (or None, if spooled).
+        Raises the first error, after every request has finished.
+        """
+        if len(batches) == 1:
+            (coll_name, docs, on_duplicate) = batches[0]
+            return {coll_name: self.save(coll_name, docs, on_duplicate, spool)}
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        # The saves run on other threads, so they need the caller's trace state to record their spans
+        save = bind(self.save)
+        futures = [(coll_name, self.executor.submit(save, coll_name, docs, on_duplicate, spool))
+                   for (coll_name, docs, on_duplicate) in batches]
+        wait([future for (_, future) in futures])
+        return {coll_name: future.result() for (coll_name, future) in futures}
+
+    def upsert_max(self, coll_name, docs, field, spool=True):
+        """Conditionally upsert documents by a field; see the module-level upsert_max()."""
+        lines = [dump_doc(coll_name, d) for d in docs]
+        return _write(coll_name, 'max-' + field, lines, spool)
+
+    def query(self, query, bind_vars):
+        """Run an AQL query, returning the RE API's response (the first page of results)."""
+        resp = self._query_request(params=None, data=json.dumps({'query': query, **bind_vars}))
+        return resp.json()
+
+    def query_iter(self, query, bind_vars):
+        """
+        Run an AQL query, yielding each result. Large result sets are fetched a
+        page at a time using the RE API's cursor.
+        """
+        for page in self._query_pages(query, bind_vars):
+            yield from page
+
+    def get_docs(self, coll_name, keys):
+        """Fetch the documents in a collection for a list of keys, as a dict of _key to doc."""
+        keys = list(keys)
+        docs = {}
+        for idx in range(0, len(keys), self.batch_size):
+            bind_vars = {'@coll': coll_name, 'keys': keys[idx:idx + self.batch_size]}
+            docs.update((doc['_key'], doc) for doc in self.query_iter(_GET_DOCS_QUERY, bind_vars))
+        return docs
+
+    def get_edges(self, coll_name, pairs):
+        """
+        Fetch the edges in a collection for a list of (_from, _to) pairs of
+        full IDs, as a dict of (_from, _to) to edge. If several edges join the
+        same pair, one of them is returned.
+        """
+        pairs = [list(pair) for pair in pairs]
+        edges = {}
+        for idx in range(0, len(pairs), self.batch_size):
+            bind_vars = {'@coll': coll_name, 'pairs': pairs[idx:idx + self.batch_size]}
+            edges.update(((e['_from'], e['_to']), e) for e in self.query_iter(_GET_EDGES_QUERY, bind_vars))
+        return edges
+
+    def check_doc_existence(self, _id):
+        """Check if a doc exists in RE already by full ID."""
+        (coll, key) = _id.split('/')
+        return self.query(_DOC_EXISTS_QUERY, {'@coll': coll, 'key': key})['count'] > 0
+
+    def _query_pages(self, query, bind_vars):
+        """Run an AQL query, yielding each page of results from the RE API's cursor."""
+        resp = self._query_request(params=None, data=json.dumps({'query': query, **bind_vars}))
+        while True:
+            result = resp.json()
+            yield result['results']
+            if not result.get('has_more'):
+                return
+            resp = self._query_request(params={'cursor_id': result['cursor_id']}, data=None)
+
+    def _query_request(self, params, data):
+        config = get_config()
+        with span('re.query'):
+            resp = _request(
+                'post',
+                config['re_api_url'] + '/api/v1/query_results',
+                params=params,
+                data=data,
+                headers={'Authorization': config['re_token']}
+            )
+        if not resp.ok:
+            raise RuntimeError(resp.text)
+        return resp
+
+
+@dataclass
+class AsyncREClient:
+    """
+    Asyncio interface to an REClient. Each request runs in an executor (the
+    event loop's default one, unless given), so many lookups and saves can be
+    in flight at once from a single coroutine using asyncio.gather.
+    """
+    client: REClient = field(default_factory=REClient)
+    executor: Optional[ThreadPoolExecutor] = field(default=None)
+
+    async def save(self, coll_name, docs, on_duplicate='update', spool=True):
+        return await self._run(self.client.save, coll_name, docs, on_duplicate, spool)
+
+    async def save_many(self, batches, spool=True):
+        results = await asyncio.gather(*[self.save(coll_name, docs, on_duplicate, spool)
+                                         for (coll_name, docs, on_duplicate) in batches])
+        return {coll_name: result for ((coll_name, _, _), result) in zip(batches, results)}
+
+    async def upsert_max(self, coll_name, docs, field, spool=True):
+        return await self._run(self.client.upsert_max, coll_name, docs, field, spool)
+
+    async def query(self, query, bind_vars):
+        return await self._run(self.client.query, query, bind_vars)
+
+    async def query_iter(self, query, bind_vars):
+        """Run an AQL query, yielding each result as the pages arrive."""
+        pages = self.client._query_pages(query, bind_vars)
+        while True:
+            page = await self._run(next, pages, None)
+            if page is None:
+                return
+            for result in page:
+                yield result
+
+    async def get_docs(self, coll_name, keys):
+        return await self._run(self.client.get_docs, coll_name, keys)
+
+    async def get_edges(self, coll_name, pairs):
+        return await self._run(self.client.get_edges, coll_name, pairs)
+
+    async def check_doc_existence(self, _id):
+        return await self._run(self.client.check_doc_existence, _id)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, bind(func), *args)
+
+
+# Client used by the module-level functions
+_CLIENT = REClient()
+
+
+def save(coll_name, docs, on_duplicate='update', spool=True):
     """
     Bulk-save documents to the relation engine database
     API docs: https://github.com/kbase/relation_engine_api
     Args:
         coll_name - collection name
-        docs - list of dicts to save into the collection as json documents
+        docs - list of dicts (or Edges) to save into the collection as json documents
+        on_duplicate - what to do when a document's _key already exists
+            ('update', 'replace', 'ignore', or 'error')
+        spool - if a spool is configured, documents are spooled while the RE
+            API is unavailable (see src/utils/spool.py) rather than raising an
+            REUnavailable error. In that case None is returned.
     """
-    url = _CONFIG['re_api_url'] + '/api/v1/documents'
-    # convert the docs into a string, where each obj is separated by a linebreak
-    payload = '\n'.join([json.dumps(d) for d in docs])
-    params = {'collection': coll_name, 'on_duplicate': 'update'}
-    resp = requests.put(
-        url,
-        data=payload,
-        params=params,
-        headers={'Authorization': _CONFIG['ws_token']}
-    )
+    return _CLIENT.save(coll_name, docs, on_duplicate, spool)
+
+
+def save_many(batches, spool=True):
+    """
+    Bulk-save documents to several collections at once.
+    Args:
+        batches - list of (collection name, docs, on_duplicate)
+        spool - spool the documents while RE is unavailable; see save()
+    Returns a dict of collection name to the import counts; see REClient.save_many.
+    """
+    return _CLIENT.save_many(batches, spool)
+
+
+def upsert_max(coll_name, docs, field, spool=True):
+    """
+    Bulk insert documents, or update existing documents with the same _key,
+    but only where the new document has a greater value for `field`. This
+    runs as a single server-side query, so concurrent or out-of-order writers
+    can never move a value backwards.
+    Args:
+        coll_name - collection name
+        docs - list of dicts to save, each with a '_key' and `field`
+        field - name of the field to compare
+        spool - spool the documents while RE is unavailable; see save()
+    """
+    return _CLIENT.upsert_max(coll_name, docs, field, spool)
+
+
+def _write(coll_name, op, lines, use_spool):
+    """
+    Save documents (JSON strings) with an on_duplicate mode or 'max-<field>'
+    operation, falling back to the spool while RE is unavailable.
+    """
+    spool = _get_spool(os.getpid()) if use_spool else None
+    if spool is not None and spool.pending(coll_name):
+        # Queue up behind the documents that are already spooled, to keep them in order
+        _append(spool, coll_name, op, lines)
+        return None
+    try:
+        return _send(coll_name, op, lines)
+    except UNAVAILABLE_ERRORS as err:
+        if spool is None:
+            raise
+        log('ERROR', f'{err}; spooling {len(lines)} documents for {coll_name}')
+        _append(spool, coll_name, op, lines)
+        return None
+
+
+def _append(spool, coll_name, op, lines):
+    """Append documents to the spool, raising REUnavailable if it is full so that the caller backs off."""
+    try:
+        spool.append(coll_name, op, lines)
+    except SpoolFull as err:
+        raise REUnavailable(f'Unable to save or spool documents for {coll_name}: {err}')
+
+
+def _send(coll_name, op, lines):
+    """
+    Save documents (JSON strings) with an on_duplicate mode or 'max-<field>'
+    operation, using the configured writer backend. The documents are sent in
+    requests of at most MAX_PAYLOAD_BYTES (see src/utils/payload.py), and the
+    import counts of all the requests are added together.
+    """
+    results = [_send_chunk(coll_name, op, chunk)
+               for chunk in split_payload(lines, get_config()['max_payload_bytes'])]
+    if len(results) == 1:
+        return results[0]
+    return _merge_results(results)
+
+
+def _merge_results(results):
+    """Combine the responses from several bulk saves, adding up the counts and concatenating any lists."""
+    if not all(isinstance(result, dict) for result in results):
+        # upsert_max query results
+        return [item for result in results for item in result]
+    merged = {}  # type: dict
+    for result in results:
+        for (key, val) in result.items():
+            if isinstance(val, (int, list)) and not isinstance(val, bool) and key in merged:
+                merged[key] += val
+            else:
+                merged[key] = val
+    return merged
+
+
+def _send_chunk(coll_name, op, lines):
+    config = get_config()
+    if op.startswith('max-'):
+        docs = [json.loads(line) for line in lines]
+        field = op[len('max-'):]
+        if config['writer_backend'] == 'arango':
+            with span('arango.upsert_max', coll=coll_name, docs=len(docs)):
+                return arango_client.query(_UPSERT_MAX_QUERY, {'@coll': coll_name, 'docs': docs, 'field': field})
+        return _upsert_max(coll_name, docs, field)
+    if config['writer_backend'] == 'arango':
+        with span('arango.import', coll=coll_name, docs=len(lines)):
+            result = arango_client.import_docs(coll_name, lines, on_duplicate=op)
+    else:
+        result = _put_documents(coll_name, lines, op)
+    _check_counts(coll_name, result)
+    return result
+
+
+def _check_counts(coll_name, result):
+    """
+    Raise an REBulkError if a bulk save response reports documents that could
+    not be saved. The import endpoint responds with a success status even when
+    some of the documents were rejected.
+    """
+    if result.get('errors'):
+        raise REBulkError(coll_name, result)
+
+
+def _put_documents(coll_name, lines, on_duplicate):
+    config = get_config()
+    url = config['re_api_url'] + '/api/v1/documents'
+    params = {'collection': coll_name, 'on_duplicate': on_duplicate}
+    with span('re.save', coll=coll_name, docs=len(lines)):
+        resp = _request(
+            'put',
+            url,
+            data='\n'.join(lines),
+            params=params,
+            headers={'Authorization': config['ws_token']}
+        )
+    if not resp.ok:
+        raise RuntimeError(f'Error response from RE API: {resp.text}')
+    return resp.json()
+
+
+def _upsert_max(coll_name, docs, field):
+    config = get_config()
+    with span('re.upsert_max', coll=coll_name, docs=len(docs)):
+        resp = _request(
+            'post',
+            config['re_api_url'] + '/api/v1/query_results',
+            data=json.dumps({
+                'query': _UPSERT_MAX_QUERY,
+                '@coll': coll_name,
+                'docs': docs,
+                'field': field
+            }),
+            headers={'Authorization': config['re_token']}
+        )
     if not resp.ok:
         raise RuntimeError(f'Error response from RE API: {resp.text}')
     return resp.json()
 
 
+def _request(method, url, **kwargs):
+    """Make a request, raising REUnavailable if the RE API is down or does not respond in time."""
+    try:
+        resp = get_session().request(method, url, timeout=get_config()['request_timeout'], **kwargs)
+    except (requests.ConnectionError, requests.Timeout) as err:
+        raise REUnavailable(f'Unable to reach the RE API: {err}')
+    if resp.status_code in _UNAVAILABLE_STATUSES:
+        raise REUnavailable(f'RE API unavailable ({resp.status_code}): {resp.text}')
+    return resp
+
+
+@functools.lru_cache(maxsize=1)
+def _get_spool(pid):
+    """
+    Open the spool and start its drainer thread, if a spool is configured.
+    This is keyed on the process ID so that each worker process starts its own drainer.
+    """
+    config = get_config()
+    if not config['spool_dir']:
+        return None
+    spool = Spool(config['spool_dir'], max_bytes=config['spool_max_bytes'])
+    spool.start_drainer(_send, UNAVAILABLE_ERRORS, config['spool_drain_interval'])
+    return spool
+
+
 def import_file(file_path, fd):
     """
     Import a file full of json documents, separated by linebreaks.
+    The collection name is taken from the file name, such as 'wsprov_object.json'.
     """
-    url = urljoin(_CONFIG['re_api_url'] + '/', 'api/v1/documents')
-    # convert the docs into a string, where each obj is separated by a linebreak
+    config = get_config()
     coll_name = os.path.basename(file_path).split('.')[0]
+    if config['writer_backend'] == 'arango':
+        result = arango_client.import_docs(coll_name, fd, on_duplicate='update')
+        _check_counts(coll_name, result)
+        return result
+    url = urljoin(config['re_api_url'] + '/', 'api/v1/documents')
     params = {'collection': coll_name, 'on_duplicate': 'update'}
-    resp = requests.put(
+    resp = get_session().put(
         url,
         data=fd,
         params=params,
-        headers={'Authorization': _CONFIG['token']}
+        headers={'Authorization': config['ws_token']},
+        timeout=config['request_timeout']
     )
     if not resp.ok:
         raise RuntimeError(f'Error response from RE API: {resp.text}')
+    result = resp.json()
+    _check_counts(coll_name, result)
+    return result
@@ -0,0 +1,140 @@
+"""
+Divide work between several supervisors (nodes), each running with the same
+NODE_COUNT and its own NODE_INDEX.
+
+Kafka partitions are already divided by the consumer group, so live events
+need no coordination beyond each node running its fair share of consumers
+(see the Autoscaler). Jobs that walk workspace IDs, such as backfills and
+reconciliation, instead take the workspaces where `wsid % node_count ==
+node_index`, so the same job can run on every node without duplicating work.
+
+When LEASE_DIR is set (a directory shared by every node, such as a network
+volume), a job also holds a lease file on each workspace while processing it,
+so that overlapping jobs skip workspaces another job is already working on.
+A lease is a file created with O_EXCL that its holder touches regularly; a
+lease that has not been touched within its TTL is treated as abandoned.
+"""
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+
+from src.utils.config import get_config
+from src.utils.logger import log
+
+
+def owns_workspace(wsid):
+    """Check whether a workspace ID is in this node's shard."""
+    config = get_config()
+    return wsid % config['node_count'] == config['node_index']
+
+
+def owns_partition(partition):
+    """Check whether a Kafka partition is in this node's shard, for jobs that assign partitions themselves."""
+    config = get_config()
+    return partition % config['node_count'] == config['node_index']
+
+
+def claim_workspaces(wsids):
+    """
+    Yield the workspace IDs from an iterable that this node should process:
+    those in its shard, whose lease it can acquire if leases are configured.
+    Each workspace's lease is held until the next workspace ID is requested.
+    """
+    lease_dir = get_config()['lease_dir']
+    for wsid in wsids:
+        if not owns_workspace(wsid):
+            continue
+        if not lease_dir:
+            yield wsid
+            continue
+        lease = Lease(os.path.join(lease_dir, f'ws-{wsid}.lease'), ttl=get_config()['lease_ttl'])
+        if not lease.acquire():
+            log('INFO', f'Skipping workspace {wsid}; it is leased by {lease.holder()}')
+            continue
+        try:
+            yield wsid
+        finally:
+            lease.release()
+
+
+@dataclass
+class Lease:
+    path: str  # path of the lease file, in a directory shared by everyone competing for the lease
+    ttl: float = field(default=600)  # seconds after the last renewal when the lease is considered abandoned
+    owner: str = field(default_factory=lambda: f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}')
+    released: threading.Event = field(init=False, default_factory=threading.Event)
+
+    def acquire(self):
+        """
+        Try to take the lease, taking over an abandoned one. If successful, a
+        daemon thread renews it until release() is called. Returns whether
+        the lease was acquired.
+        """
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._take_over():
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as lease_file:
+                lease_file.write(self.owner)
+            thread = threading.Thread(target=self._renew_forever, daemon=True)
+            thread.start()
+            return True
+        return False
+
+    def release(self):
+        """Stop renewing the lease, and remove it if we still hold it."""
+        self.released.set()
+        if self.holder() == self.owner:
+            _remove(self.path)
+
+    def holder(self):
+        """Get the owner of the lease, or None if it is not held."""
+        try:
+            with open(self.path) as fd:
+                return fd.read()
+        except FileNotFoundError:
+            return None
+
+    def _renew_forever(self):
+        while not self.released.wait(self.ttl / 4):
+            if self.holder() != self.owner:
+                log('ERROR', f'Lease {self.path} was taken over, or removed')
+                return
+            os.utime(self.path)
+
+    def _take_over(self):
+        """
+        Remove the lease if it has expired. Returns whether there may now be
+        a free lease to acquire.
+        """
+        try:
+            if time.time() - os.stat(self.path).st_mtime < self.ttl:
+                return False
+            # Move it aside first, so that we can tell if someone else took it over in the meantime
+            claimed = f'{self.path}.{self.owner}'
+            os.rename(self.path, claimed)
+        except FileNotFoundError:
+            return True
+        if time.time() - os.stat(claimed).st_mtime < self.ttl:
+            # We moved someone's fresh lease; put it back unless another lease was created since
+            try:
+                os.link(claimed, self.path)
+            except FileExistsError:
+                pass
+            _remove(claimed)
+            return False
+        log('INFO', f'Taking over expired lease {self.path}')
+        _remove(claimed)
+        return True
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
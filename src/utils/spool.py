@@ -0,0 +1,195 @@
+"""
+Local write-ahead spool for documents that could not be saved to RE.
+
+When the RE API is unavailable, documents are appended to the spool instead,
+so that consumers can keep handling events and committing offsets through an
+outage. A background thread replays spooled documents in bulk once the API
+recovers.
+
+The spool is a directory of append-only NDJSON segment files named
+'<collection>.<op>.<started>.<pid>.ndjson', where `op` is the on_duplicate
+mode the documents are saved with (or 'max-<field>' for re_client.upsert_max),
+and `started` is the time in ns that the segment was started. Segments from
+all processes are replayed in the order they were started. While a collection
+has any spooled documents, new documents for it must also be spooled (see
+`pending`), so that they are never saved out of order.
+
+A drainer claims a segment by renaming it with a '.draining' suffix, and then
+takes the segment's lock to wait for any writer that opened it just before it
+was renamed. Writers check that the segment they locked is still in place, and
+otherwise start a new one. Only one drainer on the host replays a collection
+at a time. Segments are replayed with their original `op`, so replaying part
+of a segment twice (eg. if a drainer dies part way through) is harmless.
+
+Appends raise SpoolFull while the spool is larger than its size limit, so
+that the caller can back off (such as by re-reading its events later) until
+the spool drains, without blocking.
+"""
+import fcntl
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+from src.utils.logger import log
+
+# Suffix of segments that have been claimed by a drainer
+_CLAIMED = '.draining'
+# Number of documents to replay in each request
+_REPLAY_BATCH = 5000
+
+
+class SpoolFull(RuntimeError):
+    """The spool is over its size limit, so no more documents can be appended until it drains."""
+
+
+@dataclass
+class Spool:
+    path: str  # spool directory
+    max_bytes: int  # appends raise SpoolFull while the spool is larger than this
+    segment_bytes: int = field(default=16 * 2 ** 20)  # start a new segment after this many bytes
+    # path of the current segment per (coll, op)
+    segments: Dict[Tuple[str, str], str] = field(init=False, default_factory=dict)
+
+    def __post_init__(self):
+        os.makedirs(os.path.join(self.path, 'locks'), exist_ok=True)
+        os.makedirs(os.path.join(self.path, 'failed'), exist_ok=True)
+
+    def pending(self, coll):
+        """Check whether a collection has any spooled documents."""
+        return any(True for _ in self._segments(coll))
+
+    def append(self, coll, op, docs):
+        """
+        Durably append documents (a list of JSON strings) for a collection.
+        Raises SpoolFull if the spool is over its size limit.
+        """
+        size = self.size()
+        if size > self.max_bytes:
+            raise SpoolFull(f'The spool is full ({size} of {self.max_bytes} bytes)')
+        data = ''.join(doc + '\n' for doc in docs).encode('utf-8')
+        while True:
+            flags = os.O_WRONLY | os.O_APPEND
+            seg = self.segments.get((coll, op))
+            if seg is None:
+                seg = os.path.join(self.path, f'{coll}.{op}.{time.time_ns():020d}.{os.getpid()}.ndjson')
+                self.segments[(coll, op)] = seg
+                flags |= os.O_CREAT
+            try:
+                fd = os.open(seg, flags, 0o644)
+            except FileNotFoundError:
+                # A drainer claimed the segment; a new one must sort after everything spooled since
+                del self.segments[(coll, op)]
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if not _same_file(fd, seg):
+                    # A drainer claimed the segment after we opened it
+                    del self.segments[(coll, op)]
+                    continue
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                os.fsync(fd)
+                size = os.fstat(fd).st_size
+            finally:
+                # This also releases the lock
+                os.close(fd)
+            if size >= self.segment_bytes:
+                del self.segments[(coll, op)]
+            return
+
+    def drain(self, send, retry_errors=()):
+        """
+        Replay all spooled documents with `send(coll, op, docs)`, where `docs`
+        is a list of JSON strings. If `send` raises one of `retry_errors`, we
+        stop and leave the rest for the next call. A segment for which `send`
+        raises any other error is moved to the 'failed' subdirectory.
+        """
+        colls = sorted({name.split('.')[0] for name in self._segments()})
+        for coll in colls:
+            lock_fd = os.open(os.path.join(self.path, 'locks', coll + '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Another process is draining this collection
+                    continue
+                for name in sorted(self._segments(coll), key=_start_order):
+                    seg = os.path.join(self.path, name)
+                    if not name.endswith(_CLAIMED):
+                        os.rename(seg, seg + _CLAIMED)
+                        seg += _CLAIMED
+                    try:
+                        count = _replay(seg, coll, name.split('.')[1], send)
+                    except retry_errors:
+                        raise
+                    except Exception as err:
+                        log('ERROR', f'Unable to replay spooled documents in {seg}: {err}')
+                        os.rename(seg, os.path.join(self.path, 'failed', os.path.basename(seg)))
+                        continue
+                    os.remove(seg)
+                    log('INFO', f'Replayed {count} spooled documents for {coll}')
+            finally:
+                os.close(lock_fd)
+
+    def start_drainer(self, send, retry_errors, interval):
+        """Start a daemon thread that drains the spool every `interval` seconds."""
+        def drain_forever():
+            while True:
+                try:
+                    self.drain(send, retry_errors)
+                except retry_errors as err:
+                    log('INFO', f'Unable to replay spooled documents yet: {err}')
+                except Exception as err:
+                    log('ERROR', f'Error draining the spool: {err}')
+                time.sleep(interval)
+        thread = threading.Thread(target=drain_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def _segments(self, coll=None):
+        """Get the file names of spooled segments, optionally for a single collection."""
+        prefix = (coll + '.') if coll else ''
+        return (name for name in os.listdir(self.path) if name.startswith(prefix) and '.ndjson' in name)
+
+    def size(self):
+        """Get the total size in bytes of the spooled segments."""
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in self._segments())
+
+
+def _replay(seg, coll, op, send):
+    """Send all the documents in a claimed segment. Returns the number of documents."""
+    count = 0
+    with open(seg, 'rb') as fd:
+        # Wait for any writer that opened the segment before it was claimed
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        docs = []
+        for line in fd:
+            if not line.endswith(b'\n'):
+                # Torn write from a process that died mid-append; it was never acknowledged
+                break
+            docs.append(line[:-1].decode('utf-8'))
+            if len(docs) >= _REPLAY_BATCH:
+                send(coll, op, docs)
+                count += len(docs)
+                docs = []
+        if docs:
+            send(coll, op, docs)
+            count += len(docs)
+    return count
+
+
+def _start_order(name):
+    """Sort key for segment file names, by the time each segment was started and then by process."""
+    (started, pid) = name.split('.')[2:4]
+    return (int(started), int(pid))
+
+
+def _same_file(fd, path):
+    """Check whether an open file descriptor still refers to the file at `path`."""
+    try:
+        return os.fstat(fd).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
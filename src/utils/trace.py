@@ -0,0 +1,164 @@
+"""
+Opt-in timing instrumentation for finding hot spots in production.
+
+Each batch of events handled by a consumer is wrapped in `collect()`, which
+decides whether to sample the batch. Within a sampled batch, each event gets
+its own trace ID (see `event()`), and every `span()` (such as each workspace
+and RE request, and each `_save_*` step of an import) is recorded along with
+the trace ID of the event it belongs to. Work handed to other threads must be
+wrapped with `bind()` to be recorded. When the batch is done, its spans are
+appended to a per-process file in the Chrome Trace Event format, which can be
+opened in chrome://tracing or https://ui.perfetto.dev. When a batch is not
+sampled, a span costs a single attribute lookup.
+
+Separately, sending SIGUSR1 to a worker starts a cProfile profile, and sending
+it again writes the profile's stats to a file (see `toggle_profile`).
+"""
+import cProfile
+import functools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from src.utils.config import get_config
+from src.utils.logger import log
+
+# Per-thread tracing state. `events` is a list of recorded spans while a
+# sampled batch is being collected, and None otherwise.
+_STATE = threading.local()
+
+# The profile started by SIGUSR1, if any
+_PROFILE = None
+
+
+@contextmanager
+def collect(trace_dir=None, sample_rate=None):
+    """
+    Record the spans within this block, if it is sampled, and append them to
+    the trace file on exit. Both arguments default to the config values.
+    """
+    if trace_dir is None:
+        trace_dir = get_config()['trace_dir']
+    if sample_rate is None:
+        sample_rate = get_config()['trace_sample_rate']
+    if not trace_dir or random.random() >= sample_rate:
+        yield
+        return
+    _STATE.events = []
+    _STATE.trace_id = None
+    try:
+        yield
+    finally:
+        (events, _STATE.events) = (_STATE.events, None)
+        _write(trace_dir, events)
+
+
+@contextmanager
+def event(msg):
+    """Give the handling of an event its own trace ID, and time it as a span."""
+    if getattr(_STATE, 'events', None) is None:
+        yield
+        return
+    _STATE.trace_id = uuid.uuid4().hex[:16]
+    try:
+        with span('event', evtype=msg.get('evtype'), wsid=msg.get('wsid'), objid=msg.get('objid')):
+            yield
+    finally:
+        _STATE.trace_id = None
+
+
+@contextmanager
+def span(name, **args):
+    """Time this block as a span of the current trace, if we are sampling."""
+    events = getattr(_STATE, 'events', None)
+    if events is None:
+        yield
+        return
+    start_ts = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _STATE.trace_id:
+            args['trace_id'] = _STATE.trace_id
+        events.append({
+            'name': name,
+            'ph': 'X',  # a "complete" event, with a duration
+            'ts': int(start_ts * 1e6),
+            'dur': int((time.perf_counter() - start) * 1e6),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args
+        })
+
+
+def bind(func):
+    """
+    Wrap a function so that the spans it records are added to the calling
+    thread's trace, for running it in another thread (such as on an executor).
+    """
+    events = getattr(_STATE, 'events', None)
+    if events is None:
+        return func
+    trace_id = _STATE.trace_id
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        saved = (getattr(_STATE, 'events', None), getattr(_STATE, 'trace_id', None))
+        (_STATE.events, _STATE.trace_id) = (events, trace_id)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            (_STATE.events, _STATE.trace_id) = saved
+    return wrapper
+
+
+def traced(func):
+    """Decorator to time every call of a function as a span."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def toggle_profile(signum=None, frame=None):
+    """
+    Signal handler that starts profiling the main thread, or, if we are already
+    profiling, stops and writes the stats to a file (readable with pstats or
+    snakeviz) in the 'profile_dir' config directory.
+    """
+    global _PROFILE
+    if _PROFILE is None:
+        log('INFO', 'Starting profiler..')
+        _PROFILE = cProfile.Profile()
+        _PROFILE.enable()
+        return
+    (profile, _PROFILE) = (_PROFILE, None)
+    profile.disable()
+    profile_dir = get_config()['profile_dir'] or tempfile.gettempdir()
+    path = os.path.join(profile_dir, f'profile-{os.getpid()}-{int(time.time())}.prof')
+    profile.dump_stats(path)
+    log('INFO', f'Wrote profile to {path}')
+
+
+def _write(trace_dir, events):
+    """
+    Append spans to this process's trace file. The Trace Event format allows
+    the JSON array to be left unterminated, so we can keep appending to it.
+    """
+    if not events:
+        return
+    path = os.path.join(trace_dir, f'trace-{os.getpid()}.json')
+    try:
+        with open(path, 'a') as fd:
+            if fd.tell() == 0:
+                fd.write('[\n')
+            fd.write(''.join(json.dumps(ev) + ',\n' for ev in events))
+    except OSError as err:
+        log('ERROR', f'Unable to write trace file {path}: {err}')
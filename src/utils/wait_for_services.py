@@ -1,24 +1,27 @@
 import time
-import requests
 
 from src.utils.config import get_config
+from src.utils.http import get_session
 from src.utils.logger import log
 
-_CONFIG = get_config()
 
-
-def wait_for_services():
-    """Wait for dependency services such as the RE API."""
-    timeout = int(time.time()) + 60
+def wait_for_services(timeout=60):
+    """
+    Wait for dependency services such as the RE API, checking again with
+    exponential backoff (from 0.1s up to 5s) so that we start as soon as they are up.
+    """
+    deadline = time.time() + timeout
+    delay = 0.1
     while True:
         try:
-            requests.get(_CONFIG['re_api_url'] + '/').raise_for_status()
+            get_session().get(get_config()['re_api_url'] + '/', timeout=5).raise_for_status()
             break
         except Exception as err:
             log('INFO', f'Service not yet online: {err}')
-            if int(time.time()) >= timeout:
+            if time.time() + delay > deadline:
                 raise RuntimeError("Timed out waiting for other services to come online.")
-            time.sleep(3)
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
     log('INFO', 'Services started!')
 
 
@@ -0,0 +1,48 @@
+"""
+Per-workspace high-water marks for incremental backfills.
+
+A watermark records the greatest object ID and the latest save date seen in a
+workspace by the last complete backfill, so that later runs only need to list
+newer objects and versions (see generate_workspace_objs). Watermarks are kept
+in a local SQLite database.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from src.utils.formatting import ts_to_epoch
+from src.utils.local_store import connect
+
+
+@dataclass
+class Watermark:
+    max_objid: int = field(default=0)  # greatest object ID seen
+    max_epoch: int = field(default=0)  # latest save date seen, as a ms epoch (see ts_to_epoch)
+
+    def advance(self, obj_info):
+        """Move the watermark past an ObjectInfo tuple, if it is newer."""
+        self.max_objid = max(self.max_objid, obj_info.objid)
+        self.max_epoch = max(self.max_epoch, ts_to_epoch(obj_info.save_date))
+
+
+@dataclass
+class WatermarkStore:
+    path: str  # path of the SQLite database
+    conn: Any = field(init=False)
+
+    def __post_init__(self):
+        self.conn = connect(self.path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS watermarks (wsid INTEGER PRIMARY KEY, max_objid INTEGER, max_epoch INTEGER)'
+        )
+
+    def get(self, wsid) -> Optional[Watermark]:
+        """Get the watermark for a workspace, or None if it has never been backfilled."""
+        row = self.conn.execute('SELECT max_objid, max_epoch FROM watermarks WHERE wsid = ?', (wsid,)).fetchone()
+        return Watermark(*row) if row else None
+
+    def set(self, wsid, watermark):
+        """Record the watermark for a workspace after a complete backfill."""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO watermarks (wsid, max_objid, max_epoch) VALUES (?, ?, ?)',
+            (wsid, watermark.max_objid, watermark.max_epoch)
+        )
@@ -1,41 +1,140 @@
 """
 Small manager of a group of processes.
+
+Workers are started from a forkserver: a small process that imports the
+preloaded modules once, and then forks a new worker for each request. Starting
+or restarting a worker therefore takes milliseconds, without re-importing
+anything, and without inheriting the supervisor's threads or connections.
 """
+import multiprocessing
+import os
+import time
 from dataclasses import dataclass, field
-from typing import List, Tuple, Callable
+from typing import Any, List, Tuple, Callable, Optional
 from multiprocessing import Process
 
 from src.utils.logger import log
 
 
+@dataclass
+class _Worker:
+    proc: Optional[Process] = field(default=None)
+    crashes: List[float] = field(default_factory=list)  # timestamps of recent crashes
+    restart_at: float = field(default=0)  # earliest time we can restart a crashed worker
+
+
 @dataclass
 class WorkerGroup:
     target: Callable  # function to run in each thread
-    args: Tuple  # arguments for the above function
+    args: Tuple  # arguments for the above function; the worker's index is passed as an extra final argument
     count: int = field(default=1)  # how many threads to run
-    workers: List[Process] = field(init=False)
+    backoff_max: float = field(default=60)  # max seconds to wait before restarting a crashed worker
+    crash_loop_count: int = field(default=5)  # number of crashes within crash_loop_window that counts as a loop
+    crash_loop_window: float = field(default=300)  # seconds
+    context: Any = field(default=None)  # multiprocessing context; defaults to get_context()
+    workers: List[_Worker] = field(init=False)
 
     def __post_init__(self):
         """Start the threads."""
-        self.workers = [_create_proc(self.target, self.args) for _ in range(self.count)]
+        if self.context is None:
+            self.context = get_context()
+        self.workers = [_Worker(self._start(idx)) for idx in range(self.count)]
 
     def health_check(self):
-        """Find any dead workers and restart them."""
-        for (idx, proc) in enumerate(self.workers):
-            if not proc.is_alive():
-                log('ERROR', f"Worker {proc} died, restarting..")
-                self.workers[idx] = _create_proc(self.target, self.args)
+        """
+        Find any dead workers and restart them, with exponential backoff.
+        Raises a RuntimeError if a worker is stuck in a crash loop.
+        """
+        now = time.time()
+        for (idx, worker) in enumerate(self.workers):
+            if worker.proc is not None:
+                if worker.proc.is_alive():
+                    continue
+                log('ERROR', f"Worker {worker.proc} died with exit code {worker.proc.exitcode}")
+                worker.proc = None
+                worker.crashes = [t for t in worker.crashes if now - t < self.crash_loop_window] + [now]
+                if len(worker.crashes) >= self.crash_loop_count:
+                    raise RuntimeError(f"Worker crashed {len(worker.crashes)} times in the last "
+                                       f"{self.crash_loop_window}s; giving up.")
+                delay = min(2 ** (len(worker.crashes) - 1), self.backoff_max)
+                worker.restart_at = now + delay
+                log('INFO', f"Restarting worker in {delay}s..")
+            if now >= worker.restart_at:
+                worker.proc = self._start(idx)
+
+    def scale(self, count):
+        """Start or stop workers so that `count` are running."""
+        if count == self.count:
+            return
+        log('INFO', f"Scaling workers from {self.count} to {count}")
+        while len(self.workers) < count:
+            self.workers.append(_Worker(self._start(len(self.workers))))
+        while len(self.workers) > count:
+            worker = self.workers.pop()
+            if worker.proc is not None:
+                worker.proc.terminate()
+        self.count = count
+
+    def stop(self, timeout):
+        """
+        Ask all workers to shut down with a SIGTERM, waiting up to `timeout`
+        seconds for them to exit before killing any that remain.
+        """
+        self.terminate()
+        self.join(time.time() + timeout)
+
+    def terminate(self):
+        """Ask all workers to shut down with a SIGTERM, without waiting."""
+        for worker in self.workers:
+            if worker.proc is not None:
+                worker.proc.terminate()
+
+    def join(self, deadline):
+        """Wait until the `deadline` timestamp for all workers to exit, and kill any that remain."""
+        for worker in self.workers:
+            proc = worker.proc
+            if proc is None:
+                continue
+            proc.join(max(deadline - time.time(), 0))
+            if proc.is_alive():
+                log('ERROR', f"Worker {proc} did not exit in time; killing it.")
+                proc.kill()
+
+    def send_signal(self, signum):
+        """Send a signal to all running workers."""
+        for worker in self.workers:
+            if worker.proc is not None and worker.proc.is_alive():
+                os.kill(worker.proc.pid, signum)
 
     def kill(self):
         """Kill all workers."""
-        for proc in self.workers:
-            proc.kill()
+        for worker in self.workers:
+            if worker.proc is not None:
+                worker.proc.kill()
+
+    def _start(self, idx):
+        """Start the worker process for a given index."""
+        return _create_proc(self.context, self.target, self.args + (idx,))
+
+
+def get_context(preload=()):
+    """
+    Get the multiprocessing context that workers are started with, where
+    `preload` is a list of module names for the forkserver to import up front.
+    Anything shared with workers, such as a multiprocessing.Event, must be
+    created from this context.
+    """
+    context = multiprocessing.get_context('forkserver')
+    if preload:
+        # Only has an effect if the forkserver has not started yet
+        context.set_forkserver_preload(list(preload))
+    return context
 
 
 # -- Utilities
 
-def _create_proc(func, args):
+def _create_proc(context, func, args):
     """Create and start a new process from a function and arguments."""
-    proc = Process(target=func, args=args, daemon=True)
+    proc = context.Process(target=func, args=args, daemon=True)
     proc.start()
     return proc
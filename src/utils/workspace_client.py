@@ -2,11 +2,19 @@
 Make API requests to the kbase workspace JSON RPC server.
 """
 import json
-import requests
 
 from src.utils.config import get_config
+from src.utils.http import get_session
+from src.utils.logger import log
+from src.utils.trace import span
 
-_CONFIG = get_config()
+# Parts of workspace error messages for objects that are deleted, do not exist, or cannot be read
+_INACCESSIBLE_MESSAGES = ('has been deleted', 'is deleted', 'does not exist', 'No object with', 'may not read',
+                          'inaccessible')
+
+
+class ObjectInaccessible(RuntimeError):
+    """The workspace reported that an object is deleted, does not exist, or cannot be read."""
 
 
 def download_info(wsid, objid, ver=None):
@@ -21,13 +29,45 @@ def download_info(wsid, objid, ver=None):
     return result['data'][0]
 
 
+def download_infos(wsid, objid, vers):
+    """
+    Download object info for several versions of an object in a single request.
+    A version of None fetches the latest version.
+    If the request fails, such as because one of the versions is deleted or
+    inaccessible, each version is fetched on its own. Versions that the
+    workspace reports as deleted or inaccessible are logged and skipped, and
+    any other error is raised. Raises an error if none of them can be fetched.
+    """
+    refs = ['/'.join([str(n) for n in [wsid, objid, ver] if n]) for ver in vers]
+    try:
+        result = admin_req('getObjects', {
+            'objects': [{'ref': ref} for ref in refs],
+            'no_data': 1
+        })
+        return result['data']
+    except RuntimeError:
+        if len(refs) == 1:
+            raise
+        log('ERROR', f'Unable to fetch {refs} together; fetching them one at a time')
+    infos = []
+    for ref in refs:
+        try:
+            infos.extend(admin_req('getObjects', {'objects': [{'ref': ref}], 'no_data': 1})['data'])
+        except ObjectInaccessible as err:
+            log('ERROR', f'Skipping {ref}: {err}')
+    if not infos:
+        raise RuntimeError(f'Unable to fetch any of {refs}')
+    return infos
+
+
 def req(method, params):
     """
     Make a JSON RPC request to the workspace server.
     KIDL docs: https://kbase.us/services/ws/docs/Workspace.html
     """
     payload = {'version': '1.1', 'method': method, 'params': [params]}
-    return _post_req(payload)
+    with span('ws.' + method):
+        return _post_req(payload)
 
 
 def admin_req(method, params):
@@ -40,18 +80,27 @@ def admin_req(method, params):
         'method': 'Workspace.administer',
         'params': [{'command': method, 'params': params}]
     }
-    return _post_req(payload)
+    with span('ws.' + method):
+        return _post_req(payload)
 
 
 def _post_req(payload):
     """Make a post request to the workspace server and process the response."""
-    headers = {'Authorization': _CONFIG['ws_token']}
-    resp = requests.post(_CONFIG['ws_url'], data=json.dumps(payload), headers=headers)
+    config = get_config()
+    headers = {'Authorization': config['ws_token']}
+    resp = get_session().post(config['ws_url'], data=json.dumps(payload), headers=headers,
+                              timeout=config['request_timeout'])
+    try:
+        resp_json = resp.json()
+    except ValueError:
+        # Such as an error page from a proxy
+        resp_json = {}
+    if resp_json.get('error'):
+        message = str(resp_json['error'].get('message') if isinstance(resp_json['error'], dict) else resp_json['error'])
+        err_class = ObjectInaccessible if any(m in message for m in _INACCESSIBLE_MESSAGES) else RuntimeError
+        raise err_class('Error response from workspace:\n%s' % resp.text)
     if not resp.ok:
         raise RuntimeError('Error response from workspace:\n%s' % resp.text)
-    resp_json = resp.json()
-    if 'error' in resp_json:
-        raise RuntimeError('Error response from workspace:\n%s' % resp.text)
     elif 'result' not in resp_json or not len(resp_json['result']):
         raise RuntimeError('Invalid workspace response:\n%s' % resp.text)
     return resp_json['result'][0]
@@ -0,0 +1,79 @@
+"""
+Cache of workspace_info tuples, shared by all the worker processes on a host.
+
+Workspace info (owner, global permission, narrative name, etc) is needed for
+every object in a workspace, so we cache it in a local SQLite database with a
+TTL rather than calling getWorkspaceInfo once per event per process. Entries
+are invalidated explicitly when we receive events that change them.
+"""
+import functools
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from src.utils.config import get_config
+from src.utils.local_store import connect
+from src.utils.logger import log
+from src.utils import workspace_client
+
+
+@dataclass
+class WorkspaceInfoCache:
+    path: str  # path of the SQLite database, or ':memory:' for a cache private to this process
+    ttl: float  # seconds before an entry is re-fetched
+    fetch: Callable  # function that takes a workspace ID and returns its workspace_info tuple
+    conn: Any = field(init=False)
+
+    def __post_init__(self):
+        self.conn = connect(self.path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS ws_info (wsid INTEGER PRIMARY KEY, info TEXT, fetched_at REAL)'
+        )
+
+    def get(self, wsid):
+        """Get the workspace_info tuple for a workspace ID, fetching it if missing or expired."""
+        row = self.conn.execute('SELECT info, fetched_at FROM ws_info WHERE wsid = ?', (wsid,)).fetchone()
+        now = time.time()
+        if row and now - row[1] < self.ttl:
+            return json.loads(row[0])
+        info = self.fetch(wsid)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO ws_info (wsid, info, fetched_at) VALUES (?, ?, ?)',
+            (wsid, json.dumps(info), now)
+        )
+        return info
+
+    def invalidate(self, wsid):
+        """Remove a workspace from the cache so that it is re-fetched on the next lookup."""
+        self.conn.execute('DELETE FROM ws_info WHERE wsid = ?', (wsid,))
+
+
+def get_workspace_info(wsid):
+    """Get the workspace_info tuple for a workspace ID using this host's shared cache."""
+    return _get_cache(os.getpid()).get(wsid)
+
+
+def invalidate_workspace_info(wsid):
+    """Invalidate the cached workspace_info for a workspace ID."""
+    log('INFO', f'Invalidating cached workspace info for {wsid}')
+    _get_cache(os.getpid()).invalidate(wsid)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_cache(pid):
+    """
+    Open the cache. This is keyed on the process ID so that a forked worker
+    process never reuses a database connection opened by its parent.
+    """
+    config = get_config()
+    return WorkspaceInfoCache(
+        path=config['ws_info_cache_path'] or ':memory:',
+        ttl=config['ws_info_cache_ttl'],
+        fetch=_fetch_workspace_info
+    )
+
+
+def _fetch_workspace_info(wsid):
+    return workspace_client.admin_req('getWorkspaceInfo', {'id': wsid})